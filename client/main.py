@@ -24,6 +24,28 @@ SERVER_PING_INTERVAL_SECONDS = 5
 FAST_THRESHOLD_MS = 100
 SLOW_THRESHOLD_MS = 500
 SERVER_URL = "http://127.0.0.1:8000"  # Base URL for the server
+JOB_POLL_SECONDS = 10  # Long-polling interval while an analysis job runs
+
+
+def print_plot_urls(plot_urls):
+    if len(plot_urls) == 1:
+        console.print("[green]Your plot is ready. Please open this URL in your browser:[/green]")
+    else:
+        console.print(f"[green]Your {len(plot_urls)} plots are ready. Please open these URLs in your browser:[/green]")
+    for plot_url in plot_urls:
+        console.print(f"[bold blue]{plot_url}[/bold blue]")
+
+
+def print_execution_notes(server_response):
+    if server_response.get("cache_hit"):
+        console.print("[dim]Answered from the prompt cache, without asking the LLM.[/dim]")
+    if server_response.get("execution_mode") == "chunked":
+        console.print("[dim]The frame was too large for the sandbox and was processed in row chunks.[/dim]")
+    optimizations = server_response.get("optimizations") or {"rewrites": [], "warnings": []}
+    for rewrite in optimizations["rewrites"]:
+        console.print(f"[dim]Optimized line {rewrite['line']}: {rewrite['original']} -> {rewrite['rewritten']}[/dim]")
+    for warning in optimizations["warnings"]:
+        console.print(f"[dim yellow]Slow pattern on line {warning['line']}: {warning['message']}[/dim yellow]")
 
 
 def print_generated_code_header():
@@ -207,6 +229,28 @@ def display_help():
     console.print(help_message)
 
 
+async def wait_for_job(job_id):
+    """Polls an analysis job until it finishes and returns its /command response."""
+    try:
+        with console.status("[cyan]Analyzing...[/cyan]"):
+            while True:
+                response = await asyncio.to_thread(
+                    httpx.get, f"{SERVER_URL}/jobs/{job_id}", params={"wait": JOB_POLL_SECONDS},
+                    timeout=JOB_POLL_SECONDS + 5,
+                )
+                response.raise_for_status()
+                job = response.json()
+                if job["status"] == "succeeded":
+                    return job["result"]
+                if job["status"] == "failed":
+                    return {"error": job["error"]}
+                if job["status"] == "cancelled":
+                    return {"error": "Analysis cancelled"}
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        await asyncio.to_thread(httpx.post, f"{SERVER_URL}/jobs/{job_id}/cancel")
+        raise
+
+
 async def main_loop():
     global server_status_color, client_logging_enabled
     # Start the server status updater as a background task
@@ -226,9 +270,14 @@ async def main_loop():
                 display_help()
                 continue
 
-            response = await asyncio.to_thread(httpx.post, f"{SERVER_URL}/command", json={"prompt": user_input})
+            response = await asyncio.to_thread(
+                httpx.post, f"{SERVER_URL}/command", json={"prompt": user_input, "async": True}
+            )
             response.raise_for_status()
             server_response = response.json()
+            if "job_id" in server_response:
+                # Analyses run as server-side jobs; Ctrl+C cancels the job and kills its sandbox
+                server_response = await wait_for_job(server_response["job_id"])
 
             if "command" in server_response and server_response["command"] == "client_command":
                 if client_logging_enabled:
@@ -257,22 +306,20 @@ async def main_loop():
             elif "plot_url" in server_response and "formatted_code" in server_response:
                 if client_logging_enabled:
                     logging.info(f"Server response: {server_response}")
-                plot_url = server_response.get("plot_url")
+                plot_urls = server_response.get("plot_urls") or [server_response.get("plot_url")]
                 code_content = server_response.get("code")  # Get raw code
                 formatted_code_content = server_response.get("formatted_code")
                 last_generated_code = code_content  # Store raw code
-                console.print("[green]Your plot is ready. Please open this URL in your browser:[/green]")
-                console.print(f"[bold blue]{plot_url}[/bold blue]")
+                print_plot_urls(plot_urls)
                 print_generated_code_header()
                 syntax = Syntax(code_content, "python", theme="monokai", line_numbers=True)
                 console.print(syntax)
+                print_execution_notes(server_response)
             elif "plot_url" in server_response:
                 if client_logging_enabled:
                     logging.info(f"Server response: {server_response}")
                 # TODO: remove duplicate block
-                plot_url = server_response.get("plot_url")
-                console.print("[green]Your plot is ready. Please open this URL in your browser:[/green]")
-                console.print(f"[bold blue]{plot_url}[/bold blue]")
+                print_plot_urls(server_response.get("plot_urls") or [server_response.get("plot_url")])
             elif "download_url" in server_response:
                 if client_logging_enabled:
                     logging.info(f"Server response: {server_response}")
@@ -306,8 +353,15 @@ async def main_loop():
                     last_generated_code = code_content  # Store raw code
                     console.print("\n[yellow]Generated Code:[/yellow]")
                     console.print(server_response["code"])
+                print_execution_notes(server_response)
                 console.print(f"\n[cyan]Result:[/cyan]")  # Added a header for result
                 console.print(f"[cyan]{server_response['result']}[/cyan]")
+                if "result_id" in server_response:
+                    rows, cols = (server_response["shape"] + [1])[:2]
+                    console.print(
+                        f"[dim]Preview of a {rows} x {cols} result. More rows: "
+                        f"{SERVER_URL}/results/{server_response['result_id']}?offset=0&limit=100[/dim]"
+                    )
             else:
                 if client_logging_enabled:
                     logging.info(f"Server response: {server_response}")
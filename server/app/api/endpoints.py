@@ -5,7 +5,10 @@ from ..services.session_service import session_service
 from ..services.milvus_service import milvus_service
 from ..services.logging_service import logging_service
 from ..services.storage_service import storage_service
+from ..services.job_service import FINISHED
+from ..services.prompt_cache import schema_fingerprint
 import pandas as pd
+import asyncio
 import io
 import os
 
@@ -22,8 +25,16 @@ def handle_command(payload: dict = Body(...)):
     llm_service = router.llm_service
     code_execution_service = router.code_execution_service
 
-    # 1. Classify the command
-    classified_command = llm_service.classify_and_extract_command(user_prompt)
+    # 1. Classify the command: trivial commands locally, and an analysis asked before on the same schemas
+    #    skips the LLM altogether. Only prompts that may be analyses are looked up in the prompt cache
+    classified_command = llm_service.classify_locally(user_prompt)
+    cached = None
+    if classified_command is None or classified_command.get("command") == "analyze":
+        cached = llm_service.cached_analysis(user_prompt)
+    if cached is not None:
+        classified_command = {"command": "analyze", "args": cached["args"]}
+    elif classified_command is None:
+        classified_command = llm_service.classify_and_extract_command(user_prompt, local=False)
     command = classified_command.get("command")
     args = classified_command.get("args", {})
 
@@ -105,7 +116,8 @@ def handle_command(payload: dict = Body(...)):
             "milvus": milvus_service,
             "code_execution": code_execution_service,
             "session": session_service,
-            "storage": storage_service
+            "storage": storage_service,
+            "jobs": router.job_service,
         }
         if service_name == "all":
             health_status = {}
@@ -118,6 +130,11 @@ def handle_command(payload: dict = Body(...)):
         else:
             return {"error": f"Unknown service: {service_name}"}
 
+    elif command == "storage":
+        if args.get("action") == "compact":
+            return {"message": storage_service.compact()}
+        return {"message": storage_service.usage()}
+
     elif command == "client_command":
         return classified_command
 
@@ -126,24 +143,102 @@ def handle_command(payload: dict = Body(...)):
             return {"error": "No dataframes loaded. Please upload a dataframe first."}
         
         analysis_prompt = args.get("prompt", user_prompt)
-        llm_response = llm_service.generate_code(analysis_prompt)
-
-        if llm_response["code"]:
-            result = code_execution_service.execute(llm_response["code"], dataframe_service, llm_response.get("df_name"))
-            milvus_service.add_conversation_turn(analysis_prompt, llm_response["code"], str(result))
-            # Check if the result is a dictionary containing a plot_url
-            if isinstance(result, dict) and "plot_url" in result:
-                return {"plot_url": result["plot_url"], "code": llm_response["code"], "formatted_code": llm_response["formatted_code"]}
-            else:
-                return {"result": str(result), "code": llm_response["code"], "formatted_code": llm_response["formatted_code"]}
-        else:
-            milvus_service.add_conversation_turn(analysis_prompt, "", llm_response["message"])
-            return {"message": llm_response["message"], "formatted_code": llm_response["formatted_code"]}
+        if payload.get("async"):
+            # Answered right away; the client polls GET /jobs/{job_id} for the result
+            job = router.job_service.submit(
+                lambda cancelled: run_analysis(analysis_prompt, cancelled, user_prompt, cached), analysis_prompt
+            )
+            return {"job_id": job["id"], "status": job["status"]}
+        return run_analysis(analysis_prompt, user_prompt=user_prompt, cached=cached)
 
     else:
         return {"error": "Unknown command"}, 400
 
 
+def run_analysis(analysis_prompt, cancelled=None, user_prompt=None, cached=None):
+    """
+    Generates code for an analysis prompt, runs it and returns the /command response.
+    With `cached` (see LLMService.cached_analysis) the cached code is run instead of generating it;
+    otherwise code that runs successfully is cached under `user_prompt`.
+    """
+    llm_service = router.llm_service
+    code_execution_service = router.code_execution_service
+    with dataframe_service.lock:
+        schema = schema_fingerprint(dataframe_service.get_all_dataframes())  # Before the code changes any frame
+    llm_response = cached["llm_response"] if cached is not None else llm_service.generate_code(analysis_prompt)
+
+    if llm_response["code"]:
+        if cancelled is not None and cancelled.is_set():
+            return {"error": "Cancelled"}
+        # Jobs run their code concurrently, each on its own snapshot of the workspace (which is not thread-safe);
+        # execute only takes the workspace lock again to commit the frames the code changed
+        frames = dataframe_service.snapshot()
+        code, optimization = code_execution_service.optimize(llm_response["code"], list(frames))
+        # Frames too large for the sandbox are streamed to it in row chunks when the code allows it
+        chunked = code_execution_service.chunk_plan(code, frames, llm_response.get("df_name"))
+        result = code_execution_service.execute(
+            code, dataframe_service, llm_response.get("df_name"), cancelled, chunked=chunked, frames=frames
+        )
+        is_preview = isinstance(result, dict) and "result_id" in result
+        if cached is None and user_prompt and not (isinstance(result, str) and result.startswith("Error executing code")):
+            llm_service.remember_analysis(user_prompt, schema, {"prompt": analysis_prompt}, llm_response)
+        milvus_service.add_conversation_turn(analysis_prompt, llm_response["code"], str(result["result"] if is_preview else result))
+        response = {
+            "code": llm_response["code"],
+            "formatted_code": llm_response["formatted_code"],
+            "execution_mode": "chunked" if chunked else "in_memory",
+            "cache_hit": cached is not None,
+        }
+        if optimization and (optimization["rewrites"] or optimization["warnings"]):
+            # What the optimizer rewrote (the code that actually ran) and the slow patterns it left alone
+            response["optimizations"] = optimization
+            if optimization["rewrites"]:
+                response["optimized_code"] = code
+        # Check if the result is a dictionary containing a plot_url
+        if isinstance(result, dict) and "plot_url" in result:
+            return {"plot_url": result["plot_url"], "plot_urls": result.get("plot_urls", [result["plot_url"]]), **response}
+        elif is_preview:
+            # Only a preview is returned; further rows and columns are paged with GET /results/{result_id}
+            return {**result, **response}
+        else:
+            return {"result": str(result), **response}
+    else:
+        milvus_service.add_conversation_turn(analysis_prompt, "", llm_response["message"])
+        return {"message": llm_response["message"], "formatted_code": llm_response["formatted_code"], "cache_hit": False}
+
+
+@router.get("/jobs")
+def list_jobs():
+    return {"jobs": router.job_service.list()}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Returns the status of an analysis job, and its result once it has finished.
+    With `wait`, waits up to that many seconds for the job to finish (long polling).
+    """
+    deadline = asyncio.get_running_loop().time() + min(wait, 60)
+    job = router.job_service.get(job_id)
+    while job is not None and job["status"] not in FINISHED and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.1)
+        job = router.job_service.get(job_id)
+    if job is None:
+        return {"error": f"Job '{job_id}' not found"}, 404
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """
+    Cancels a queued or running analysis job; a running job's sandbox is killed.
+    """
+    job = router.job_service.cancel(job_id)
+    if job is None:
+        return {"error": f"Job '{job_id}' not found"}, 404
+    return job
+
+
 @router.post("/execute_upload")
 def execute_upload(file: UploadFile = File(...)):
     """This endpoint is called by the client *after* the server has
@@ -188,6 +283,70 @@ def remove_dataframe(df_name: str):
         return {"error": f"DataFrame '{df_name}' not found."}
 
 
+@router.get("/versions")
+def list_versions():
+    """
+    Lists the saved workspace versions, oldest first.
+    """
+    return {"head": storage_service.get_head(), "versions": dataframe_service.list_versions()}
+
+
+@router.post("/versions/{version_id}/checkout")
+def checkout_version(version_id: str):
+    """
+    Restores the workspace to an arbitrary saved version.
+    """
+    state = dataframe_service.checkout_version(version_id)
+    if state is None:
+        return {"error": f"Version '{version_id}' not found."}
+    if state:
+        session_service.load_dataframe()
+    elif session_service.active.is_active:
+        session_service.pop_to_empty_state()
+    return {"message": f"Checked out version {version_id}."}
+
+
+@router.get("/storage")
+def storage_usage():
+    """
+    Reports the disk usage of every saved version.
+    """
+    return storage_service.usage()
+
+
+@router.post("/storage/compact")
+def compact_storage():
+    """
+    Applies the retention policy and deletes unreferenced versions and blobs.
+    """
+    return storage_service.compact()
+
+
+@router.get("/results/{result_id}")
+def get_result_page(result_id: str, offset: int = 0, limit: int = 100, col_offset: int = 0, col_limit: int = None):
+    """
+    Returns a window of rows and columns of a stored analysis result.
+    """
+    page = router.code_execution_service.get_result_page(result_id, offset, limit, col_offset, col_limit)
+    if page is None:
+        return {"error": f"Result '{result_id}' not found"}, 404
+    return page
+
+
+@router.get("/metrics")
+def metrics():
+    """
+    Code execution metrics, such as the hit rate of the execution cache, and how commands were classified.
+    """
+    metrics = {"code_execution": router.code_execution_service.metrics()}
+    llm_service = router.llm_service
+    if llm_service.command_classifier is not None:
+        metrics["classifier"] = llm_service.command_classifier.stats()
+    if llm_service.prompt_cache is not None:
+        metrics["prompt_cache"] = llm_service.prompt_cache.stats()
+    return metrics
+
+
 @router.get("/health")
 def health_check():
     """
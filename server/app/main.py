@@ -13,11 +13,15 @@ def create_fastapi_app() -> FastAPI:
     with hydra.initialize(config_path="conf", version_base=None):
         cfg = hydra.compose(config_name="config")
 
+    from .services.storage_service import storage_service
+    storage_service.configure(cfg.storage)
+
     from .services.vector_store_factory import get_vector_store
     vector_store = get_vector_store(cfg)
 
     from .services.dataframe_service import dataframe_service
     dataframe_service.set_vector_store(vector_store)
+    dataframe_service.configure(cfg.dataframe)
 
     # Pass the loaded config to services that need it
     from .services.llm_service import LLMService
@@ -26,14 +30,22 @@ def create_fastapi_app() -> FastAPI:
     from .services.code_execution_service import CodeExecutionService
     code_execution_service_instance = CodeExecutionService(config=cfg.code_execution)
 
+    from .services.job_service import JobService
+    job_service_instance = JobService(config=cfg.jobs)
+
     # Import endpoints after services are created
     from .api import endpoints
 
     fastapi_app = FastAPI()
+    # Write out any snapshot still queued by the write-behind storage
+    fastapi_app.add_event_handler("shutdown", storage_service.flush)
+    fastapi_app.add_event_handler("shutdown", job_service_instance.close)
+    fastapi_app.add_event_handler("shutdown", code_execution_service_instance.close)
 
     # Pass the service instances to the endpoints router
     endpoints.router.llm_service = llm_service_instance
     endpoints.router.code_execution_service = code_execution_service_instance
+    endpoints.router.job_service = job_service_instance
     fastapi_app.include_router(endpoints.router)
 
     # Mount static files for plots
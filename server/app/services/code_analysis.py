@@ -0,0 +1,333 @@
+import ast
+
+# DataFrame/Series methods that change the object they are called on
+MUTATING_METHODS = {"insert", "pop", "update", "__setitem__", "__delitem__", "set_flags"}
+
+
+def _root_name(node):
+    """
+    Returns the variable at the root of `df`, `df['a']`, `df.loc[...]`, `df.a.b`, ..., or None.
+    """
+    while isinstance(node, (ast.Subscript, ast.Attribute)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _targets(node):
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, (ast.AugAssign, ast.AnnAssign)):
+        targets = [node.target]
+    elif isinstance(node, ast.Delete):
+        targets = node.targets
+    else:
+        return []
+    flat = []
+    for target in targets:
+        if isinstance(target, (ast.Tuple, ast.List)):
+            flat.extend(target.elts)
+        else:
+            flat.append(target)
+    return flat
+
+
+def analyze_code(code, frame_names):
+    """
+    Classifies generated code as read-only or mutating with respect to the dataframes in `frame_names`.
+
+    Code mutates a frame when it assigns to or deletes its columns, rows or attributes
+    (`df['a'] = ...`, `df.loc[...] = ...`, `del df['a']`, `df.columns = ...`), rebinds it
+    (`df = ...`, `df += 1`), calls a method with `inplace=True` or a method that changes
+    the object in place (`insert`, `pop`, `update`). Variables bound directly to a frame
+    (`d = df`) count as that frame. Code that does not parse is treated as mutating.
+
+    Returns {"read_only": bool, "mutations": [description, ...], "frames": [name, ...]}, where `frames`
+    are the names in `frame_names` whose objects the code changes or rebinds, with aliases resolved
+    (rebinding an alias leaves its frame alone).
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return {"read_only": False, "mutations": [f"line {e.lineno}: code does not parse"], "frames": []}
+
+    frames = {name: name for name in frame_names}  # Name in the code -> the frame it is bound to
+    mutations = []
+    changed = set()
+    # Aliases first, so that `d = df` followed by `d['a'] = 1` is seen as a mutation of df
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Name) and node.value.id in frames:
+            frames.update((target.id, frames[node.value.id]) for target in node.targets if isinstance(target, ast.Name))
+
+    for node in ast.walk(tree):
+        for target in _targets(node):
+            name = _root_name(target)
+            if name not in frames:
+                continue
+            if isinstance(target, ast.Name):
+                if isinstance(node, ast.Assign) and isinstance(node.value, ast.Name) and node.value.id in frames:
+                    continue  # An alias, not a change
+                mutations.append(f"line {node.lineno}: rebinds {name}")
+                if frames[name] == name:
+                    changed.add(name)
+            else:
+                action = "deletes from" if isinstance(node, ast.Delete) else "assigns into"
+                mutations.append(f"line {node.lineno}: {action} {name}")
+                changed.add(frames[name])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            name = _root_name(node.func.value)
+            if name not in frames:
+                continue
+            inplace = any(
+                kw.arg == "inplace" and not (isinstance(kw.value, ast.Constant) and kw.value.value is False)
+                for kw in node.keywords
+            )
+            if inplace or node.func.attr in MUTATING_METHODS:
+                mutations.append(f"line {node.lineno}: {name}.{node.func.attr}() changes {name} in place")
+                changed.add(frames[name])
+    return {"read_only": not mutations, "mutations": mutations, "frames": sorted(changed)}
+
+
+# Methods and attributes that work row by row, so they give the same rows on a chunk of df as on the whole frame
+ROW_METHODS = {
+    "astype", "isna", "isnull", "notna", "notnull", "fillna", "between", "isin", "abs", "round", "clip",
+    "where", "mask", "query", "assign", "copy", "rename", "drop", "dropna", "replace", "map", "apply",
+    "select_dtypes", "to_frame", "add", "sub", "mul", "div", "truediv", "floordiv", "mod", "pow",
+    "eq", "ne", "lt", "le", "gt", "ge",
+    # .str and .dt accessors
+    "lower", "upper", "strip", "lstrip", "rstrip", "title", "capitalize", "contains", "startswith",
+    "endswith", "len", "slice", "zfill", "match", "fullmatch", "strftime", "normalize",
+}
+ROW_ATTRIBUTES = {"str", "dt", "loc", "year", "month", "day", "hour", "minute", "weekday", "date"}
+ROW_FUNCTIONS = {
+    "np": {"where", "abs", "sqrt", "exp", "log", "log10", "log1p", "floor", "ceil", "round", "isnan", "sign"},
+    "pd": {"to_numeric", "isna", "notna"},
+}
+# Reductions whose results on chunks can be merged; mean is merged from sums and counts
+REDUCERS = {"sum": "sum", "count": "sum", "size": "sum", "min": "min", "max": "max", "mean": None}
+
+
+class _RowLocal:
+    """
+    Decides whether expressions only combine values within a row of `df`.
+    """
+
+    def __init__(self, names=("df",)):
+        self.names = set(names)
+        self.frames = set(names)  # The names known to hold frames (or rows), which columns can be selected from
+
+    def is_frame(self, node):
+        """
+        True for expressions known to be a frame with the rows of `df`, such as `df[mask]` or `df[['a', 'b']]`.
+        """
+        if isinstance(node, ast.Name):
+            return node.id in self.frames
+        if isinstance(node, ast.Subscript):
+            if isinstance(node.value, ast.Attribute) and node.value.attr == "loc":
+                columns = node.slice.elts[1] if isinstance(node.slice, ast.Tuple) and len(node.slice.elts) == 2 else None
+                return self.is_frame(node.value.value) and not isinstance(columns, ast.Constant)
+            return self.is_frame(node.value) and not isinstance(node.slice, ast.Constant)
+        if isinstance(node, (ast.BinOp, ast.Compare)):
+            operands = [node.left, node.right] if isinstance(node, ast.BinOp) else [node.left, *node.comparators]
+            return any(self.is_frame(operand) for operand in operands)
+        if isinstance(node, ast.UnaryOp):
+            return self.is_frame(node.operand)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            # Frame methods keep returning frames, except a row-wise apply which returns a Series
+            return node.func.attr != "apply" and (node.func.attr == "to_frame" or self.is_frame(node.func.value))
+        return False
+
+    def _is_mask(self, node):
+        # A row-wise expression selecting rows, not a label lookup: it has to use the data
+        return (not isinstance(node, ast.Lambda) and self.check(node)
+                and any(isinstance(n, ast.Name) for n in ast.walk(node)))
+
+    def _check_subscript(self, node):
+        value, index = node.value, node.slice
+        if isinstance(value, ast.Attribute) and value.attr == "str":
+            # `.str[0]`, `.str[:3]`: element-wise on the strings
+            bounds = [index] if not isinstance(index, ast.Slice) else [index.lower, index.upper, index.step]
+            return self.check(value) and all(b is None or isinstance(b, ast.Constant) for b in bounds)
+        if isinstance(value, ast.Attribute) and value.attr == "loc":
+            if not self.is_frame(value.value):
+                return False
+            rows, columns = index.elts if isinstance(index, ast.Tuple) and len(index.elts) == 2 else (index, None)
+            rows_ok = (isinstance(rows, ast.Slice) and self.check(rows)) or self._is_mask(rows)
+            return rows_ok and (columns is None or _is_column_list(columns)
+                                or (isinstance(columns, ast.Slice) and self.check(columns)))
+        # Columns are only selected from frames, and a Series is never indexed: its labels may be in another chunk
+        if not self.is_frame(value) or not self.check(value):
+            return False
+        return _is_column_list(index) or self._is_mask(index)
+
+    def check(self, node):
+        if isinstance(node, ast.Constant):
+            return True
+        if isinstance(node, ast.Name):
+            return node.id in self.names
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return all(self.check(elt) for elt in node.elts)
+        if isinstance(node, ast.Dict):
+            return all(isinstance(k, ast.Constant) and self.check(v) for k, v in zip(node.keys, node.values))
+        if isinstance(node, ast.BinOp):
+            return self.check(node.left) and self.check(node.right)
+        if isinstance(node, ast.UnaryOp):
+            return self.check(node.operand)
+        if isinstance(node, ast.Compare):
+            return self.check(node.left) and all(self.check(c) for c in node.comparators)
+        if isinstance(node, ast.Slice):
+            return node.lower is None and node.upper is None and node.step is None  # `:` only; labels may be missing
+        if isinstance(node, ast.Subscript):
+            return self._check_subscript(node)
+        if isinstance(node, ast.Attribute):
+            if isinstance(node.value, ast.Name) and node.value.id in ("np", "pd"):
+                return node.attr in ("nan", "NA", "NaT", "inf")
+            return node.attr in ROW_ATTRIBUTES and self.check(node.value)
+        if isinstance(node, ast.Lambda):
+            # Only its own arguments, bound to a row (or a value), and only row-wise operations on them
+            args = node.args
+            if args.vararg or args.kwarg or args.kwonlyargs or args.posonlyargs or args.defaults:
+                return False
+            return _RowLocal([arg.arg for arg in args.args]).check(node.body)
+        if isinstance(node, ast.Call):
+            return self._check_call(node)
+        return False
+
+    def _check_call(self, node):
+        func = node.func
+        if not isinstance(func, ast.Attribute):
+            return False
+        keywords = {kw.arg for kw in node.keywords}
+        if not (all(self.check(arg) for arg in node.args) and all(self.check(kw.value) for kw in node.keywords)):
+            return False
+        if isinstance(func.value, ast.Name) and func.value.id in ROW_FUNCTIONS:
+            return func.attr in ROW_FUNCTIONS[func.value.id]
+        if func.attr not in ROW_METHODS or not self.check(func.value):
+            return False
+        if func.attr == "drop":
+            return keywords == {"columns"} and not node.args
+        if func.attr in ("dropna", "fillna"):
+            return not keywords & {"axis", "method"}
+        if func.attr == "query":
+            return (len(node.args) == 1 and not node.keywords and isinstance(node.args[0], ast.Constant)
+                    and _query_is_row_local(node.args[0].value))
+        if func.attr == "apply":
+            # Row-wise on a frame, or element-wise on a single column
+            axis_1 = any(kw.arg == "axis" and isinstance(kw.value, ast.Constant) and kw.value.value in (1, "columns")
+                         for kw in node.keywords)
+            single_column = (isinstance(func.value, ast.Subscript) and isinstance(func.value.slice, ast.Constant)
+                             and isinstance(func.value.slice.value, str))
+            return axis_1 or single_column
+        return True
+
+
+class _QueryRowLocal(_RowLocal):
+    """
+    _RowLocal for the expression of `df.query(...)`, where every name is a column.
+    """
+
+    def check(self, node):
+        if isinstance(node, ast.BoolOp):  # `and` / `or` are element-wise in query expressions
+            return all(self.check(value) for value in node.values)
+        return super().check(node)
+
+
+def _query_is_row_local(expr):
+    # Local variables (@x) and backticked column names are not Python; such queries are not checked
+    if not isinstance(expr, str) or "@" in expr or "`" in expr:
+        return False
+    try:
+        tree = ast.parse(expr.strip(), mode="eval")
+    except SyntaxError:
+        return False
+    columns = _QueryRowLocal({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)})
+    columns.frames = set()  # A column is a Series: no labels are looked up in it
+    return columns.check(tree.body)
+
+
+def _is_column_list(node):
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, str)
+    return isinstance(node, ast.List) and all(isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts)
+
+
+def _reduction(node, row_local):
+    """
+    Splits `<rows>.sum()` or `<rows>.groupby(keys)[cols].sum()` into (mode, reducer), or returns None.
+    """
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in REDUCERS
+            and not node.args):
+        return None
+    reducer, target = node.func.attr, node.func.value
+    if node.keywords and (reducer == "mean" or {kw.arg for kw in node.keywords} != {"numeric_only"}):
+        return None
+    if isinstance(target, ast.Subscript) and _is_column_list(target.slice):
+        grouped = target.value
+    else:
+        grouped = target
+    if (isinstance(grouped, ast.Call) and isinstance(grouped.func, ast.Attribute) and grouped.func.attr == "groupby"
+            and not grouped.keywords and len(grouped.args) == 1):
+        if row_local.check(grouped.func.value) and (_is_column_list(grouped.args[0]) or row_local.check(grouped.args[0])):
+            return "groupby", reducer
+        return None
+    if reducer != "size" and row_local.check(target):
+        return "reduce", reducer
+    return None
+
+
+def chunk_plan(code):
+    """
+    Decides whether code can run over row chunks of `df` and have its partial results combined.
+
+    Eligible code only uses `df`, pd/np element-wise functions and its own variables,
+    and consists of assignments of row-wise expressions (filters, column selections
+    and transforms, `df['c'] = ...`) followed by `result = ...`, which is either:
+    - row-wise itself: the chunk results are concatenated ("rows")
+    - `<rows>.sum/count/min/max/mean()`: the chunk results are reduced again ("reduce")
+    - `<rows>.groupby(keys)[cols].sum/count/size/min/max/mean()`: the chunk results
+      are grouped by their index and reduced again ("groupby")
+
+    Returns {"mode", "reducer", "code"} where `code` is what runs on every chunk
+    (a mean computes sums and counts), or None if the code is not eligible.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    if not tree.body:
+        return None
+    row_local = _RowLocal()
+    *body, last = tree.body
+    for node in body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AugAssign):
+            target, value = node.target, node.value
+        else:
+            return None
+        if not row_local.check(value):
+            return None
+        if isinstance(target, ast.Name) and target.id not in ("df", "result", "pd", "np"):
+            row_local.names.add(target.id)
+            if row_local.is_frame(value):
+                row_local.frames.add(target.id)
+            else:
+                row_local.frames.discard(target.id)
+        elif not (isinstance(target, ast.Subscript) and _root_name(target) == "df" and row_local.check(target)):
+            return None
+    if not (isinstance(last, ast.Assign) and len(last.targets) == 1 and isinstance(last.targets[0], ast.Name)
+            and last.targets[0].id == "result"):
+        return None
+    if row_local.check(last.value) and any(isinstance(n, ast.Name) for n in ast.walk(last.value)):
+        return {"mode": "rows", "reducer": None, "code": code}
+    reduction = _reduction(last.value, row_local)
+    if reduction is None:
+        return None
+    mode, reducer = reduction
+    if reducer == "mean":
+        target = last.value.func.value
+        last.value = ast.Tuple(elts=[
+            ast.Call(func=ast.Attribute(value=target, attr=name, ctx=ast.Load()), args=[], keywords=[])
+            for name in ("sum", "count")
+        ], ctx=ast.Load())
+        code = ast.unparse(ast.fix_missing_locations(tree))
+    return {"mode": mode, "reducer": reducer, "code": code}
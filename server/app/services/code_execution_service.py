@@ -4,27 +4,68 @@ import matplotlib
 
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+import json
 import os
 import uuid  # Import uuid for unique filenames
 import urllib.parse  # Import urllib.parse for URL encoding
-import pickle
-import shutil
+import threading
+from collections import deque
 from .logging_service import logging_service
 from datetime import datetime
 from . import safe_exec
+from .result_store import ResultStore
+from .exec_cache import ExecutionCache, is_cacheable
+from .code_analysis import analyze_code, chunk_plan
+from .code_optimizer import optimize_code
+from .storage_service import storage_service
 
 
 class CodeExecutionService:
     def __init__(self, config):
         self.config = config
-        self.results_history = []
         current_file_dir = os.path.dirname(os.path.abspath(__file__))
         app_dir = os.path.dirname(current_file_dir)
         server_dir = os.path.dirname(app_dir)
         project_root = os.path.dirname(server_dir)
         self.plots_dir = os.path.join(project_root, "server", "storage", "plots")
+        results_config = config.get("results") or {}
+        self.results_history = ResultStore(
+            os.path.join(project_root, "server", "storage", "results"),
+            keep_last=int(results_config.get("keep_last", 10)),
+            budget=int(results_config.get("budget", 0)),
+        )
         if not os.path.exists(self.plots_dir):
             os.makedirs(self.plots_dir)
+        self.preview_rows = int(results_config.get("preview_rows", 20))
+        self.preview_cols = int(results_config.get("preview_cols", 20))
+        self.max_page_rows = int(results_config.get("max_page_rows", 1000))
+        cache_config = config.get("cache") or {}
+        self.cache = None
+        if cache_config.get("enabled", True):
+            self.cache = ExecutionCache(
+                max_bytes=int(cache_config.get("max_bytes", 256 * 2**20)),
+                directory=os.path.join(project_root, "server", "storage", "exec_cache") if cache_config.get("persist") else None,
+                disk_bytes=int(cache_config.get("disk_bytes", 2**30)),
+            )
+        # Resource usage of every execution (see safe_exec), aggregated for metrics()
+        self._usage_lock = threading.Lock()
+        self.usage_totals = {"count": 0, "failed": 0, "timeouts": 0, "totals": {}, "max": {}}
+        self.recent_executions = deque(maxlen=50)
+        # Pre-started sandbox workers; with pool_size 0 every job starts its own sandbox process
+        self.pool = safe_exec.SandboxPool(config) if int(config.get("pool_size", 0)) > 0 else None
+        self.optimizer_enabled = bool((config.get("optimizer") or {}).get("enabled", True))
+        # Eligible code on frames of at least `min_bytes` runs over row chunks instead of the whole frame
+        chunked_config = config.get("chunked") or {}
+        self.chunked_enabled = bool(chunked_config.get("enabled", True))
+        self.chunked_min_bytes = int(chunked_config.get("min_bytes", 250_000_000))
+        self.chunk_rows = int(chunked_config.get("chunk_rows", 1_000_000))
+        plots_config = config.get("plots") or {}
+        # Part of the cache key, so that plots are rendered again when the format or resolution changes
+        self.plot_settings = ",".join(f"{key}={plots_config.get(key)}" for key in sorted(plots_config))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
 
     def log(self, message):
         if logging_service.get_logging_level("code_execution") == "on":
@@ -39,65 +80,264 @@ class CodeExecutionService:
 
     def health(self):
         # For now, this service is always considered healthy
-        return "OK"
+        status = [f"{len(self.results_history)} results stored"]
+        if self.pool is not None:
+            status.insert(0, f"sandbox pool: {self.pool.size} workers")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            status.append(f"cache hit rate {stats['hit_rate']:.0%} ({stats['hits']}/{stats['hits'] + stats['misses']})")
+        return f"OK ({', '.join(status)})"
+
+    def metrics(self):
+        with self._usage_lock:
+            executions = {
+                "count": self.usage_totals["count"],
+                "failed": self.usage_totals["failed"],
+                "timeouts": self.usage_totals["timeouts"],
+                "totals": dict(self.usage_totals["totals"]),
+                "max": dict(self.usage_totals["max"]),
+                "recent": list(self.recent_executions),
+            }
+        return {"cache": self.cache.stats() if self.cache is not None else None, "executions": executions}
+
+    def _record_usage(self, code, df_name, execution_result):
+        """
+        Aggregates the resource usage of one execution for metrics().
+        """
+        usage = execution_result.get("usage") or {}
+        self.log(f"Execution usage ({df_name}): {usage}\n")
+        with self._usage_lock:
+            totals = self.usage_totals
+            totals["count"] += 1
+            totals["failed"] += 0 if execution_result.get("ok") else 1
+            totals["timeouts"] += 1 if execution_result.get("error") == "timeout" else 0
+            for key, value in usage.items():
+                if key != "peak_rss_bytes":  # A peak only has a maximum
+                    totals["totals"][key] = round(totals["totals"].get(key, 0) + value, 6)
+                totals["max"][key] = max(totals["max"].get(key, 0), value)
+            self.recent_executions.append({
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "code": code[:200],
+                "df_name": df_name,
+                "frames_loaded": execution_result.get("frames_loaded", []),
+                "ok": bool(execution_result.get("ok")),
+                "usage": usage,
+            })
+
+    def get_result_page(self, result_id, offset=0, limit=100, col_offset=0, col_limit=None):
+        """
+        Returns a window of rows and columns of a stored result, or None if the result is gone.
+        """
+        result = self.results_history.get(result_id)
+        if result is None:
+            return None
+        limit = max(0, min(limit, self.max_page_rows))
+        if not isinstance(result, (pd.DataFrame, pd.Series)):
+            return {"result_id": result_id, "shape": None, "text": str(result)}
+        window = result.iloc[offset:offset + limit]
+        if isinstance(result, pd.DataFrame):
+            col_end = None if col_limit is None else col_offset + col_limit
+            window = window.iloc[:, col_offset:col_end]
+        return {
+            "result_id": result_id,
+            "shape": list(result.shape),
+            "offset": offset,
+            "limit": limit,
+            "columns": [str(c) for c in window.columns] if isinstance(window, pd.DataFrame) else [str(window.name)],
+            "text": window.to_string(),
+            "data": json.loads(window.to_json(orient="split", date_format="iso", default_handler=str)),
+        }
+
+    def _input_fingerprints(self, inputs, all_dfs, result_paths):
+        """
+        Returns the current fingerprints of the inputs a piece of code used, or None if one of them is gone.
+        """
+        fingerprints = []
+        for kind, name in inputs:
+            if kind == "frame":
+                if name not in all_dfs:
+                    return None
+                fingerprints.append(storage_service.fingerprint(all_dfs.raw(name)))
+            else:  # Position of a result counted from the newest one, whose file never changes
+                if -name > len(result_paths):
+                    return None
+                fingerprints.append(result_paths[name])
+        return fingerprints
 
-    def execute(self, code: str, dataframe_service, df_name: str = None) -> any:
+    def _cached_result(self, code_key, all_dfs, result_paths):
+        # Plot results are only reused while their files still exist
+        inputs = self.cache.inputs(code_key)
+        fingerprints = self._input_fingerprints(inputs, all_dfs, result_paths) if inputs is not None else None
+        if fingerprints is None:
+            self.cache.miss()
+            return None
+        return self.cache.get(self.cache.key(code_key, fingerprints), valid=self._plots_exist)
+
+    def _plots_exist(self, result):
+        if not isinstance(result, dict):
+            return True
+        return all(
+            os.path.exists(os.path.join(self.plots_dir, urllib.parse.unquote(url.rsplit("/", 1)[-1])))
+            for url in result.get("plot_urls", [])
+        )
+
+    def optimize(self, code: str, frames=()):
+        """
+        Rewrites slow pandas idioms in generated code into vectorized forms (see code_optimizer).
+        `frames` are the names of the workspace frames the code can use besides `df`.
+        Returns (code, report), where report lists the rewrites and the patterns that were only
+        flagged; report is None when the optimizer is disabled.
+        """
+        if not self.optimizer_enabled:
+            return code, None
+        optimized, report = optimize_code(code, frames)
+        for rewrite in report["rewrites"]:
+            self.log(f"Optimizer: line {rewrite['line']}: {rewrite['original']} -> {rewrite['rewritten']}\n")
+        for warning in report["warnings"]:
+            self.log(f"Optimizer: line {warning['line']}: {warning['message']}\n")
+        return optimized, report
+
+    def chunk_plan(self, code: str, all_dfs, df_name: str = None):
+        """
+        Returns the plan to run the code over row chunks of its frame in `all_dfs` (see code_analysis.chunk_plan),
+        or None if it runs in memory: chunked mode is disabled, the frame is small or the code is not eligible.
+        """
+        if not df_name and all_dfs:
+            df_name = next(iter(all_dfs))
+        if not self.chunked_enabled or df_name not in all_dfs:
+            return None
+        nbytes = all_dfs.info(df_name)["nbytes"] or 0
+        if nbytes < self.chunked_min_bytes:
+            return None
+        if not analyze_code(code, ["df", "dataframes", *all_dfs])["read_only"]:
+            # Changes to a chunk cannot be written back to the frame
+            self.log(f"Frame {df_name} takes {nbytes} bytes, but the code changes a frame\n")
+            return None
+        plan = chunk_plan(code)
+        if plan is None:
+            self.log(f"Frame {df_name} takes {nbytes} bytes, but the code cannot run in chunks\n")
+            return None
+        plan["chunk_rows"] = self.chunk_rows
+        self.log(f"Running code over chunks of {self.chunk_rows} rows of {df_name} ({plan['mode']})\n")
+        return plan
+
+    def execute(self, code: str, dataframe_service, df_name: str = None, cancelled=None, chunked=None,
+                frames=None) -> any:
         """
         Executes the given Python code in a restricted environment.
+        Setting the `cancelled` event (a threading.Event) kills the sandbox.
+        With a `chunked` plan (see chunk_plan), the code runs over row chunks of the frame.
+        The code runs on `frames`, a snapshot of the workspace (see DataFrameService.snapshot, taken here
+        by default), without holding the workspace lock; its changes are committed under the lock.
         """
         original_df_name = df_name # Store the original df_name
-        df = None
-        if df_name:
-            df = dataframe_service.get_dataframe(df_name)
-        else:
-            all_dfs = dataframe_service.get_all_dataframes()
-            if all_dfs:
-                original_df_name = list(all_dfs.keys())[0] # Get the name of the first dataframe
-                df = all_dfs[original_df_name]
+        all_dfs = frames if frames is not None else dataframe_service.snapshot()
+        if not df_name and all_dfs:
+            original_df_name = next(iter(all_dfs)) # Get the name of the first dataframe
+
+        # Only the frames the code changes are written back (and snapshotted and re-indexed)
+        analysis = analyze_code(code, ["df", "dataframes", *all_dfs])
+        self.log(f"Code is {'read-only' if analysis['read_only'] else 'mutating: ' + '; '.join(analysis['mutations'])}\n")
 
-        if df is None:
-            # Create an empty dataframe if none are loaded
-            df = pd.DataFrame()
-        df_pickle = pickle.dumps(df)
+        result_paths = self.results_history.paths()
+        code_key = None
+        # Changes to frames are not cached, so only read-only code is
+        if self.cache is not None and analysis["read_only"] and is_cacheable(code):
+            # Plots are cached like any other result: by code and the fingerprints of the frames it used
+            code_key = self.cache.code_key(code, context=f"{original_df_name or ''}\0{self.plot_settings}")
+            cached = self._cached_result(code_key, all_dfs, result_paths)
+            if cached is not None:
+                self.log(f"Cache hit for code {code_key}\n")
+                return self._finish(cached)
 
-        execution_result = safe_exec.run_user_code(code, df_pickle, self.config)
+        # Every dataframe is available to the code by name, but only the ones it uses are loaded and handed over
+        df = None if original_df_name in all_dfs else pd.DataFrame()
+        execution_result = safe_exec.run_user_code(
+            code, df, self.config, pool=self.pool, frames=all_dfs, df_name=original_df_name,
+            results=result_paths, cancelled=cancelled, plots_dir=self.plots_dir, chunked=chunked,
+            write_back=analysis["frames"],
+        )
+        if execution_result.get("frames_loaded"):
+            self.log(f"Frames loaded by the sandbox: {execution_result['frames_loaded']}\n")
+        self._record_usage(code, original_df_name, execution_result)
 
         if not execution_result["ok"]:
             error_message = execution_result.get('err') or execution_result.get('error')
             return f"Error executing code: {error_message}"
+        conflicts = self._commit(dataframe_service, all_dfs, execution_result.get("frames_written") or {})
+        if conflicts:
+            return f"Error executing code: {', '.join(conflicts)} changed while the code ran, its changes were not saved"
+
+        cache_key = None
+        if code_key is not None:
+            inputs = [("frame", name) for name in execution_result.get("frames_loaded", [])]
+            inputs += [("result", result_paths.index(path) - len(result_paths))
+                       for path in execution_result.get("results_loaded", [])]
+            fingerprints = self._input_fingerprints(inputs, all_dfs, result_paths)
+            cache_key = self.cache.key(code_key, fingerprints)
 
         final_result = None
         plot_urls = []
 
-        if execution_result.get("plots"):
-            for plot_path in execution_result["plots"]:
-                plot_filename = os.path.basename(plot_path)
-                new_plot_path = os.path.join(self.plots_dir, plot_filename)
-                shutil.move(plot_path, new_plot_path)
-                encoded_plot_filename = urllib.parse.quote(plot_filename)
-                plot_urls.append(f"http://localhost:8000/plots/{encoded_plot_filename}")
+        for plot_path in execution_result.get("plots", []):
+            encoded_plot_filename = urllib.parse.quote(os.path.basename(plot_path))
+            plot_urls.append(f"http://localhost:8000/plots/{encoded_plot_filename}")
+        if execution_result.get("downsampled"):
+            self.log(f"Downsampled {execution_result['downsampled']} oversized series before rendering\n")
 
         if plot_urls:
-            final_result = {"plot_url": plot_urls[0]} # Support multiple plots in the future
+            final_result = {"plot_url": plot_urls[0], "plot_urls": plot_urls}
         else:
             result = execution_result.get("result")
             if isinstance(result, (pd.Series, pd.DataFrame)):
                 final_result = result
-                # Update the dataframe in dataframe_service if the user code returned a dataframe
-                if original_df_name:
-                    dataframe_service.set_dataframe(original_df_name, final_result)
             else:
                 final_result = (
                     result if result is not None else "Code executed successfully, but no result was returned."
                 )
 
-        self.results_history.append(final_result)
-        if len(self.results_history) > 10:  # Keep the last 10 results
-            self.results_history.pop(0)
+        if cache_key is not None:
+            self.cache.put(code_key, inputs, cache_key, final_result)
+        return self._finish(final_result)
+
+    def _commit(self, dataframe_service, all_dfs, frames):
+        """
+        Writes back the frames the code changed, by name; `result` is never written to a frame.
+        Nothing is written if one of them is no longer what it was in `all_dfs`, the snapshot the code ran on:
+        returns the names of those frames.
+        """
+        with dataframe_service.lock:
+            live = dataframe_service.get_all_dataframes()
+            conflicts = [name for name in frames if not self._unchanged(live, all_dfs, name)]
+            if conflicts:
+                self.log(f"Not committing changes to {conflicts}, changed while the code ran\n")
+                return conflicts
+            for name, frame in frames.items():
+                dataframe_service.set_dataframe(name, frame)
+                self.log(f"Committed changes to {name}\n")
+        return []
+
+    @staticmethod
+    def _unchanged(live, snapshot, name):
+        if name not in live or name not in snapshot:
+            return False
+        before, now = snapshot.raw(name), live.raw(name)
+        # Persisting a frame or reloading it replaces the object, not the contents
+        return now is before or storage_service.fingerprint(now) == storage_service.fingerprint(before)
+
+    def _finish(self, final_result):
+        # Spilled to disk; the store keeps the last `keep_last` results
+        result_id = self.results_history.append(final_result)
 
-        # If the result is a pandas DataFrame, return its string representation
+        # DataFrames and Series are only previewed (head, tail and shape); the rest is fetched with get_result_page
         if isinstance(final_result, (pd.DataFrame, pd.Series)):
-            return final_result.to_string()
+            # Series.to_string has no max_cols
+            columns = {"max_cols": self.preview_cols} if isinstance(final_result, pd.DataFrame) else {}
+            return {
+                "result": final_result.to_string(max_rows=self.preview_rows, **columns),
+                "result_id": result_id,
+                "shape": list(final_result.shape),
+            }
         elif isinstance(final_result, list):
             return "\n".join(map(str, final_result))
         else:
@@ -0,0 +1,217 @@
+import ast
+import copy
+import pandas as pd
+
+ARITHMETIC_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+COMPARE_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+NUMPY_UFUNCS = {"abs", "sqrt", "exp", "log", "log10", "log2", "floor", "ceil", "sin", "cos", "tan", "sign"}
+
+
+def _is_plain_reference(node, frames):
+    """
+    True for `df`, `df['a']`, `df.a`, ... without calls, which can safely be evaluated more than once.
+    The root has to be one of `frames`, so that it is known to be a DataFrame (and not e.g. a GroupBy).
+    """
+    while isinstance(node, (ast.Subscript, ast.Attribute)):
+        if isinstance(node, ast.Subscript) and not isinstance(node.slice, (ast.Constant, ast.Name)):
+            return False
+        node = node.value
+    return isinstance(node, ast.Name) and node.id in frames
+
+
+def _bound_names(tree):
+    """
+    Every name the code assigns, deletes, imports, defines or takes as a parameter.
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+    return names
+
+
+class _Vectorizer(ast.NodeTransformer):
+    """
+    Rewrites the body of a lambda into the same expression over whole columns.
+    `row['a']` / `row.a` (row mode) or the parameter itself (element mode) become column references;
+    anything other than arithmetic, comparisons, constants and numpy ufuncs makes the rewrite fail.
+    """
+
+    def __init__(self, param, target, row_mode):
+        self.param = param
+        self.target = target
+        self.row_mode = row_mode
+        self.used = False
+
+    def fail(self):
+        raise ValueError("not vectorizable")
+
+    def generic_visit(self, node):
+        self.fail()
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, str, bool)):
+            self.fail()
+        return node
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, ARITHMETIC_OPS):
+            self.fail()
+        return ast.BinOp(left=self.visit(node.left), op=node.op, right=self.visit(node.right))
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, (ast.USub, ast.UAdd)):
+            self.fail()
+        return ast.UnaryOp(op=node.op, operand=self.visit(node.operand))
+
+    def visit_Compare(self, node):
+        if len(node.ops) != 1 or not isinstance(node.ops[0], COMPARE_OPS):
+            self.fail()
+        return ast.Compare(left=self.visit(node.left), ops=node.ops, comparators=[self.visit(node.comparators[0])])
+
+    def visit_Call(self, node):
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id in ("np", "numpy")
+                and func.attr in NUMPY_UFUNCS and not node.keywords):
+            self.fail()
+        return ast.Call(func=func, args=[self.visit(arg) for arg in node.args], keywords=[])
+
+    def _column(self, name):
+        self.used = True
+        return ast.Subscript(value=copy.deepcopy(self.target), slice=ast.Constant(name), ctx=ast.Load())
+
+    def visit_Subscript(self, node):
+        if (self.row_mode and isinstance(node.value, ast.Name) and node.value.id == self.param
+                and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+            return self._column(node.slice.value)
+        self.fail()
+
+    def visit_Attribute(self, node):
+        # `row.name`, `row.size`, `row.index`, ... are attributes of the row Series, not columns
+        if (self.row_mode and isinstance(node.value, ast.Name) and node.value.id == self.param
+                and not hasattr(pd.Series, node.attr)):
+            return self._column(node.attr)
+        self.fail()
+
+    def visit_Name(self, node):
+        if not self.row_mode and node.id == self.param:
+            self.used = True
+            return copy.deepcopy(self.target)
+        self.fail()
+
+
+def _axis(call):
+    for keyword in call.keywords:
+        if keyword.arg == "axis" and isinstance(keyword.value, ast.Constant):
+            return keyword.value.value
+    return 0
+
+
+class _Optimizer(ast.NodeTransformer):
+    def __init__(self, frames):
+        self.frames = frames
+        self.rewrites = []
+        self.warnings = []
+        self._loops = 0
+
+    def _vectorize(self, node):
+        """
+        Returns a vectorized form of `x.apply(lambda ...)` / `x.map(lambda ...)`, or None.
+        """
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr in ("apply", "map") and len(node.args) == 1
+                and isinstance(node.args[0], ast.Lambda) and _is_plain_reference(func.value, self.frames)):
+            return None
+        lam = node.args[0]
+        if len(lam.args.args) != 1 or lam.args.vararg or lam.args.kwarg:
+            return None
+        axis = _axis(node)
+        row_mode = func.attr == "apply" and axis in (1, "columns")
+        extra = [k for k in node.keywords if k.arg != "axis"]
+        if extra or (not row_mode and axis not in (0, "index")) or (func.attr == "map" and node.keywords):
+            return None
+        if not row_mode and not isinstance(func.value, (ast.Subscript, ast.Attribute)):
+            return None  # An element-wise apply on a whole DataFrame is left alone
+        vectorizer = _Vectorizer(lam.args.args[0].arg, func.value, row_mode)
+        try:
+            body = vectorizer.visit(lam.body)
+        except ValueError:
+            return None
+        if not vectorizer.used:
+            return None  # A constant would lose its shape
+        return body
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        vectorized = self._vectorize(node)
+        if vectorized is not None:
+            self.rewrites.append({
+                "line": node.lineno,
+                "pattern": f"{node.func.attr}(lambda)" + (" with axis=1" if _axis(node) in (1, "columns") else ""),
+                "original": ast.unparse(node),
+                "rewritten": ast.unparse(vectorized),
+            })
+            return ast.copy_location(vectorized, node)
+        func = node.func
+        if isinstance(func, ast.Attribute):
+            if func.attr == "apply" and _axis(node) in (1, "columns"):
+                self._warn(node, "row-wise apply(axis=1) could not be vectorized automatically")
+            elif func.attr in ("iterrows", "itertuples") and self._loops:
+                self._warn(node, f"{func.attr}() loops over rows in Python; prefer column operations")
+            elif func.attr == "append" and self._loops:
+                self._warn(node, "list built in a Python loop; prefer a vectorized expression or groupby")
+        return node
+
+    def visit_For(self, node):
+        iterator = node.iter
+        if (isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Attribute)
+                and iterator.func.attr in ("iterrows", "itertuples")):
+            self._warn(iterator, f"{iterator.func.attr}() loops over rows in Python; prefer column operations")
+        self._loops += 1
+        for child in node.body + node.orelse:
+            for sub in ast.walk(child):
+                if (isinstance(sub, ast.Subscript) and isinstance(sub.slice, ast.Compare)
+                        and isinstance(sub.value, ast.Name)):
+                    self._warn(sub, f"{sub.value.id}[...] is filtered again on every loop iteration; prefer groupby")
+        node = self.generic_visit(node)
+        self._loops -= 1
+        return node
+
+    visit_While = visit_For
+
+    def _warn(self, node, message):
+        warning = {"line": node.lineno, "message": message}
+        if warning not in self.warnings:
+            self.warnings.append(warning)
+
+
+def optimize_code(code, frames=()):
+    """
+    Rewrites slow pandas idioms in generated code into vectorized equivalents.
+
+    Only `x.apply(lambda row: ...)` with axis=1 and element-wise `s.apply/map(lambda v: ...)`
+    whose bodies are arithmetic, comparisons, constants and numpy ufuncs over the row's
+    columns (or the value) are rewritten; those compute the same values column by column.
+    `x` has to be `df` or one of the workspace `frames`, or a column of one, and the code must
+    never rebind that name. Row loops (iterrows/itertuples), other row-wise applies, lists
+    built in loops and masks recomputed inside loops are only reported.
+
+    Returns (code, {"rewrites": [...], "warnings": [...]}); the code is unchanged if nothing was rewritten.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code, {"rewrites": [], "warnings": []}
+    optimizer = _Optimizer({"df", *frames} - _bound_names(tree))
+    tree = optimizer.visit(tree)
+    if optimizer.rewrites:
+        code = ast.unparse(ast.fix_missing_locations(tree))
+    return code, {"rewrites": optimizer.rewrites, "warnings": optimizer.warnings}
@@ -0,0 +1,135 @@
+import re
+import threading
+
+NAME = r"(?P<{}>[\w.-]+)"
+PATH = r"(?P<file_path>\S+\.csv)"
+
+
+def _rule(pattern, command, **fixed_args):
+    pattern = pattern.replace("<old>", NAME.format("old_name")).replace("<new>", NAME.format("new_name"))
+    pattern = pattern.replace("<df>", NAME.format("df_name")).replace("<service>", NAME.format("service_name"))
+    return re.compile(pattern, re.IGNORECASE), command, fixed_args
+
+
+# Full-match rules for the commands of the classification prompt, tried in order
+RULES = [
+    _rule(r"(?:pop|undo|revert(?: to the previous state)?|go back(?: to the previous state)?)", "pop"),
+    _rule(r"(?:list|show)(?: all)?(?: the)?(?: loaded| current)? (?:dataframes|data frames|dfs)"
+          r"|what dataframes are (?:currently )?loaded", "list_dataframes"),
+    _rule(r"rename(?: dataframe| df)? <old> (?:to|as) <new>", "rename"),
+    _rule(r"(?:remove|delete|drop)(?: dataframe| df)? <df>", "remove"),
+    _rule(r"(?:please )?(?:upload|load|open|read)(?: the)?(?: data| file| csv)?(?: file)?"
+          r"(?: (?:located|stored))?(?: (?:at|from))? " + PATH, "upload"),
+    _rule(r"download(?: dataframe| df)? <df> (?:as|to) (?P<filename>\S+)", "download"),
+    _rule(r"(?:show )?(?:the )?(?:storage|disk) usage", "storage", action="usage"),
+    _rule(r"compact(?: the)? (?:storage|snapshots|versions)", "storage", action="compact"),
+    _rule(r"(?:turn|switch) (?P<level>on|off) (?:the )?<service> (?:service )?(?:logging|logs)", "set_logging"),
+    _rule(r"(?:turn|switch) (?:the )?<service> (?:service )?(?:logging|logs) (?P<level>on|off)", "set_logging"),
+    _rule(r"(?P<client_action>enable|disable) client(?: side|-side)? logging", "client_command"),
+    _rule(r"(?:list|show)(?: all)?(?: the)?(?: available)? services", "list_services"),
+    _rule(r"(?:check |show )?(?:the )?(?:service )?health(?: of| check)?(?: the)?(?: <service>)?(?: service| services)?",
+          "service_health"),
+]
+
+# Phrasings of the commands without arguments, for the optional embedding classifier
+EXAMPLES = {
+    "pop": ["undo the last change", "revert to the previous state", "go back one step"],
+    "list_dataframes": ["which dataframes do I have", "what data is loaded", "show me the loaded tables"],
+    "list_services": ["which services are there", "what services are available"],
+}
+
+
+class CommandClassifier:
+    """
+    Classifies trivial commands in-process, so that they do not wait for the LLM.
+
+    Prompts are matched against full-match rules for the command set of the
+    classification prompt. A match only counts when its arguments are certain:
+    dataframe names must be loaded and service names configured, so e.g.
+    "remove duplicates" is left to the LLM. With an `embed` function and a
+    `threshold` above 0, prompts without a rule match are also compared with
+    example phrasings of the commands that take no arguments. `classify`
+    returns None when it is unsure; callers then ask the LLM and `record_llm()`.
+    """
+
+    def __init__(self, services=(), embed=None, threshold=0.0):
+        self.services = set(services)
+        self.embed = embed if threshold > 0 else None
+        self.threshold = threshold
+        self._examples = None  # (command, normalized vector) per example, embedded on first use
+        self._lock = threading.Lock()
+        self.hits = {"rules": {}, "embedding": {}, "llm": 0}
+
+    def _count(self, path, command):
+        with self._lock:
+            self.hits[path][command] = self.hits[path].get(command, 0) + 1
+
+    def record_llm(self):
+        with self._lock:
+            self.hits["llm"] += 1
+
+    def classify(self, prompt, frame_names=()):
+        """
+        Returns {"command", "args"} for a prompt it is sure about, or None.
+        """
+        text = re.sub(r"\s+", " ", prompt.strip()).rstrip(" ?.!")
+        for pattern, command, fixed_args in RULES:
+            match = pattern.fullmatch(text)
+            if match is None:
+                continue
+            args = {key: value for key, value in match.groupdict().items() if value is not None}
+            args.update(fixed_args)
+            if not self._certain(command, args, set(frame_names)):
+                return None
+            if command == "client_command":
+                args = {"action": f"{args.pop('client_action').lower()}_logging"}
+            elif command == "set_logging":
+                args["level"] = args["level"].lower()
+            elif command == "service_health":
+                args.setdefault("service_name", "all")
+            self._count("rules", command)
+            return {"command": command, "args": args}
+        if self.embed is not None:
+            command = self._nearest(text)
+            if command is not None:
+                self._count("embedding", command)
+                return {"command": command, "args": {}}
+        return None
+
+    def _certain(self, command, args, frame_names):
+        if command in ("remove", "download"):
+            return args["df_name"] in frame_names
+        if command == "rename":
+            return args["old_name"] in frame_names and args["new_name"] not in frame_names
+        if "service_name" in args:
+            args["service_name"] = args["service_name"].lower()
+            return args["service_name"] == "all" or args["service_name"] in self.services
+        return True
+
+    def _vector(self, text):
+        vector = [float(x) for x in self.embed(text.lower())]
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
+
+    def _nearest(self, text):
+        if self._examples is None:
+            self._examples = [(command, self._vector(example))
+                              for command, examples in EXAMPLES.items() for example in examples]
+        vector = self._vector(text)
+        best, best_score = None, self.threshold
+        for command, example in self._examples:
+            score = sum(a * b for a, b in zip(vector, example))
+            if score >= best_score:
+                best, best_score = command, score
+        return best
+
+    def stats(self):
+        with self._lock:
+            fast = sum(self.hits["rules"].values()) + sum(self.hits["embedding"].values())
+            total = fast + self.hits["llm"]
+            return {
+                "rules": dict(self.hits["rules"]),
+                "embedding": dict(self.hits["embedding"]),
+                "llm": self.hits["llm"],
+                "fast_path_rate": round(fast / total, 3) if total else 0.0,
+            }
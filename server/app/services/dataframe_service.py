@@ -1,18 +1,38 @@
+import threading
 import pandas as pd
 from .storage_service import storage_service
 from .logging_service import logging_service
+from .workspace import Workspace
 from datetime import datetime
 
 
 class DataFrameService:
     def __init__(self):
-        self.dataframes = {}
+        self.dataframes = Workspace(storage_service.load_frame)
         self.vector_store = None
+        self.memory_budget = 0  # Bytes of hydrated frames to keep in memory, 0 means unlimited
+        # The Workspace is not thread-safe, and requests and background jobs use it from several threads
+        self.lock = threading.RLock()
         self.load_from_storage()
 
     def set_vector_store(self, vector_store):
         self.vector_store = vector_store
 
+    def configure(self, config):
+        """
+        Applies the `dataframe` section of the Hydra config.
+        """
+        with self.lock:
+            self.memory_budget = int(config.get("memory_budget", self.memory_budget))
+            self._set_workspace(self.dataframes)
+
+    def _set_workspace(self, workspace):
+        workspace.memory_budget = self.memory_budget
+        self.dataframes = workspace
+        evicted = workspace.enforce_memory_budget()
+        if evicted:
+            self.log(f"Evicted to disk: {', '.join(evicted)}")
+
     def log(self, message):
         if logging_service.get_logging_level("dataframe") == "on":
             log_file = logging_service.get_log_file("dataframe")
@@ -24,23 +44,33 @@ class DataFrameService:
                 print(f"[DataFrameService] {message}")
 
     def health(self):
-        # For now, we'll just check if there are any dataframes loaded
-        if self.dataframes:
-            return "OK"
-        else:
-            return "No dataframes loaded"
+        with self.lock:
+            if not self.dataframes:
+                return "No dataframes loaded"
+            usage = self.dataframes.memory_usage()
+            frames = ", ".join(
+                f"{name}: {usage[name] / 2**20:.1f} MB" if name in usage else f"{name}: on disk" for name in self.dataframes
+            )
+            budget = f"{self.memory_budget / 2**20:.1f} MB" if self.memory_budget else "unlimited"
+            return f"OK (memory {sum(usage.values()) / 2**20:.1f} MB of {budget}; {frames})"
 
     def load_from_storage(self):
-        state = storage_service.get_latest_state()
-        if state:
-            self.dataframes = state
+        with self.lock:
+            # Only names and metadata are read here; frames are hydrated on first access
+            state = storage_service.get_latest_state()
+            if state is None:
+                # Frames saved into an empty workspace can be evicted too, and have to be reloaded from storage
+                state = Workspace(storage_service.load_frame)
+            self._set_workspace(state)
 
     def save_to_storage(self):
-        storage_service.save_state(self.dataframes)
+        with self.lock:
+            storage_service.save_state(self.dataframes)
 
     def add_dataframe(self, name: str, df: pd.DataFrame):
-        self.dataframes[name] = df
-        self.save_to_storage()
+        with self.lock:
+            self.dataframes[name] = df
+            self.save_to_storage()
         schema_text = f"""DataFrame: {name}
 Columns and Data Types:
 {df.dtypes.to_string()}
@@ -50,8 +80,9 @@ First 5 rows:
         self.vector_store.add_dataframe_schema(name, schema_text)
 
     def set_dataframe(self, name: str, df: pd.DataFrame):
-        self.dataframes[name] = df
-        self.save_to_storage()
+        with self.lock:
+            self.dataframes[name] = df
+            self.save_to_storage()
         schema_text = f"""DataFrame: {name}
 Columns and Data Types:
 {df.dtypes.to_string()}
@@ -61,28 +92,58 @@ First 5 rows:
         self.vector_store.add_dataframe_schema(name, schema_text)
 
     def get_dataframe(self, name: str) -> pd.DataFrame:
-        return self.dataframes.get(name)
+        with self.lock:
+            return self.dataframes.get(name)
 
     def get_all_dataframes(self):
         return self.dataframes
 
+    def snapshot(self):
+        """
+        Returns a copy of the workspace that can be read without the lock while the live one keeps changing.
+        """
+        with self.lock:
+            return self.dataframes.snapshot()
+
+    def get_dataframe_info(self, name: str):
+        """
+        Returns shape, dtypes and size of a dataframe without loading it.
+        """
+        with self.lock:
+            if name in self.dataframes:
+                return self.dataframes.info(name)
+            return None
+
     def rename_dataframe(self, old_name: str, new_name: str):
-        if old_name in self.dataframes:
-            self.dataframes[new_name] = self.dataframes.pop(old_name)
-            self.save_to_storage()
+        with self.lock:
+            if old_name in self.dataframes:
+                self.dataframes.rename(old_name, new_name)
+                self.save_to_storage()
 
     def pop_state(self):
-        state = storage_service.pop_state()
-        if state:
-            self.dataframes = state
-        return state
+        with self.lock:
+            state = storage_service.pop_state()
+            if state is not None:
+                self._set_workspace(state)
+            return state
+
+    def checkout_version(self, version_id: str):
+        with self.lock:
+            state = storage_service.checkout(version_id)
+            if state is not None:
+                self._set_workspace(state)
+            return state
+
+    def list_versions(self):
+        return storage_service.list_versions()
 
     def remove_dataframe(self, name: str):
-        if name in self.dataframes:
-            del self.dataframes[name]
-            self.save_to_storage()
-            return True
-        return False
+        with self.lock:
+            if name in self.dataframes:
+                del self.dataframes[name]
+                self.save_to_storage()
+                return True
+            return False
 
 
 dataframe_service = DataFrameService()
@@ -0,0 +1,181 @@
+import ast
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from .sandbox_worker import write_frame, read_frame
+from .workspace import describe_frame
+
+# Code that uses any of these names can return something different on every run
+NONDETERMINISTIC_NAMES = {
+    "random", "rand", "randn", "randint", "choice", "shuffle", "permutation", "sample",
+    "now", "today", "time", "uuid4", "urandom", "open", "read_csv", "read_excel", "read_json",
+}
+
+
+def normalize_code(code):
+    """
+    Returns a form of the code that ignores formatting and comments, or the code itself if it does not parse.
+    """
+    try:
+        return ast.dump(ast.parse(code))
+    except SyntaxError:
+        return code
+
+
+def is_cacheable(code):
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        name = node.id if isinstance(node, ast.Name) else node.attr if isinstance(node, ast.Attribute) else None
+        if name in NONDETERMINISTIC_NAMES:
+            return False
+    return True
+
+
+class ExecutionCache:
+    """
+    Results of earlier executions, keyed by the normalized code and the fingerprints of the inputs it used.
+
+    The inputs of a piece of code are only known after it has run (the frames and
+    results it actually loaded), so they are remembered per code and looked up
+    again before the next run. Entries are kept in LRU order within `max_bytes`;
+    with a `directory` they are also written to disk and survive restarts, up to
+    `disk_bytes` (oldest files are removed first).
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None, disk_bytes=2**30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes), least recently used first
+        self._nbytes = 0
+        self._inputs = {}  # code key -> names of the inputs the code used last time
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            try:
+                with open(os.path.join(directory, "inputs.json")) as f:
+                    self._inputs = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def code_key(self, code, context=""):
+        return hashlib.blake2b(f"{context}\0{normalize_code(code)}".encode(), digest_size=16).hexdigest()
+
+    def inputs(self, code_key):
+        """
+        Returns the input names the code used on its last run, or None if it has not been cached.
+        """
+        return self._inputs.get(code_key)
+
+    def key(self, code_key, fingerprints):
+        h = hashlib.blake2b(code_key.encode(), digest_size=16)
+        for fingerprint in fingerprints:
+            h.update(b"\0" + fingerprint.encode())
+        return h.hexdigest()
+
+    def get(self, key, valid=None):
+        """
+        Returns the cached value, or None. A value for which `valid(value)` is false is dropped and counts as a miss.
+        """
+        with self._lock:
+            value = self._entries[key][0] if key in self._entries else None
+        from_disk = value is None
+        if from_disk:
+            value = self._read(key)
+        if value is not None and valid is not None and not valid(value):
+            with self._lock:
+                if key in self._entries:
+                    self._nbytes -= self._entries.pop(key)[1]
+            value = None
+        elif value is not None and from_disk:
+            self._remember(key, value)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, code_key, inputs, key, value):
+        with self._lock:
+            self._inputs[code_key] = list(inputs)
+        self._remember(key, value)
+        if self.directory:
+            self._write(key, value)
+
+    def _size(self, value):
+        nbytes = describe_frame(value)["nbytes"]
+        if nbytes is None:
+            try:
+                nbytes = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            except Exception:
+                nbytes = 0
+        return nbytes
+
+    def _remember(self, key, value):
+        nbytes = self._size(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                self._nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        for ext in (".arrow", ".pickle"):
+            path = os.path.join(self.directory, key + ext)
+            if os.path.exists(path):
+                try:
+                    os.utime(path)  # Keeps recently used files when the disk budget is enforced
+                    return read_frame(path)
+                except Exception:
+                    return None
+        return None
+
+    def _write(self, key, value):
+        try:
+            write_frame(os.path.join(self.directory, key), value)
+        except Exception:
+            return  # Not serializable, it is only cached in memory
+        with self._lock:
+            inputs_path = os.path.join(self.directory, "inputs.json")
+            with open(inputs_path + ".tmp", "w") as f:
+                json.dump(self._inputs, f)
+            os.replace(inputs_path + ".tmp", inputs_path)
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f != "inputs.json"]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for path in files[:-1]:
+            if total <= self.disk_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._nbytes,
+        }
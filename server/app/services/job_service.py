@@ -0,0 +1,119 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from .logging_service import logging_service
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobService:
+    """
+    Runs analyses in the background on a bounded thread pool.
+
+    A job is queued -> running -> succeeded, failed or cancelled. Clients poll it by
+    id; cancelling a queued job drops it, and cancelling a running job kills its
+    sandbox (the job function receives a threading.Event that it has to pass on).
+    """
+
+    def __init__(self, config):
+        self.max_workers = int(config.get("max_workers", 2))
+        self.keep_finished = int(config.get("keep_finished", 100))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()  # job id -> job, oldest first
+        self._lock = threading.Lock()
+
+    def log(self, message):
+        if logging_service.get_logging_level("code_execution") == "on":
+            log_file = logging_service.get_log_file("code_execution")
+            if log_file:
+                with open(log_file, "a", buffering=1) as f:
+                    f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')} - INFO - [JobService] {message}\n")
+            else:
+                print(f"[JobService] {message}")
+
+    def health(self):
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job["status"] not in FINISHED)
+        return f"OK ({active} active jobs, {self.max_workers} workers)"
+
+    def _view(self, job):
+        return {key: value for key, value in job.items() if not key.startswith("_")}
+
+    def submit(self, fn, prompt):
+        """
+        Queues `fn(cancelled)` and returns the new job. Its return value becomes the job result.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "prompt": prompt,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "started": None,
+            "finished": None,
+            "result": None,
+            "error": None,
+            "_cancelled": threading.Event(),
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn)
+        self.log(f"Queued job {job['id']}: {prompt}")
+        return self._view(job)
+
+    def _run(self, job, fn):
+        with self._lock:
+            if job["_cancelled"].is_set():
+                return
+            job["status"] = "running"
+            job["started"] = datetime.now().isoformat(timespec="seconds")
+        try:
+            result = fn(job["_cancelled"])
+            status, error = "succeeded", None
+        except Exception as e:
+            result, status, error = None, "failed", str(e)
+        with self._lock:
+            job["status"] = "cancelled" if job["_cancelled"].is_set() else status
+            job["result"] = result if job["status"] == "succeeded" else None
+            job["error"] = error
+            job["finished"] = datetime.now().isoformat(timespec="seconds")
+        self.log(f"Job {job['id']} {job['status']}")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in FINISHED]
+        for job_id in finished[: max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._view(job) if job is not None else None
+
+    def list(self):
+        with self._lock:
+            return [self._view(job) for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job and returns it, or None if there is no such job.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] not in FINISHED:
+                job["_cancelled"].set()
+                if job["status"] == "queued":
+                    job["status"] = "cancelled"
+                    job["finished"] = datetime.now().isoformat(timespec="seconds")
+            view = self._view(job)
+        self.log(f"Cancelled job {job_id}")
+        return view
+
+    def close(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job["_cancelled"].set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -6,6 +6,8 @@ from datetime import datetime
 from .dataframe_service import dataframe_service
 from .vector_store_factory import get_vector_store
 from .logging_service import logging_service
+from .prompt_cache import PromptCache, schema_fingerprint
+from .command_classifier import CommandClassifier
 
 
 class LLMService:
@@ -17,6 +19,27 @@ class LLMService:
             raise ValueError("OPENAI_API_KEY environment variable not set.")
         self.client = openai.OpenAI(api_key=api_key)
         self.model = self.config.llm.model
+        cache_config = self.config.llm.get("prompt_cache") or {}
+        self.prompt_cache = None
+        if cache_config.get("enabled", True):
+            server_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            model = getattr(self.vector_store, "model", None)
+            self.prompt_cache = PromptCache(
+                path=os.path.join(server_dir, "storage", "prompt_cache.json") if cache_config.get("persist", True) else None,
+                ttl=float(cache_config.get("ttl_seconds", 86400)),
+                max_entries=int(cache_config.get("max_entries", 1000)),
+                threshold=float(cache_config.get("similarity_threshold", 0.0)),
+                embed=model.encode if model is not None else None,
+            )
+        # Trivial commands ("pop", "rename a to b", ...) are classified locally, without an LLM round trip
+        classifier_config = self.config.llm.get("fast_classifier") or {}
+        self.command_classifier = None
+        if classifier_config.get("enabled", True):
+            self.command_classifier = CommandClassifier(
+                services=self.config.get("services") or [],
+                embed=model.encode if model is not None else None,
+                threshold=float(classifier_config.get("embedding_threshold", 0.0)),
+            )
 
     def log(self, message):
         if logging_service.get_logging_level("llm") == "on":
@@ -27,6 +50,27 @@ class LLMService:
             else:
                 print(f"[LLMService] {message}")
 
+    def cached_analysis(self, prompt: str) -> dict:
+        """
+        Returns {"args", "llm_response"} of an analysis prompt answered before on the same
+        dataframe schemas, or None. A hit skips both LLM classification and code generation;
+        prompts that classify_locally resolves to another command are not looked up.
+        """
+        if self.prompt_cache is None:
+            return None
+        cached = self.prompt_cache.get(prompt, schema_fingerprint(dataframe_service.get_all_dataframes()))
+        if cached is not None:
+            self.log(f"Prompt cache hit: {prompt}")
+        return cached
+
+    def remember_analysis(self, prompt: str, schema: str, args: dict, llm_response: dict):
+        """
+        Caches the code generated for an analysis prompt on the dataframe schemas it was generated for
+        (see prompt_cache.schema_fingerprint); only called once the code has run successfully.
+        """
+        if self.prompt_cache is not None:
+            self.prompt_cache.put(prompt, schema, {"args": args, "llm_response": llm_response})
+
     def _get_classification_prompt(self, user_prompt: str) -> str:
         prompt_template = """You are a command interpreter for a data analysis chatbot.
 Your task is to analyze the user's prompt and classify it into one of the following commands and extract its arguments.
@@ -40,6 +84,7 @@ The available commands are:
 - 'remove': For removing a dataframe.
 - 'download': For downloading a dataframe.
 - 'list_dataframes': For listing all currently loaded dataframes.
+- 'storage': For reporting the disk usage of the saved versions or compacting them. Optional 'action' ("usage" or "compact", default "usage").
 - 'analyze': For any other data analysis task.
 - 'set_logging': For controlling server-side logging. Requires 'service_name' ("all" or a specific service) and 'level' ("on" or "off").
 - 'client_command': For controlling the client application. Requires 'action' ("enable_logging" or "disable_logging").
@@ -66,10 +111,28 @@ Your response:
 """
         return f"""{prompt_template}\n\nUser prompt: {user_prompt}\nYour response:\n"""
 
-    def classify_and_extract_command(self, prompt: str) -> dict:
+    def classify_locally(self, prompt: str) -> dict:
+        """
+        Returns {"command", "args"} if the local command classifier is sure about the prompt, or None.
+        """
+        if self.command_classifier is None:
+            return None
+        classified = self.command_classifier.classify(prompt, list(dataframe_service.get_all_dataframes()))
+        if classified is not None:
+            self.log(f"Classified locally: {prompt} -> {classified}")
+        return classified
+
+    def classify_and_extract_command(self, prompt: str, local: bool = True) -> dict:
         """
-        Uses the LLM to classify the prompt and extract arguments.
+        Uses the LLM to classify the prompt and extract arguments,
+        unless the local command classifier is sure about it (with `local`, see classify_locally).
         """
+        if local:
+            classified = self.classify_locally(prompt)
+            if classified is not None:
+                return classified
+        if self.command_classifier is not None:
+            self.command_classifier.record_llm()
         full_prompt = self._get_classification_prompt(prompt)
         response = self.client.chat.completions.create(
             model=self.model,
@@ -154,9 +217,12 @@ Relevant Conversation History:
 
 You have access to the following tools:
 - `df`: The pandas DataFrame that you need to analyze. It has been pre-loaded for you.
+- `dataframes`: Every loaded DataFrame by name, e.g. `dataframes['df_te']`. A DataFrame whose name is a valid Python identifier can also be used directly by that name, e.g. `df_te.merge(df_pr, on='id')`.
 - `results_history`: A list of the results of the last 10 commands. `results_history[-1]` is the most recent result.
 - `last_result`: A convenient alias for `results_history[-1]`.
 - `plots_dir`: The absolute path to the directory where plots should be saved.
+- `parallel_apply(df, fn, partitions=None)`: Calls `fn` on row partitions of `df` in parallel worker processes and concatenates the results. Use it for heavy row-independent work, e.g. `result = parallel_apply(df, lambda part: part[cols].std(axis=1))`.
+- `parallel_groupby(df, by, fn)`: The same as `df.groupby(by).apply(fn)`, with the groups spread over parallel worker processes. Use it when `fn` is expensive per group, e.g. `result = parallel_groupby(df, 'customer', lambda g: g.nlargest(3, 'amount'))`. Plain aggregations (`sum`, `mean`, ...) are faster without it.
 
 **Your Task:**
 Your task is to generate a single block of Python code to answer the user's prompt. The result of your code MUST be assigned to a variable named `result`.
@@ -312,6 +378,12 @@ Now, let's get to work! The user is waiting for your amazing code.
     def health(self):
         # For now, we'll just check if the OpenAI API key is set
         if os.getenv("OPENAI_API_KEY"):
-            return "OK"
+            status = []
+            if self.prompt_cache is not None:
+                stats = self.prompt_cache.stats()
+                status.append(f"prompt cache hit rate {stats['hit_rate']:.0%}, {stats['entries']} entries")
+            if self.command_classifier is not None:
+                status.append(f"{self.command_classifier.stats()['fast_path_rate']:.0%} of commands classified locally")
+            return f"OK ({', '.join(status)})" if status else "OK"
         else:
             return "Error: OPENAI_API_KEY not set"
\ No newline at end of file
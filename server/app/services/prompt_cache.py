@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+    """
+    Lowercases a prompt and collapses whitespace and trailing punctuation, so trivially different wordings share a key.
+    """
+    return re.sub(r"\s+", " ", prompt.strip().lower()).rstrip(" ?.!")
+
+
+def schema_fingerprint(frames):
+    """
+    Fingerprints the names, columns and dtypes of the loaded frames (a Workspace), without loading them.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for name in sorted(frames):
+        h.update(json.dumps([name, frames.info(name)["dtypes"]], sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class PromptCache:
+    """
+    Generated code by prompt, so that repeated questions skip the LLM.
+
+    Entries are keyed by the normalized prompt and the schema fingerprint of the
+    loaded frames, expire after `ttl` seconds and are evicted least recently used
+    first beyond `max_entries`. With an `embed` function and a `threshold` above 0,
+    a prompt that misses is also matched to the most similar cached prompt on the
+    same schema (cosine similarity of the embeddings). With a `path` the cache is
+    kept in a JSON file across restarts.
+    """
+
+    def __init__(self, path=None, ttl=86400, max_entries=1000, threshold=0.0, embed=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.embed = embed if threshold > 0 else None
+        self._entries = OrderedDict()  # key -> entry, least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        if path:
+            try:
+                with open(path) as f:
+                    self._entries = OrderedDict((entry["key"], entry) for entry in json.load(f))
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+    def _key(self, prompt, schema):
+        return hashlib.blake2b(f"{schema}\0{normalize_prompt(prompt)}".encode(), digest_size=16).hexdigest()
+
+    def _vector(self, prompt):
+        vector = [float(x) for x in self.embed(normalize_prompt(prompt))]
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
+
+    def get(self, prompt, schema):
+        """
+        Returns the cached value for a prompt on this schema, or None.
+        """
+        key = self._key(prompt, schema)
+        with self._lock:
+            now = time.time()
+            for expired in [k for k, entry in self._entries.items() if now - entry["created"] > self.ttl]:
+                del self._entries[expired]
+            entry = self._entries.get(key)
+            if entry is None and (self.embed is None or not self._entries):
+                self.misses += 1
+                return None
+        if entry is None:
+            vector = self._vector(prompt)  # Outside the lock, embedding takes a while
+            with self._lock:
+                best_score = self.threshold
+                for candidate in self._entries.values():
+                    if candidate["schema"] == schema and candidate.get("vector"):
+                        score = sum(a * b for a, b in zip(vector, candidate["vector"]))
+                        if score >= best_score:
+                            entry, best_score = candidate, score
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self.similar_hits += 1
+        with self._lock:
+            if entry["key"] in self._entries:
+                self._entries.move_to_end(entry["key"])
+            self.hits += 1
+        return entry["value"]
+
+    def put(self, prompt, schema, value):
+        entry = {
+            "key": self._key(prompt, schema),
+            "prompt": prompt,
+            "schema": schema,
+            "created": time.time(),
+            "value": value,
+            "vector": self._vector(prompt) if self.embed is not None else None,
+        }
+        with self._lock:
+            self._entries.pop(entry["key"], None)
+            self._entries[entry["key"]] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path:
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(list(self._entries.values()), f)
+                os.replace(self.path + ".tmp", self.path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
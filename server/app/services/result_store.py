@@ -0,0 +1,71 @@
+import os
+import threading
+import uuid
+from collections.abc import Sequence
+from .sandbox_worker import write_frame, read_frame
+
+
+class ResultStore(Sequence):
+    """
+    The most recent code execution results, oldest first.
+
+    Every result is spilled to a file as soon as it is added (Arrow IPC for
+    frames, pickle otherwise) and memory-mapped again when it is read, so large
+    results do not stay in server memory. The sandbox maps the same files, so
+    `results_history` does not have to be serialized for every job.
+
+    At most `keep_last` results are kept, and the oldest are dropped while the
+    files take more than `budget` bytes (0 = unlimited); the newest result is always kept.
+    """
+
+    def __init__(self, directory, keep_last=10, budget=0):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.budget = budget
+        self._handles = []  # (result id, path, size) per result, oldest first
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):  # Results of a previous server run
+            os.remove(os.path.join(directory, name))
+
+    def append(self, result):
+        """
+        Stores a result and returns its id.
+        """
+        result_id = uuid.uuid4().hex
+        path = write_frame(os.path.join(self.directory, f"result_{result_id}"), result)
+        with self._lock:
+            self._handles.append((result_id, path, os.path.getsize(path)))
+            while len(self._handles) > 1 and (
+                len(self._handles) > self.keep_last or (self.budget and self.nbytes() > self.budget)
+            ):
+                os.remove(self._handles.pop(0)[1])
+        return result_id
+
+    def get(self, result_id):
+        """
+        Returns a stored result by id, or None if it has been dropped.
+        """
+        with self._lock:
+            paths = [path for handle_id, path, _ in self._handles if handle_id == result_id]
+        return read_frame(paths[0]) if paths else None
+
+    def __getitem__(self, i):
+        with self._lock:
+            handles = self._handles[i]
+        if isinstance(i, slice):
+            return [read_frame(path) for _, path, _ in handles]
+        return read_frame(handles[1])
+
+    def __len__(self):
+        return len(self._handles)
+
+    def paths(self):
+        """
+        Returns the files of the stored results, oldest first, for the sandbox to map.
+        """
+        with self._lock:
+            return [path for _, path, _ in self._handles]
+
+    def nbytes(self):
+        return sum(size for _, _, size in self._handles)
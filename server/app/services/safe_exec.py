@@ -1,105 +1,321 @@
-import resource, signal, subprocess, sys, tempfile, textwrap, os, json, pickle
+import contextlib, errno, re, resource, select, shutil, signal, socket, stat, subprocess, sys, tempfile, time, os, queue, threading
+import pandas as pd
+from .sandbox_worker import send_message, receive_message, write_frame, read_frame
+from .workspace import describe_frame
 
-def run_user_code(py_code:str, df_pickle:bytes, config, workdir:str=None):
-    cpu_limit = int(config.cpu_limit)
-    mem_limit = int(config.mem_limit)
-    timeout = int(config.timeout)
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+# Handoff files live on tmpfs when available, so the sandbox maps the frame straight from memory.
+# tmpfs can be small (64 MB in a default Docker container), so frames that do not fit go to disk
+SHM_DIR = "/dev/shm" if os.access("/dev/shm", os.W_OK) else None
+STARTUP_CPU = 10  # CPU seconds a worker may spend importing pandas, numpy and matplotlib
+# The only files the server takes out of a sandbox directory
+PLOT_FILE = re.compile(r"plot_[0-9a-f]{32}\.(?:png|svg|webp|jpg)")
+RESULT_FILE = re.compile(r"result\.(?:arrow|pickle)")
+FRAME_FILE = re.compile(r"written_[0-9]+\.(?:arrow|pickle)")
 
-    def set_limits():
-        try:
-            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
-        except (ValueError, resource.error):
-            pass
-        try:
-            resource.setrlimit(resource.RLIMIT_AS, (mem_limit, mem_limit))
-        except (ValueError, resource.error):
-            pass
-        os.environ["NO_PROXY"] = "*"  # example: block unintended egress
-
-    with tempfile.TemporaryDirectory(dir=workdir) as td:
-        path = os.path.join(td, "user_code.py")
-        df_path = os.path.join(td, "df.pickle")
-        result_path = os.path.join(td, "result.pickle")
-        
-        with open(df_path, "wb") as f:
-            f.write(df_pickle)
-
-        # prepend guards and data loading
-        guarded_code = f"""import builtins
-import sys
-
-original_import = builtins.__import__
-blacklist = []
-
-def secure_importer(name, globals=None, locals=None, fromlist=(), level=0):
-    if name in blacklist:
-        raise ImportError(f"Import of module '{{name}}' is not allowed.")
-    
-    module = original_import(name, globals, locals, fromlist, level)
-    if name == 'subprocess':
-        for attr in ['call', 'run', 'Popen', 'check_call', 'check_output']:
-            if hasattr(module, attr):
-                delattr(module, attr)
-    elif name == 'shutil':
-        for attr in ['move', 'copy', 'copy2', 'copyfile', 'copytree', 'rmtree', 'chown']:
-            if hasattr(module, attr):
-                delattr(module, attr)
-    return module
-
-builtins.__import__ = secure_importer
-for x in []: delattr(builtins,x)
-
-import pickle
-import pandas as pd
-import numpy as np
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import uuid
-import urllib.parse
-import os
-
-df = pickle.load(open('{df_path}', 'rb'))
-plots_dir = '{td}'
-
-# User code starts here
-{py_code}
-# User code ends here
-
-# Save the result
-if 'result' in locals():
-    with open('{result_path}', 'wb') as f:
-        pickle.dump(result, f)
-
-# Save any plots
-for i in plt.get_fignums():
-    fig = plt.figure(i)
-    plot_filename = f"plot_{{uuid.uuid4().hex}}.jpg"
-    plot_filepath = os.path.join(plots_dir, plot_filename)
-    fig.savefig(plot_filepath)
-    plt.close(fig)
-"""
-        
-        open(path,"w").write(guarded_code)
-        
-        p = subprocess.Popen([sys.executable, path],
-                             preexec_fn=set_limits,
-                             cwd=td,
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+class Cancelled(Exception):
+    pass
+
+
+def sandbox_file(workdir, path, pattern):
+    """
+    Returns `path` if it is a regular file directly in `workdir` whose name matches `pattern`, otherwise None.
+    Paths reported by the sandbox are not trusted: user code could point them at any file of the server.
+    """
+    if not isinstance(path, str) or not pattern.fullmatch(os.path.basename(path)):
+        return None
+    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(workdir):
+        return None
+    try:
+        if not stat.S_ISREG(os.lstat(path).st_mode):
+            return None  # e.g. a symlink to a file outside the sandbox
+    except OSError:
+        return None
+    return path
+
+
+class SandboxWorker:
+    """
+    A sandbox process that runs up to `max_jobs` jobs with the rlimits of the `code_execution` config.
+    """
+
+    def __init__(self, config, max_jobs=1):
+        self.cpu_limit = int(config.get("cpu_limit"))
+        self.mem_limit = int(config.get("mem_limit"))
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        # Jobs run in forks of the worker that set their own limit to `cpu_limit` (see sandbox_worker.run_job),
+        # so the worker itself only needs time for its imports and a little for every fork
+        cpu_total = STARTUP_CPU + max_jobs
+        cpu_hard = max(cpu_total, self.cpu_limit)
+
+        def set_limits():
+            try:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_total, cpu_hard))
+            except (ValueError, resource.error):
+                pass
+            try:
+                resource.setrlimit(resource.RLIMIT_AS, (self.mem_limit, self.mem_limit))
+            except (ValueError, resource.error):
+                pass
+            os.environ["NO_PROXY"] = "*"  # example: block unintended egress
+
+        self.control, worker_control = socket.socketpair()
+        self.process = subprocess.Popen([sys.executable, WORKER_SCRIPT, str(worker_control.fileno()),
+                                         str(self.cpu_limit)],
+                                        preexec_fn=set_limits, start_new_session=True,
+                                        pass_fds=(worker_control.fileno(),),
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        worker_control.close()
+        self.ready = False
+        self.job_pid = None  # The running job's fork, which leads its own process group
+        self.rusage = None  # Resource usage of the worker process, once it has been reaped
+
+    def _receive(self, fd, deadline, cancelled=None):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError
+            # With a cancellation event, wake up regularly to check it
+            wait = remaining if cancelled is None else min(remaining, 0.1)
+            if select.select([fd], [], [], wait)[0]:
+                return receive_message(fd)
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled
+
+    def run(self, job, export, timeout, cancelled=None):
+        """
+        Runs one job and returns the safe_exec result dict; the worker is unusable afterwards if it is not ok.
+        `export(name)` writes the frame the job asks for and returns its path, or None if there is no such frame.
+        Setting the `cancelled` event kills the worker.
+        """
+        started = time.monotonic()
+        deadline = started + timeout  # wall clock, including the imports of a worker that is still starting
+        self.jobs += 1
+        # Fresh pipes for every job: processes a job leaves behind keep only its own
+        job_read, job_write = os.pipe()
+        result_read, result_write = os.pipe()
         try:
-            out, err = p.communicate(timeout=timeout)  # wall clock
-        except subprocess.TimeoutExpired:
-            p.kill()
-            return {"ok":False, "error":"timeout"}
-        
-        if p.returncode == 0:
-            result = None
-            if os.path.exists(result_path):
-                with open(result_path, 'rb') as f:
-                    result = pickle.load(f)
-            
-            plots = [os.path.join(td, f) for f in os.listdir(td) if f.endswith('.jpg')]
-            
-            return {"ok":True, "out":out, "err":err, "result":result, "plots": plots}
+            try:
+                socket.send_fds(self.control, [b"job"], [job_read, result_write])
+            finally:
+                os.close(job_read)
+                os.close(result_write)
+            if not self.ready:
+                self._receive(self.control.fileno(), deadline, cancelled)
+                self.ready = True
+            self.job_pid = self._receive(self.control.fileno(), deadline, cancelled)["pid"]
+            send_message(job_write, dict(job, cpu_limit=self.cpu_limit))
+            try:
+                message = self._receive(result_read, deadline, cancelled)
+                while "frame" in message:
+                    send_message(job_write, {"path": export(message["frame"])})
+                    message = self._receive(result_read, deadline, cancelled)
+                self.job_pid = None  # Done; the worker kills what it left behind
+            except EOFError:
+                # The job died; wait for the worker to exit the same way, so its return code says why
+                while True:
+                    self._receive(self.control.fileno(), deadline, cancelled)
+        except Cancelled:
+            self.close()
+            return {"ok": False, "error": "cancelled", "usage": self._killed_usage(started)}
+        except TimeoutError:
+            self.close()
+            return {"ok": False, "error": "timeout", "usage": self._killed_usage(started)}
+        except (EOFError, OSError):
+            returncode = self.close()
+            usage = self._killed_usage(started)
+            if returncode == -signal.SIGXCPU:
+                return {"ok": False, "out": "", "err": "CPU time limit exceeded", "usage": usage}
+            return {"ok": False, "out": "", "err": f"Sandbox worker exited with code {returncode}", "usage": usage}
+        finally:
+            os.close(job_write)
+            os.close(result_read)
+        usage = message.setdefault("usage", {})
+        message["plots"] = [path for path in message.get("plots") or []
+                            if sandbox_file(job["workdir"], path, PLOT_FILE) is not None]
+        if message.get("ok"):
+            result_path = sandbox_file(job["workdir"], message.pop("result_path", None), RESULT_FILE)
+            written = message.pop("frames_written", None)
+            written = written if isinstance(written, dict) else {}
+            frame_paths = {name: sandbox_file(job["workdir"], path, FRAME_FILE) for name, path in written.items()}
+            if result_path is None or None in frame_paths.values():
+                usage["wall_seconds"] = round(time.monotonic() - started, 6)
+                return {"ok": False, "out": message.get("out", ""), "err": "Sandbox returned an invalid result path",
+                        "plots": message["plots"], "usage": usage}
+            read_started = time.monotonic()
+            message["result"] = read_frame(result_path)
+            message["frames_written"] = {name: read_frame(path) for name, path in frame_paths.items()}
+            usage["result_read_seconds"] = round(time.monotonic() - read_started, 6)
+        usage["wall_seconds"] = round(time.monotonic() - started, 6)
+        return message
+
+    def _killed_usage(self, started):
+        # The worker cannot report on a job it did not finish, so this is what the whole worker used
+        usage = {"wall_seconds": round(time.monotonic() - started, 6)}
+        if self.rusage is not None:
+            usage.update(
+                cpu_user_seconds=round(self.rusage.ru_utime, 6),
+                cpu_sys_seconds=round(self.rusage.ru_stime, 6),
+                peak_rss_bytes=self.rusage.ru_maxrss * 1024,
+            )
+        return usage
+
+    @property
+    def exhausted(self):
+        return self.jobs >= self.max_jobs
+
+    def close(self):
+        self.control.close()
+        if self.job_pid is not None:
+            # A job the worker did not wait for, with everything it started
+            with contextlib.suppress(ProcessLookupError, PermissionError):
+                os.killpg(self.job_pid, signal.SIGKILL)
+        if self.process.returncode is None:
+            # Reaped with wait4 rather than Popen.wait, to get the resource usage of the worker
+            try:
+                # The worker leads its own process group, which includes its parallel_apply processes
+                os.killpg(self.process.pid, signal.SIGKILL)
+                _, status, self.rusage = os.wait4(self.process.pid, 0)
+                self.process.returncode = os.waitstatus_to_exitcode(status)
+            except (ProcessLookupError, ChildProcessError):
+                self.process.wait()
+        return self.process.returncode
+
+
+class SandboxPool:
+    """
+    Pre-started sandbox workers, so a job does not pay for interpreter startup and imports.
+    A worker is replaced after `max_jobs_per_worker` jobs or after any failed job.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.size = int(config.get("pool_size", 0))
+        self.max_jobs = max(1, int(config.get("max_jobs_per_worker", 1)))
+        self._idle = queue.Queue()  # Replacement workers go to the back while they start up
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(self.size):
+            self._idle.put(SandboxWorker(config, self.max_jobs))
+
+    def _replace(self, worker):
+        worker.close()
+        with self._lock:
+            if not self._closed:
+                self._idle.put(SandboxWorker(self.config, self.max_jobs))
+
+    def run(self, job, export, timeout, cancelled=None):
+        worker = self._idle.get()
+        result = worker.run(job, export, timeout, cancelled)
+        if not result.get("ok") or worker.exhausted:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        return result
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _handoff_dir(df, frames, df_name):
+    """
+    SHM_DIR if it has room for the frame bound to `df`, else None for the default (disk) temp directory.
+    """
+    if SHM_DIR is None:
+        return None
+    if df is not None:
+        nbytes = describe_frame(df)["nbytes"]
+    elif df_name in frames:
+        nbytes = frames.info(df_name)["nbytes"] if hasattr(frames, "info") else describe_frame(frames[df_name])["nbytes"]
+    else:
+        nbytes = 0
+    try:
+        free = shutil.disk_usage(SHM_DIR).free
+    except OSError:
+        return None
+    return SHM_DIR if free > (nbytes or 0) else None
+
+
+def run_user_code(py_code:str, df, config, workdir:str=None, pool:SandboxPool=None, frames=None, df_name:str=None,
+                  results=None, cancelled:threading.Event=None, plots_dir:str=None, chunked:dict=None,
+                  write_back=()):
+    """
+    Runs `py_code` in a sandbox. `df` is the frame bound to `df` (by default `frames[df_name]`),
+    and `frames` are the dataframes the code can use by name; each is only written out if the code asks for it.
+    The frames named in `write_back` (names in the code, see code_analysis.analyze_code) come back
+    in `result["frames_written"]`, by the name of the frame in `frames`.
+    `results` are the files of previous results (see ResultStore.paths), exposed as `results_history`.
+    Setting `cancelled` kills the sandbox and returns {"ok": False, "error": "cancelled"}.
+    Plots are rendered as configured in `config.plots` and moved to `plots_dir` before the sandbox directory is removed.
+    With a `chunked` plan (see code_analysis.chunk_plan), `df` is written in batches of `chunked["chunk_rows"]`
+    rows and the code runs on one batch at a time, so the frame never has to fit in the sandbox.
+    """
+    timeout = int(config.timeout)
+    frames = frames if frames is not None else {}
+
+    # Frames returned in `result` stay valid after the directory is removed, as they are memory-mapped
+    with contextlib.ExitStack() as stack:
+        handoff_dir = workdir or _handoff_dir(df, frames, df_name)
+        td = stack.enter_context(tempfile.TemporaryDirectory(dir=handoff_dir))
+        spill = []  # A disk directory for the frames that no longer fit in SHM_DIR, created when needed
+        exported = {}
+        export_usage = {"export_seconds": 0.0, "bytes_in": 0}
+
+        def write(frame, chunk_rows):
+            path = os.path.join(td, f"frame_{len(exported)}")
+            try:
+                return write_frame(path, frame, chunk_rows=chunk_rows)
+            except OSError as e:
+                if e.errno != errno.ENOSPC or SHM_DIR is None or handoff_dir != SHM_DIR:
+                    raise
+            # SHM_DIR filled up after all: this frame goes to disk instead
+            for partial in (path + ".arrow", path + ".pickle"):
+                if os.path.exists(partial):
+                    os.remove(partial)
+            if not spill:
+                spill.append(stack.enter_context(tempfile.TemporaryDirectory()))
+            return write_frame(os.path.join(spill[0], f"frame_{len(exported)}"), frame, chunk_rows=chunk_rows)
+
+        def export(name):
+            if name not in exported:
+                if name is None or (name == df_name and df is not None):
+                    frame = df if df is not None else pd.DataFrame()
+                elif name in frames:
+                    frame = frames[name]
+                else:
+                    return None
+                started = time.monotonic()
+                chunk_rows = chunked["chunk_rows"] if chunked and name == job["df"] else None
+                exported[name] = write(frame, chunk_rows)
+                export_usage["export_seconds"] += time.monotonic() - started
+                export_usage["bytes_in"] += os.path.getsize(exported[name])
+            return exported[name]
+
+        job = {"code": py_code, "workdir": td, "frames": list(frames), "df": df_name if df is None else None,
+               "results": list(results or []), "plots": dict(config.get("plots") or {}), "chunked": chunked,
+               "write_back": list(write_back),
+               "parallel_processes": int(config.get("parallel_processes") or min(4, os.cpu_count() or 1))}
+        if pool is not None:
+            result = pool.run(job, export, timeout, cancelled)
         else:
-            return {"ok":False, "out":out, "err":err}
+            worker = SandboxWorker(config)
+            try:
+                result = worker.run(job, export, timeout, cancelled)
+            finally:
+                worker.close()
+        if "frames_written" in result:
+            result["frames_written"] = {name: frame for name, frame in result["frames_written"].items()
+                                        if isinstance(name, str) and name in frames}
+        if plots_dir and result.get("plots"):
+            result["plots"] = [shutil.move(path, os.path.join(plots_dir, os.path.basename(path))) for path in result["plots"]]
+        export_usage["export_seconds"] = round(export_usage["export_seconds"], 6)
+        result["usage"].update(export_usage)
+        return result
@@ -0,0 +1,671 @@
+"""
+Sandbox worker process for safe_exec.
+
+The worker is started with `sys.executable sandbox_worker.py <control_fd> <cpu_limit>`, where
+`control_fd` is a Unix socket and `cpu_limit` the CPU seconds of every job.
+It imports pandas, numpy and matplotlib once, installs the import guard and then
+receives a pair of pipes per job over the control socket: the job is read from the first
+and its result message written to the second.
+Every job runs in a fresh fork of the worker, in its own session, so nothing a job changes
+(monkeypatches, rlimits, open figures) is seen by the next one, and nothing it leaves
+running outlives it or can reach the pipes of a later job.
+Dataframes go both ways as Arrow IPC files (see write_frame/read_frame), never through the pipe;
+while a job runs, the worker asks for the frames it needs with {"frame": name} messages.
+Only the standard library is imported at module level, so the parent process
+can import the message helpers without the sandbox's dependencies.
+"""
+import ast
+import contextlib
+import io
+import os
+import pickle
+import signal
+import socket
+import struct
+import sys
+import time
+import traceback
+import types
+import urllib.parse
+import uuid
+from collections.abc import Mapping, Sequence
+
+HEADER = struct.Struct("<Q")
+
+
+def send_message(fd, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    view = memoryview(HEADER.pack(len(data)) + data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _read_exactly(fd, size):
+    chunks = []
+    while size:
+        chunk = os.read(fd, min(size, 1 << 20))
+        if not chunk:
+            raise EOFError("sandbox pipe closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def receive_message(fd):
+    (size,) = HEADER.unpack(_read_exactly(fd, HEADER.size))
+    return pickle.loads(_read_exactly(fd, size))
+
+
+def write_frame(path, obj, chunk_rows=None):
+    """
+    Writes a dataframe or series as an uncompressed Arrow IPC file that the reader can memory-map.
+    Anything else, and frames Arrow cannot hold, is pickled. Returns the path of the file written.
+    With `chunk_rows`, the file holds record batches of that many rows for read_frame_chunks.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        try:
+            frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+            # Arrow field names must be strings; the original labels are restored from the metadata
+            names = frame.columns
+            frame = frame.set_axis([str(i) for i in range(frame.shape[1])], axis=1)
+            table = pa.Table.from_pandas(frame, preserve_index=True)
+            metadata = dict(table.schema.metadata or {})
+            metadata[b"columns"] = pickle.dumps(names)
+            if isinstance(obj, pd.Series):
+                metadata[b"series_name"] = pickle.dumps(obj.name)
+            table = table.replace_schema_metadata(metadata)
+            with pa.OSFile(path + ".arrow", "wb") as f:
+                with pa.ipc.new_file(f, table.schema) as writer:
+                    writer.write_table(table, max_chunksize=chunk_rows)
+            return path + ".arrow"
+        except (pa.ArrowException, TypeError, ValueError):
+            pass  # e.g. mixed-type object columns
+    with open(path + ".pickle", "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path + ".pickle"
+
+
+def read_frame(path):
+    """
+    Reads a file written by write_frame without copying its numeric columns.
+
+    The file is mapped copy-on-write, so those columns stay writable: pages are
+    only copied when the frame is modified in place, and never written back.
+    """
+    if path.endswith(".pickle"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    import mmap
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    base_address = np.frombuffer(mapped, dtype=np.uint8).ctypes.data
+    table = pa.ipc.open_file(pa.py_buffer(mapped)).read_all()
+    frame = table.to_pandas(split_blocks=True)
+    columns = []
+    for i in range(frame.shape[1]):
+        column = table.column(i)
+        values = frame.iloc[:, i].to_numpy(copy=False)
+        arrow_type = column.type
+        if (column.num_chunks == 1 and column.null_count == 0
+                and (pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type))
+                and frame.dtypes.iloc[i] == np.dtype(arrow_type.to_pandas_dtype())):
+            chunk = column.chunk(0)
+            offset = chunk.buffers()[1].address - base_address + chunk.offset * values.itemsize
+            values = np.frombuffer(mapped, dtype=values.dtype, count=len(chunk), offset=offset)
+        else:
+            values = frame.iloc[:, i].array
+        columns.append(values)
+    frame = pd.DataFrame(dict(enumerate(columns)), index=frame.index, copy=False)
+    frame.columns = pickle.loads(table.schema.metadata[b"columns"])
+    series_name = table.schema.metadata.get(b"series_name")
+    if series_name is not None:
+        return frame.iloc[:, 0].rename(pickle.loads(series_name))
+    return frame
+
+
+def read_frame_chunks(path):
+    """
+    Yields the record batches of a file written by write_frame as dataframes, one at a time.
+    The batches are read rather than mapped, so only one of them takes memory.
+    """
+    if path.endswith(".pickle"):
+        yield read_frame(path)
+        return
+    import pyarrow as pa
+
+    with pa.OSFile(path, "rb") as f:
+        reader = pa.ipc.open_file(f)
+        columns = pickle.loads(reader.schema.metadata[b"columns"])
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            frame = pa.Table.from_batches([batch], schema=reader.schema).to_pandas()
+            del batch
+            frame.columns = columns
+            yield frame
+
+
+def combine_chunks(plan, partials):
+    """
+    Combines the results of running a chunk plan (see code_analysis.chunk_plan) on every chunk.
+    """
+    pd = libs.pd
+    merge = {"sum": "sum", "count": "sum", "size": "sum", "min": "min", "max": "max"}
+
+    def reduce(how, values):
+        if plan["mode"] == "groupby":
+            combined = pd.concat(values)
+            return getattr(combined.groupby(level=list(range(combined.index.nlevels))), how)()
+        if isinstance(values[0], pd.Series):  # One value per column
+            return getattr(pd.concat(values, axis=1), how)(axis=1)
+        return getattr(pd.Series(values), how)()
+
+    if plan["mode"] == "rows":
+        return pd.concat(partials)
+    if plan["reducer"] == "mean":
+        sums, counts = zip(*partials)
+        return reduce("sum", sums) / reduce("sum", counts)
+    return reduce(merge[plan["reducer"]], partials)
+
+
+class LazyFrames(Mapping):
+    """
+    The server's dataframes by name. A frame is requested from the server and
+    mapped with read_frame the first time it is looked up.
+    """
+
+    def __init__(self, names, request, read=read_frame):
+        self._names = list(names)
+        self._request = request
+        self._read = read
+        self._frames = {}
+
+    def __getitem__(self, name):
+        if name not in self._frames:
+            if name not in self._names:
+                raise KeyError(name)
+            self._frames[name] = self._read(self._request(name))
+        return self._frames[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __repr__(self):
+        return f"LazyFrames({self._names!r})"
+
+    def loaded(self):
+        return list(self._frames)
+
+
+class LazyResults(Sequence):
+    """
+    The server's recent results, oldest first; each one is mapped the first time it is indexed.
+    """
+
+    def __init__(self, paths, read=read_frame):
+        self._paths = list(paths)
+        self._read = read
+        self._results = {}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self._paths))[i]]
+        path = self._paths[i]
+        if path not in self._results:
+            self._results[path] = self._read(path)
+        return self._results[path]
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __repr__(self):
+        return f"LazyResults({len(self._paths)} results)"
+
+    def loaded(self):
+        return list(self._results)
+
+
+class JobUsage:
+    """
+    What one job cost the worker: CPU time and peak RSS, and the time spent
+    mapping inputs, running the code and writing the result.
+    """
+
+    def __init__(self, resource):
+        self._resource = resource
+        self._started = time.perf_counter()
+        self._rusage = resource.getrusage(resource.RUSAGE_SELF)
+        self._children = resource.getrusage(resource.RUSAGE_CHILDREN)  # parallel_apply/parallel_groupby processes
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # Resets the peak RSS (VmHWM) to the current RSS
+        except OSError:
+            pass
+        self.load_seconds = 0.0
+        self.code_seconds = 0.0
+        self.write_seconds = 0.0
+        self.bytes_out = 0
+        self.chunks = 0  # Row chunks the code ran on, in chunked mode
+        self.parallel_tasks = 0  # Partitions run by parallel_apply/parallel_groupby
+
+    def read(self, path):
+        started = time.perf_counter()
+        try:
+            return read_frame(path)
+        finally:
+            self.load_seconds += time.perf_counter() - started
+
+    def write(self, path, obj):
+        started = time.perf_counter()
+        path = write_frame(path, obj)
+        self.write_seconds += time.perf_counter() - started
+        self.bytes_out += os.path.getsize(path)
+        return path
+
+    def _peak_rss(self):
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return self._resource.getrusage(self._resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak of the whole worker
+
+    def report(self):
+        rusage = self._resource.getrusage(self._resource.RUSAGE_SELF)
+        children = self._resource.getrusage(self._resource.RUSAGE_CHILDREN)
+        return {
+            "worker_seconds": round(time.perf_counter() - self._started, 6),
+            "cpu_user_seconds": round(rusage.ru_utime - self._rusage.ru_utime
+                                      + children.ru_utime - self._children.ru_utime, 6),
+            "cpu_sys_seconds": round(rusage.ru_stime - self._rusage.ru_stime
+                                     + children.ru_stime - self._children.ru_stime, 6),
+            "peak_rss_bytes": self._peak_rss(),
+            "load_seconds": round(self.load_seconds, 6),
+            "code_seconds": round(self.code_seconds, 6),
+            "result_write_seconds": round(self.write_seconds, 6),
+            "bytes_out": self.bytes_out,
+            "chunks": self.chunks,
+            "parallel_tasks": self.parallel_tasks,
+        }
+
+
+def referenced_names(code):
+    """
+    Returns every identifier the code uses, or None if it does not parse.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+
+
+BLACKLIST = ["resource"]  # The worker keeps its own rlimits out of reach of user code
+
+
+def install_import_guard():
+    import builtins
+
+    original_import = builtins.__import__
+
+    def secure_importer(name, globals=None, locals=None, fromlist=(), level=0):
+        if name in BLACKLIST:
+            raise ImportError(f"Import of module '{name}' is not allowed.")
+
+        module = original_import(name, globals, locals, fromlist, level)
+        if name == 'subprocess':
+            for attr in ['call', 'run', 'Popen', 'check_call', 'check_output']:
+                if hasattr(module, attr):
+                    delattr(module, attr)
+        elif name == 'shutil':
+            for attr in ['move', 'copy', 'copy2', 'copyfile', 'copytree', 'rmtree', 'chown']:
+                if hasattr(module, attr):
+                    delattr(module, attr)
+        return module
+
+    builtins.__import__ = secure_importer
+
+
+libs = types.SimpleNamespace()  # Filled by main() before the import guard is installed
+
+
+PLOT_FORMATS = ("png", "svg", "webp", "jpg")
+
+
+def minmax_indices(y, max_points):
+    """
+    Indices of the minimum and maximum of `y` in each of max_points / 2 equal buckets, in order.
+    Decimating a line to these points keeps its visual envelope (spikes included).
+    """
+    np = libs.np
+    n = len(y)
+    buckets = max(1, max_points // 2)
+    if n <= max_points:
+        return np.arange(n)
+    size = -(-n // buckets)  # Points per bucket; the last bucket is padded
+    padding = buckets * size - n
+    low = np.concatenate([np.where(np.isnan(y), np.inf, y), np.full(padding, np.inf)]).reshape(buckets, size)
+    high = np.concatenate([np.where(np.isnan(y), -np.inf, y), np.full(padding, -np.inf)]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    indices = np.unique(np.concatenate([offsets + low.argmin(axis=1), offsets + high.argmax(axis=1), [0, n - 1]]))
+    return indices[indices < n]
+
+
+def save_figures(workdir, settings):
+    """
+    Saves and closes every open figure in `workdir`, in the configured format and dpi.
+    Lines and scatter plots with more than `max_points` points are decimated first,
+    so that rendering stays within the CPU limit. Returns (paths, number of decimated artists).
+    """
+    np, plt = libs.np, libs.plt
+    fmt = settings.get("format", "png")
+    fmt = fmt if fmt in PLOT_FORMATS else "png"
+    dpi = settings.get("dpi", 100)
+    max_points = int(settings.get("max_points", 0))
+    paths, downsampled = [], 0
+    for i in plt.get_fignums():
+        fig = plt.figure(i)
+        if max_points:
+            for ax in fig.axes:
+                for line in ax.get_lines():
+                    x, y = line.get_data(orig=True)
+                    if len(y) <= max_points:
+                        continue
+                    try:
+                        indices = minmax_indices(np.asarray(y, dtype=float), max_points)
+                    except (TypeError, ValueError):
+                        continue  # Not numeric
+                    line.set_data(np.asarray(x)[indices], np.asarray(y)[indices])
+                    downsampled += 1
+                for collection in ax.collections:
+                    offsets = collection.get_offsets()
+                    if len(offsets) <= max_points:
+                        continue
+                    # Evenly spaced points of a scatter plot; they have no order to take extremes from
+                    indices = np.linspace(0, len(offsets) - 1, max_points).astype(np.int64)
+                    collection.set_offsets(offsets[indices])
+                    for getter, setter in ((collection.get_array, collection.set_array),
+                                           (collection.get_sizes, collection.set_sizes)):
+                        values = getter()
+                        if values is not None and len(values) == len(offsets):
+                            setter(values[indices])
+                    downsampled += 1
+        path = os.path.join(workdir, f"plot_{uuid.uuid4().hex}.{fmt}")
+        fig.savefig(path, format=fmt, dpi=dpi)
+        plt.close(fig)
+        paths.append(path)
+    return paths, downsampled
+
+
+def parallel_map(fn, parts, settings):
+    """
+    Returns [fn(part) for part in parts], computed in forked processes, at most settings["processes"] at a time.
+
+    The processes inherit the worker's address space limit and get the job's CPU limit
+    each; they are in the worker's process group, so they die with it on a timeout.
+    Results come back pickled through files in the job's directory.
+    """
+    resource = libs.resource
+    results, running, pending = [None] * len(parts), {}, list(enumerate(parts))
+    try:
+        while pending or running:
+            while pending and len(running) < settings["processes"]:
+                i, part = pending.pop(0)
+                path = os.path.join(settings["workdir"], f"parallel_{uuid.uuid4().hex}.pickle")
+                pid = os.fork()
+                if pid == 0:
+                    status = 0
+                    try:
+                        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+                        resource.setrlimit(resource.RLIMIT_CPU, (min(settings["cpu_limit"], hard), hard))
+                        value = fn(part)
+                    except BaseException as e:
+                        value, status = "".join(traceback.format_exception(type(e), e, e.__traceback__)), 1
+                    try:
+                        with open(path, "wb") as f:
+                            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    except BaseException:
+                        status = 2
+                    os._exit(status)
+                running[pid] = (i, path)
+            pid, status = os.waitpid(-1, 0)
+            i, path = running.pop(pid)
+            returncode = os.waitstatus_to_exitcode(status)
+            if returncode in (0, 1):
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+                os.remove(path)
+                if returncode == 1:
+                    raise RuntimeError(f"Partition {i} failed:\n{value}")
+                results[i] = value
+            elif returncode == 2:
+                raise RuntimeError(f"Partition {i} returned a result that cannot be pickled")
+            else:
+                reason = "CPU time limit exceeded" if returncode == -signal.SIGXCPU else f"exit code {returncode}"
+                raise RuntimeError(f"Partition {i} was killed ({reason})")
+    finally:
+        for pid in running:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+    settings["tasks"] = settings.get("tasks", 0) + len(parts)
+    return results
+
+
+def _concat(results):
+    pd = libs.pd
+    if results and all(isinstance(r, (pd.DataFrame, pd.Series)) for r in results):
+        return pd.concat(results)
+    return results
+
+
+def parallel_apply(df, fn, settings, partitions=None):
+    """
+    Calls fn on row partitions of df in parallel and concatenates the results (a list if they are not frames).
+    """
+    np = libs.np
+    n = max(1, min(partitions or settings["processes"], len(df)))
+    bounds = np.linspace(0, len(df), n + 1).astype(int)
+    return _concat(parallel_map(fn, [df.iloc[a:b] for a, b in zip(bounds[:-1], bounds[1:])], settings))
+
+
+def parallel_groupby(df, by, fn, settings):
+    """
+    Equivalent of df.groupby(by).apply(fn), with whole groups spread over the processes.
+    """
+    codes = df.groupby(by).ngroup().to_numpy()  # -1 for rows with a missing key, which groupby drops
+    n = max(1, min(settings["processes"], codes.max() + 1 if len(codes) else 1))
+    parts = [df[(codes >= 0) & (codes % n == i)] for i in range(n)]
+    results = parallel_map(lambda part: part.groupby(by).apply(fn), parts, settings)
+    keys = len(by) if isinstance(by, list) else 1
+    combined = _concat(results)
+    if isinstance(combined, list):
+        return combined
+    return combined.sort_index(level=list(range(keys)), sort_remaining=False, kind="stable")
+
+
+def run_job(job, request_frame, usage):
+    resource, matplotlib, plt, np, pd = libs.resource, libs.matplotlib, libs.plt, libs.np, libs.pd
+
+    # The job runs in a fork whose CPU time starts at zero. Lowering the hard limit too means that
+    # code which gets hold of the resource module anyway cannot raise its own limit
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = job["cpu_limit"] if hard == resource.RLIM_INFINITY else min(job["cpu_limit"], hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, limit))
+
+    # Every job gets fresh globals with the same names the one-shot script used to provide
+    frames = LazyFrames(job["frames"], request_frame, read=usage.read)
+    namespace = {
+        "__name__": "__main__", "dataframes": frames, "plots_dir": job["workdir"],
+        "pd": pd, "np": np, "matplotlib": matplotlib, "plt": plt,
+        "pickle": pickle, "os": os, "uuid": uuid, "urllib": urllib,
+    }
+    # Only the frames the code names are mapped up front; `dataframes[...]` maps the others on demand
+    names = referenced_names(job["code"])
+    for name in job["frames"]:
+        if name.isidentifier() and name not in namespace and (names is None or name in names):
+            namespace[name] = frames[name]
+    results = LazyResults(job.get("results", []), read=usage.read)
+    namespace["results_history"] = results
+    parallel = {"processes": job.get("parallel_processes", 1), "cpu_limit": job["cpu_limit"], "workdir": job["workdir"]}
+    namespace["parallel_apply"] = lambda df, fn, partitions=None: parallel_apply(df, fn, parallel, partitions)
+    namespace["parallel_groupby"] = lambda df, by, fn: parallel_groupby(df, by, fn, parallel)
+    if names is None or "last_result" in names:
+        namespace["last_result"] = results[-1] if results else None
+    chunked = job.get("chunked")
+    if chunked is None and (names is None or "df" in names):
+        namespace["df"] = frames[job["df"]] if job["df"] in frames else usage.read(request_frame(None))
+    out, err = io.StringIO(), io.StringIO()
+    previous_cwd = os.getcwd()
+    os.chdir(job["workdir"])
+    started, loading = time.perf_counter(), usage.load_seconds
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            if chunked is None:
+                exec(compile(job["code"], "user_code.py", "exec"), namespace)
+            else:
+                # `df` is bound to one chunk of rows at a time, and the chunk results are combined
+                code, partials = compile(chunked["code"], "user_code.py", "exec"), []
+                chunks = read_frame_chunks(request_frame(job["df"]))
+                while True:
+                    read_started = time.perf_counter()
+                    chunk = next(chunks, None)
+                    usage.load_seconds += time.perf_counter() - read_started
+                    if chunk is None:
+                        break
+                    chunk_namespace = dict(namespace, df=chunk)
+                    exec(code, chunk_namespace)
+                    partials.append(chunk_namespace.get("result"))
+                    del chunk, chunk_namespace
+                namespace["result"] = combine_chunks(chunked, partials)
+                usage.chunks = len(partials)
+    except BaseException as e:
+        plt.close("all")
+        # Report the traceback from the user's code onwards, as the one-shot script did
+        tb = "".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next))
+        return {"ok": False, "out": out.getvalue(), "err": err.getvalue() + tb}
+    finally:
+        os.chdir(previous_cwd)
+        usage.parallel_tasks = parallel.get("tasks", 0)
+        # Frames the code maps on demand count as loading, not as running the code
+        usage.code_seconds = time.perf_counter() - started - (usage.load_seconds - loading)
+
+    plots, downsampled = save_figures(job["workdir"], job.get("plots") or {})
+
+    # The frames the code changed go back under their own names, then the ones changed through `dataframes`,
+    # then `df` under the name of the frame it was bound to
+    changed = {}
+    for name in sorted(job.get("write_back") or [], key=lambda name: (name == "df", name == "dataframes")):
+        if name == "dataframes":
+            candidates = [(loaded, frames[loaded]) for loaded in frames.loaded()]
+        elif name == "df":
+            candidates = [(job["df"], namespace.get("df"))] if job["df"] is not None else []
+        else:
+            candidates = [(name, namespace.get(name))]
+        for key, frame in candidates:
+            if isinstance(frame, pd.DataFrame):
+                changed.setdefault(key, frame)
+
+    try:
+        result_path = usage.write(os.path.join(job["workdir"], "result"), namespace.get("result"))
+        frames_written = {
+            name: usage.write(os.path.join(job["workdir"], f"written_{i}"), frame)
+            for i, (name, frame) in enumerate(changed.items())
+        }
+    except Exception as e:
+        return {"ok": False, "out": out.getvalue(), "err": f"Cannot return result: {e}"}
+    return {"ok": True, "out": out.getvalue(), "err": err.getvalue(), "result_path": result_path, "plots": plots,
+            "downsampled": downsampled, "results_loaded": results.loaded(), "frames_written": frames_written,
+            "frames_loaded": frames.loaded() + ([job["df"]] if chunked and job["df"] else [])}
+
+
+def exit_like(status, cpu_seconds, cpu_limit):
+    """
+    Ends this process the way a job's fork with wait `status` ended, so the server sees why it failed.
+    """
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        if signum == signal.SIGKILL and cpu_seconds >= cpu_limit - 0.1:
+            # Its soft and hard CPU limits are equal, and the kernel sends SIGKILL rather than SIGXCPU at the hard one.
+            # The rusage of the fork is sampled per tick, so it can be a few milliseconds short of the limit
+            signum = signal.SIGXCPU
+        with contextlib.suppress(OSError, ValueError):
+            signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+    os._exit(os.waitstatus_to_exitcode(status) or 1)
+
+
+def main(control_fd, cpu_limit):
+    # Pre-import everything user code typically needs, before the import guard is installed
+    import resource
+    import pandas
+    import numpy
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot
+
+    libs.__dict__.update(resource=resource, pd=pandas, np=numpy, matplotlib=matplotlib, plt=matplotlib.pyplot)
+
+    install_import_guard()
+    control = socket.socket(fileno=control_fd)
+    send_message(control_fd, {"ready": True})
+    while True:
+        _, fds, _, _ = socket.recv_fds(control, 16, 2)
+        if len(fds) != 2:
+            return  # The server closed the control socket
+        job_fd, result_fd = fds
+
+        # This process stays as it was after the imports; the job gets a copy-on-write fork of it
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                # Its own session, so it and whatever it starts can be killed as one process group,
+                # and without the control socket, so only the server can hand out pipes
+                os.setsid()
+                control.close()
+                job = receive_message(job_fd)
+
+                def request_frame(name):
+                    send_message(result_fd, {"frame": name})
+                    path = receive_message(job_fd)["path"]
+                    if path is None:
+                        raise KeyError(name)
+                    return path
+
+                usage = JobUsage(resource)
+                message = run_job(job, request_frame, usage)
+                message["usage"] = usage.report()
+                send_message(result_fd, message)
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(job_fd)
+        os.close(result_fd)
+        send_message(control_fd, {"pid": pid})
+        # Not os.wait4, which imports the resource module behind the import guard
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        _, status = os.waitpid(pid, 0)
+        # Processes the job left behind still hold its pipes
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(pid, signal.SIGKILL)
+        if status != 0:
+            rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu_seconds = rusage.ru_utime - children.ru_utime + rusage.ru_stime - children.ru_stime
+            exit_like(status, cpu_seconds, cpu_limit)  # The job died without reporting back
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]), int(sys.argv[2]))
@@ -1,18 +1,111 @@
+import hashlib
+import json
 import pickle
 import os
+import struct
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import pandas as pd
 from .logging_service import logging_service
+from .workspace import FrameRef, Workspace, describe_frame
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, states are then stored as pickles only
+    pa = None
+    pq = None
+
+STORAGE_FORMATS = ("arrow", "parquet", "pickle")
+BLOB_EXTENSIONS = {"arrow": ".arrow", "parquet": ".parquet", "pickle": ".pkl"}
+CODECS = ("none", "lz4", "zstd")
+# Pickled blobs carry their codec in the extension; Arrow and Parquet files describe it themselves
+PICKLE_CODEC_EXTENSIONS = {"lz4": ".pkl.lz4", "zstd": ".pkl.zst"}
 
 
 class StorageService:
+    """
+    Content-addressed store for workspace states.
+
+    Every column is written once per content version into `blobs/<digest>.<ext>`
+    (next to small pickled blobs for the row index and the column names), and
+    every saved workspace state is a small `state_<ts>.json` manifest that maps
+    dataframe names to their blobs. Saving a state therefore only writes the
+    columns whose content has not been stored before: a frame that gains one
+    derived column costs one column's worth of I/O.
+
+    Versions are tracked in `index.jsonl`, an append-only write-ahead journal of
+    commits (id, parent, timestamp, sizes) and head moves. A commit records only
+    the operations (upload, set, rename, remove) that turn its parent into it;
+    every `checkpoint_every` commits a full manifest is written instead. Every
+    record is a single checksummed, fsynced append made after the blobs it
+    points at are durable, so a torn write is detected and truncated at startup
+    and a version is rebuilt by replaying its records from the last checkpoint.
+    The journal is replayed once at startup, after which latest, pop, checkout
+    and listing are in-memory lookups.
+
+    With `write_behind` enabled, `save_state` only queues a snapshot for a
+    background writer thread. Snapshots queued while a write is in progress are
+    coalesced so only the newest one is written; `flush` waits for the queue to
+    drain and runs before every read of the version history and on shutdown.
+
+    `compact` applies the retention policy (the last N versions plus the newest
+    version of each recent hour and day, and always the head), relinks the kept
+    versions to their nearest kept ancestor, rewrites the index and deletes the
+    manifests and blobs no longer referenced by any kept version.
+
+    Columns are stored in the configured columnar format (Arrow IPC or Parquet)
+    when they can be represented in it, and pickled otherwise. Arrow IPC blobs
+    are memory-mapped on load, so only the pages of the columns that are
+    actually touched are read from disk.
+
+    Blobs can be compressed with lz4 or zstd (`storage.compression`). The codec
+    is recorded in every blob and in every commit record, so snapshots written
+    with different codecs can be read side by side. Uncompressed Arrow blobs are
+    the only ones that stay zero-copy on load. Columns of large frames are
+    encoded and compressed on a thread pool.
+    """
+
     def __init__(self, storage_dir_relative_to_project_root="server/storage"):
         current_file_dir = os.path.dirname(os.path.abspath(__file__))
         app_dir = os.path.dirname(current_file_dir)
         server_dir = os.path.dirname(app_dir)
         project_root = os.path.dirname(server_dir)
         self.storage_dir = os.path.join(project_root, storage_dir_relative_to_project_root)
-        if not os.path.exists(self.storage_dir):
-            os.makedirs(self.storage_dir)
+        self.blobs_dir = os.path.join(self.storage_dir, "blobs")
+        if not os.path.exists(self.blobs_dir):
+            os.makedirs(self.blobs_dir)
+        # id(frame) -> (weakref to frame, manifest entry). Frames are treated as immutable once they
+        # are handed to the storage, so an object we have already stored is never hashed again.
+        self._known_entries = {}
+        self._columns = {}  # column blob -> (weakref to a loaded frame holding it, column position)
+        self._fingerprints = {}  # id(frame) -> (weakref to frame, fingerprint) of frames that are not stored
+        self.format = "arrow" if pa is not None else "pickle"
+        self.codec = "none"
+        self.codec_level = None  # Codec default
+        self.compression_threads = 4
+        self.parallel_threshold = 64 * 2**20  # Frames larger than this are written on a thread pool
+        self.index_path = os.path.join(self.storage_dir, "index.jsonl")
+        self._lock = threading.RLock()
+        self._versions = {}  # version id -> commit record, in commit order
+        self._head = None
+        self._frames_cache = OrderedDict()  # version id -> manifest frames, for the most recent lookups
+        self.checkpoint_every = 50
+        self.fsync = True
+        self._load_index()
+        self.write_behind = False
+        self._pending = None  # Newest snapshot waiting for the background writer
+        self._writing = False
+        self._write_error = None
+        self._writer = None
+        self._writer_cond = threading.Condition()
+        self.retention = {"keep_last": 50, "hourly": 24, "daily": 7}
+        self.compact_every = 0  # Compact automatically after this many commits, 0 disables
+        self._commits_since_compaction = 0
 
     def log(self, message):
         if logging_service.get_logging_level("storage") == "on":
@@ -23,37 +116,738 @@ class StorageService:
             else:
                 print(f"[StorageService] {message}")
 
+    def configure(self, config):
+        """
+        Applies the `storage` section of the Hydra config.
+        """
+        storage_format = config.get("format", self.format)
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown storage format: {storage_format}")
+        if storage_format != "pickle" and pa is None:
+            self.log(f"pyarrow is not installed, falling back to pickle instead of {storage_format}")
+            storage_format = "pickle"
+        self.format = storage_format
+        compression = config.get("compression") or {}
+        codec = compression.get("codec", self.codec)
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression codec: {codec}")
+        if codec != "none" and pa is None:
+            self.log(f"pyarrow is not installed, {codec} compression is disabled")
+            codec = "none"
+        self.codec = codec
+        self.codec_level = compression.get("level", self.codec_level)
+        self.compression_threads = int(compression.get("threads", self.compression_threads))
+        self.write_behind = bool(config.get("write_behind", self.write_behind))
+        retention = config.get("retention") or {}
+        for key in self.retention:
+            self.retention[key] = int(retention.get(key, self.retention[key]))
+        self.compact_every = int(config.get("compact_every", self.compact_every))
+        self.checkpoint_every = int(config.get("checkpoint_every", self.checkpoint_every))
+        self.fsync = bool(config.get("fsync", self.fsync))
+
     def health(self):
-        # For now, we'll just check if the storage directory exists
-        if os.path.exists(self.storage_dir):
-            return "OK"
-        else:
+        if not os.path.exists(self.storage_dir):
             return "Error: Storage directory not found"
+        if self._write_error is not None:
+            return f"Error: background save failed: {self._write_error}"
+        return "OK"
+
+    def _remember_entry(self, obj, entry):
+        key = id(obj)
+        try:
+            self._known_entries[key] = (weakref.ref(obj, lambda _, key=key: self._known_entries.pop(key, None)), entry)
+        except TypeError:
+            pass  # Not weak-referenceable, it will simply be hashed again next time
+
+    def _known_entry(self, obj):
+        known = self._known_entries.get(id(obj))
+        if known is not None and known[0]() is obj:
+            return known[1]
+        return None
+
+    def _hash(self, *parts):
+        h = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else str(part).encode())
+        return h.hexdigest()
+
+    def _column_digest(self, column):
+        # Only dtype and values: the column name and the row index live in their own blobs
+        try:
+            values = pd.util.hash_pandas_object(column, index=False).to_numpy().tobytes()
+            if column.dtype == object:
+                # Object cells are hashed by their string form, so 1 and '1' need their types mixed in
+                types = pd.util.hash_pandas_object(column.map(type, na_action=None).astype(str), index=False)
+                values += types.to_numpy().tobytes()
+        except TypeError:
+            # Unhashable cells (lists, dicts, ...): fall back to hashing the pickled values
+            values = pickle.dumps(column.array, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._hash("column", repr(column.dtype), values)
+
+    def fingerprint(self, obj):
+        """
+        Returns a content digest of a frame, series, other object or FrameRef, without hydrating refs.
+        Equal contents have the same fingerprint whether they are stored or not.
+        """
+        entry = obj.entry if isinstance(obj, FrameRef) else self._known_entry(obj)
+        if entry is not None:
+            return self._hash(*(blob.split(".")[0] for blob in self._entry_blobs(entry)))
+        known = self._fingerprints.get(id(obj))
+        if known is not None and known[0]() is obj:
+            return known[1]
+
+        def pickle_digest(value):
+            return self._hash("pickle", pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+        # Same parts, in the same order, as the blobs of a manifest entry
+        if isinstance(obj, pd.DataFrame):
+            parts = [self._column_digest(obj.iloc[:, i]) for i in range(obj.shape[1])]
+            parts += [pickle_digest(obj.index), pickle_digest(obj.columns)]
+        elif isinstance(obj, pd.Series):
+            parts = [self._column_digest(obj), pickle_digest(obj.index), pickle_digest(obj.name)]
+        else:
+            parts = [pickle_digest(obj)]
+        fingerprint = self._hash(*parts)
+        key = id(obj)
+        try:
+            self._fingerprints[key] = (weakref.ref(obj, lambda _, key=key: self._fingerprints.pop(key, None)), fingerprint)
+        except TypeError:
+            pass
+        return fingerprint
+
+    def _find_blob(self, digest):
+        for ext in (*BLOB_EXTENSIONS.values(), *PICKLE_CODEC_EXTENSIONS.values()):
+            blob = f"{digest}{ext}"
+            if os.path.exists(os.path.join(self.blobs_dir, blob)):
+                return blob
+        return None
+
+    def _write_atomic(self, path, write):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                write(f)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+    def _arrow_codec(self):
+        if self.codec == "none":
+            return None
+        return pa.Codec(self.codec, compression_level=self.codec_level)
+
+    def _survives_arrow(self, column, table):
+        """
+        True if the column comes back from `table` with its dtype and, for object columns, its element types.
+        Plain numpy numbers, booleans and datetimes always do and are not converted back to check.
+        """
+        if not isinstance(column.dtype, pd.api.extensions.ExtensionDtype) and column.dtype.kind in "biufM":
+            return True
+        restored = table.to_pandas(split_blocks=True)["values"]
+        if restored.dtype != column.dtype:
+            return False
+        if column.dtype == object:
+            # e.g. lists come back as ndarrays and NaN as None
+            return restored.map(type, na_action=None).equals(column.map(type, na_action=None).reset_index(drop=True))
+        return True
+
+    def _write_columnar(self, column, path):
+        table = pa.Table.from_pandas(column.to_frame("values"), preserve_index=False)
+        if not self._survives_arrow(column, table):
+            raise TypeError(f"dtype {column.dtype} does not survive a round trip through {self.format}")
+        if self.format == "parquet":
+            compression = self.codec if self.codec != "none" else None
+            self._write_atomic(
+                path, lambda f: pq.write_table(table, f, compression=compression, compression_level=self.codec_level)
+            )
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=self._arrow_codec(), use_threads=True)
+
+            def write(f):
+                with pa.ipc.new_file(f, table.schema, options=options) as writer:
+                    writer.write_table(table)
+
+            self._write_atomic(path, write)
+
+    def _write_blob(self, digest, payload):
+        """
+        Writes a column (Series) or pickled bytes under `digest` unless it is already stored.
+        Returns the blob file name and the number of bytes written.
+        """
+        blob = self._find_blob(digest)
+        if blob is not None:
+            return blob, 0
+
+        storage_format = self.format if isinstance(payload, pd.Series) else "pickle"
+        if storage_format != "pickle":
+            blob = f"{digest}{BLOB_EXTENSIONS[storage_format]}"
+            try:
+                self._write_columnar(payload, os.path.join(self.blobs_dir, blob))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, TypeError, ValueError) as e:
+                self.log(f"Cannot store blob {digest} as {storage_format}, pickling it instead: {e}")
+                storage_format = "pickle"
+
+        if storage_format == "pickle":
+            if isinstance(payload, pd.Series):
+                payload = pickle.dumps(payload.array, protocol=pickle.HIGHEST_PROTOCOL)
+            codec = self._arrow_codec()
+            if codec is None:
+                blob = f"{digest}{BLOB_EXTENSIONS['pickle']}"
+                data = [payload]
+            else:
+                # The uncompressed size is needed to decompress in one shot
+                blob = f"{digest}{PICKLE_CODEC_EXTENSIONS[self.codec]}"
+                data = [struct.pack("<Q", len(payload)), codec.compress(payload, asbytes=True)]
+            self._write_atomic(os.path.join(self.blobs_dir, blob), lambda f: f.writelines(data))
+        self.log(f"Wrote blob {blob}")
+        return blob, os.path.getsize(os.path.join(self.blobs_dir, blob))
+
+    def _read_pickle(self, blob):
+        with open(os.path.join(self.blobs_dir, blob), "rb") as f:
+            for codec, ext in PICKLE_CODEC_EXTENSIONS.items():
+                if blob.endswith(ext):
+                    (size,) = struct.unpack("<Q", f.read(8))
+                    return pickle.loads(pa.Codec(codec).decompress(f.read(), decompressed_size=size, asbytes=True))
+            return pickle.load(f)
+
+    def _shared_column(self, blob):
+        # Columns shared between versions are shared in memory too while a frame using them is alive
+        shared = self._columns.get(blob)
+        obj = shared[0]() if shared is not None else None
+        if obj is None:
+            return None
+        column = obj.iloc[:, shared[1]] if isinstance(obj, pd.DataFrame) else obj
+        return column.to_numpy() if isinstance(column.array, pd.arrays.NumpyExtensionArray) else column.array
+
+    def _share_columns(self, obj, blobs):
+        def forget(ref):
+            for blob in blobs:
+                if self._columns.get(blob, (None,))[0] is ref:
+                    del self._columns[blob]
+
+        ref = weakref.ref(obj, forget)
+        for position, blob in enumerate(blobs):
+            self._columns[blob] = (ref, position)
+
+    def _read_column(self, blob):
+        column = self._shared_column(blob)
+        if column is not None:
+            return column
+        path = os.path.join(self.blobs_dir, blob)
+        if blob.endswith(BLOB_EXTENSIONS["arrow"]):
+            # Zero-copy: the column is backed by the read-only memory map
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            column = table.to_pandas(split_blocks=True)["values"].array
+        elif blob.endswith(BLOB_EXTENSIONS["parquet"]):
+            column = pq.read_table(path, memory_map=True).to_pandas(split_blocks=True)["values"].array
+        else:
+            column = self._read_pickle(blob)
+        if isinstance(column, pd.arrays.NumpyExtensionArray):
+            # Plain ndarrays are put into frames without copying or consolidating them
+            column = column.to_numpy()
+        return column
+
+    def _checksum(self, record):
+        return zlib.crc32(json.dumps(record, sort_keys=True).encode("utf-8"))
+
+    def _append_index(self, record, index_path=None):
+        record = dict(record, crc=self._checksum(record))
+        line = (json.dumps(record, sort_keys=True) + "\n").encode("utf-8")
+        # A single O_APPEND write per record, so concurrent readers never see half a record
+        fd = os.open(index_path or self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _apply_index_record(self, record):
+        if record["op"] == "commit":
+            self._versions[record["id"]] = record
+            self._head = record["id"]
+        elif record["op"] == "head":
+            self._head = record["id"]
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            self._migrate_state_files()
+            return
+        good_offset = 0
+        with open(self.index_path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                    crc = record.pop("crc", None)
+                    if crc is not None and crc != self._checksum(record):
+                        raise ValueError("checksum mismatch")
+                except ValueError as e:
+                    # A torn write: drop it and everything after it, so new records follow the last good one
+                    self.log(f"Truncating journal at byte {good_offset}: {e}")
+                    break
+                self._apply_index_record(record)
+                good_offset += len(line)
+        if good_offset != os.path.getsize(self.index_path):
+            with open(self.index_path, "r+b") as f:
+                f.truncate(good_offset)
+
+    def _migrate_state_files(self):
+        # Build the index from state files written before it existed, oldest first
+        files = sorted(f for f in os.listdir(self.storage_dir) if f.startswith("state_") and f.endswith((".json", ".pkl")))
+        parent = None
+        for file_name in files:
+            file_path = os.path.join(self.storage_dir, file_name)
+            version_id = file_name[len("state_"):].rsplit(".", 1)[0]
+            try:
+                ts = datetime.strptime(version_id, "%Y%m%d%H%M%S%f").isoformat()
+            except ValueError:
+                ts = datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
+            size = os.path.getsize(file_path)
+            record = {"op": "commit", "id": version_id, "parent": parent, "ts": ts, "manifest": file_name,
+                      "frames": None, "size": size, "written": size}
+            self._append_index(record)
+            self._apply_index_record(record)
+            parent = version_id
+
+    def _read_manifest(self, file_name):
+        """
+        Returns the frames of a checkpoint manifest, or None for a legacy full-workspace pickle.
+        """
+        if file_name.endswith(".pkl"):
+            return None
+        with open(os.path.join(self.storage_dir, file_name), "r") as f:
+            return json.load(f)["frames"]
+
+    def _apply_ops(self, frames, ops):
+        frames = dict(frames)
+        for op in ops:
+            if op["op"] in ("upload", "set"):
+                frames[op["name"]] = op["entry"]
+            elif op["op"] == "rename":
+                frames[op["new"]] = frames.pop(op["old"])
+            elif op["op"] == "remove":
+                del frames[op["name"]]
+        return frames
+
+    def _diff_ops(self, parent_frames, frames):
+        """
+        Returns the journal operations that turn `parent_frames` into `frames`.
+        """
+        ops = []
+        removed = [name for name in parent_frames if name not in frames]
+        for name, entry in frames.items():
+            if name in parent_frames:
+                if parent_frames[name] != entry:
+                    ops.append({"op": "set", "name": name, "entry": entry})
+                continue
+            renamed_from = next((old for old in removed if parent_frames[old] == entry), None)
+            if renamed_from is not None:
+                removed.remove(renamed_from)
+                ops.append({"op": "rename", "old": renamed_from, "new": name})
+            else:
+                ops.append({"op": "upload", "name": name, "entry": entry})
+        ops.extend({"op": "remove", "name": name} for name in removed)
+        return ops
+
+    def _version_frames(self, version_id):
+        """
+        Rebuilds the frames of a version by replaying its records from the last checkpoint.
+        Returns None for a legacy full-workspace pickle.
+        """
+        chain = []
+        current = version_id
+        while True:
+            if current in self._frames_cache:
+                frames = self._frames_cache[current]
+                break
+            if current is None:
+                frames = {}
+                break
+            record = self._versions[current]
+            if "manifest" in record:
+                frames = self._read_manifest(record["manifest"])
+                break
+            chain.append(record)
+            current = record["parent"]
+        for record in reversed(chain):
+            frames = self._apply_ops(frames, record["ops"])
+        if frames is not None:
+            self._frames_cache[version_id] = frames
+            self._frames_cache.move_to_end(version_id)
+            while len(self._frames_cache) > 8:
+                self._frames_cache.popitem(last=False)
+        return frames
+
+    def load_frame(self, ref):
+        entry = ref.entry
+        self.log(f"Hydrating {entry['kind']} with {len(entry.get('columns', []))} columns")
+        if entry["kind"] == "object":
+            return self._read_pickle(entry["blob"])
+        arrays = [self._read_column(blob) for blob in entry["columns"]]
+        index = self._read_pickle(entry["index"])
+        names = self._read_pickle(entry["names"])
+        if entry["kind"] == "series":
+            obj = pd.Series(arrays[0], index=index, name=names, copy=False)
+        else:
+            obj = pd.DataFrame(dict(enumerate(arrays)), index=index, copy=False)
+            obj.columns = names
+        self._share_columns(obj, entry["columns"])
+        self._remember_entry(obj, entry)
+        return obj
+
+    def _entry_blobs(self, entry):
+        if entry["kind"] == "object":
+            return [entry["blob"]]
+        return entry["columns"] + [entry["index"], entry["names"]]
+
+    def _frame_entry(self, obj):
+        """
+        Writes the blobs of a frame that are not stored yet.
+        Returns its manifest entry and the number of bytes written.
+        """
+        entry = self._known_entry(obj)
+        if entry is not None:
+            return entry, 0
+
+        written = 0
+        written_lock = threading.Lock()
+
+        def store(digest, payload):
+            nonlocal written
+            blob, blob_written = self._write_blob(digest, payload)
+            with written_lock:
+                written += blob_written
+            return blob
+
+        def store_pickle(value):
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            return store(self._hash("pickle", data), data)
+
+        if isinstance(obj, pd.DataFrame):
+            columns = [obj.iloc[:, i] for i in range(obj.shape[1])]
+            entry = {"kind": "frame", "names": store_pickle(obj.columns)}
+        elif isinstance(obj, pd.Series):
+            columns = [obj]
+            entry = {"kind": "series", "names": store_pickle(obj.name)}
+        else:
+            columns = None
+            entry = {"kind": "object", "blob": store_pickle(obj)}
+        description = describe_frame(obj)
+        if columns is not None:
+            # Every column is its own blob, so unchanged columns are shared with earlier versions
+            def store_column(column):
+                return store(self._column_digest(column), column)
+
+            if self.compression_threads > 1 and len(columns) > 1 and description["nbytes"] > self.parallel_threshold:
+                # Hashing, encoding and compression release the GIL, so columns are written in parallel
+                with ThreadPoolExecutor(max_workers=self.compression_threads) as executor:
+                    entry["columns"] = list(executor.map(store_column, columns))
+            else:
+                entry["columns"] = [store_column(column) for column in columns]
+            entry["index"] = store_pickle(obj.index)
+
+        entry["disk_bytes"] = sum(os.path.getsize(os.path.join(self.blobs_dir, b)) for b in self._entry_blobs(entry))
+        entry.update(description)
+        self._remember_entry(obj, entry)
+        return entry, written
+
+    def _new_version_id(self):
+        version_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        while version_id in self._versions:
+            version_id = str(int(version_id) + 1)
+        return version_id
 
     def save_state(self, state):
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-        file_path = os.path.join(self.storage_dir, f"state_{timestamp}.pkl")
-        with open(file_path, "wb") as f:
-            pickle.dump(state, f)
+        if not self.write_behind:
+            return self._commit_state(state)
+        snapshot = state.snapshot() if isinstance(state, Workspace) else dict(state)
+        with self._writer_cond:
+            if self._pending is not None:
+                self.log("Coalescing pending snapshot with a newer one")
+            self._pending = snapshot
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name="storage-writer", daemon=True)
+                self._writer.start()
+            self._writer_cond.notify_all()
+        return None
+
+    def _writer_loop(self):
+        while True:
+            with self._writer_cond:
+                while self._pending is None:
+                    self._writer_cond.wait()
+                state, self._pending = self._pending, None
+                self._writing = True
+            try:
+                self._commit_state(state)
+                self._write_error = None
+            except Exception as e:
+                self._write_error = e
+                self.log(f"Background save failed: {e}")
+            finally:
+                with self._writer_cond:
+                    self._writing = False
+                    self._writer_cond.notify_all()
+
+    def flush(self):
+        """
+        Blocks until every queued snapshot has been written.
+        """
+        with self._writer_cond:
+            while self._pending is not None or self._writing:
+                self._writer_cond.wait()
+
+    def _fsync_dirs(self):
+        if not self.fsync:
+            return
+        for path in (self.blobs_dir, self.storage_dir):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _commit_state(self, state):
+        with self._lock:
+            is_workspace = isinstance(state, Workspace)
+            frames = {}
+            written = 0
+            for name, value in list(state.raw_items() if is_workspace else state.items()):
+                # Frames that are unchanged since they were persisted are not even loaded
+                if isinstance(value, FrameRef):
+                    frames[name] = value.entry
+                    continue
+                frames[name], blob_written = self._frame_entry(value)
+                written += blob_written
+                if is_workspace:
+                    state.mark_persisted(name, FrameRef(frames[name]))
+
+            version_id = self._new_version_id()
+            record = {
+                "op": "commit",
+                "id": version_id,
+                "parent": self._head,
+                "ts": datetime.now().isoformat(),
+                "frames": len(frames),
+                "format": self.format,
+                "codec": self.codec,
+                "size": sum(entry.get("disk_bytes") or 0 for entry in frames.values()),
+                "written": written,
+            }
+
+            # Renames and removals become tiny journal records; a full manifest is only written periodically
+            parent_frames = self._version_frames(self._head) if self._head is not None else None
+            chain = self._versions[self._head].get("chain", 0) + 1 if self._head is not None else 0
+            ops = self._diff_ops(parent_frames, frames) if parent_frames is not None else None
+            if ops is None or chain >= self.checkpoint_every or list(self._apply_ops(parent_frames, ops)) != list(frames):
+                manifest_name = f"state_{version_id}.json"
+                manifest = {"frames": frames}
+                self._write_atomic(
+                    os.path.join(self.storage_dir, manifest_name),
+                    lambda f: f.write(json.dumps(manifest).encode("utf-8")),
+                )
+                record.update(manifest=manifest_name, chain=0)
+            else:
+                record.update(ops=ops, chain=chain)
+
+            # Blobs and manifest must be durable before the journal record that points at them
+            self._fsync_dirs()
+            self._append_index(record)
+            self._apply_index_record(record)
+            self._frames_cache[version_id] = frames
+            self.log(f"Committed version {version_id} ({written} bytes written, {len(record.get('ops', []))} ops)")
+
+            self._commits_since_compaction += 1
+            if self.compact_every and self._commits_since_compaction >= self.compact_every:
+                # Not compact(): on the write-behind thread, flushing would wait for this very commit
+                self._compact_locked()
+            return version_id
+
+    def _load_version(self, version_id):
+        frames = self._version_frames(version_id)
+        if frames is None:
+            # Legacy full-workspace pickle
+            with open(os.path.join(self.storage_dir, self._versions[version_id]["manifest"]), "rb") as f:
+                return Workspace(self.load_frame, pickle.load(f))
+        # Only the manifest is read here, every frame is hydrated on first access
+        return Workspace(self.load_frame, {name: FrameRef(entry) for name, entry in frames.items()})
+
+    def _move_head(self, version_id):
+        record = {"op": "head", "id": version_id, "ts": datetime.now().isoformat()}
+        self._append_index(record)
+        self._apply_index_record(record)
+
+    def get_head(self):
+        self.flush()
+        return self._head
 
     def get_latest_state(self):
-        files = sorted([f for f in os.listdir(self.storage_dir) if f.endswith(".pkl")], reverse=True)
-        if not files:
+        self.flush()
+        with self._lock:
+            version_id = self._head
+            while version_id is not None:
+                try:
+                    return self._load_version(version_id)
+                except (OSError, ValueError, KeyError, pickle.UnpicklingError, EOFError) as e:
+                    # Never let one damaged version brick startup: fall back to its parent
+                    self.log(f"Cannot load version {version_id}, falling back to its parent: {e}")
+                    version_id = self._versions[version_id]["parent"]
             return None
-        file_path = os.path.join(self.storage_dir, files[0])
-        # Check if the latest path is a file indeed, not a directory
-        if not os.path.isfile(file_path):
-            return None
-        with open(file_path, "rb") as f:
-            return pickle.load(f)
 
     def pop_state(self):
-        files = sorted([f for f in os.listdir(self.storage_dir) if f.endswith(".pkl")], reverse=True)
-        if len(files) < 2:
-            return None  # Cannot pop the initial state
-        file_to_remove = os.path.join(self.storage_dir, files[0])
-        os.remove(file_to_remove)
-        return self.get_latest_state()
+        self.flush()
+        with self._lock:
+            if self._head is None or self._versions[self._head]["parent"] is None:
+                return None  # Cannot pop the initial state
+            parent = self._versions[self._head]["parent"]
+            self._move_head(parent)
+            return self._load_version(parent)
+
+    def checkout(self, version_id):
+        """
+        Moves the head to an arbitrary version and returns its state.
+        """
+        self.flush()
+        with self._lock:
+            if version_id not in self._versions:
+                return None
+            self._move_head(version_id)
+            return self._load_version(version_id)
+
+    def list_versions(self):
+        """
+        Returns all commit records, oldest first.
+        """
+        self.flush()
+        return list(self._versions.values())
+
+    def _versions_to_keep(self):
+        records = list(self._versions.values())
+        keep = {r["id"] for r in records[-self.retention["keep_last"]:]} if self.retention["keep_last"] else set()
+        if self._head is not None:
+            keep.add(self._head)
+        # Newest version of each of the most recent hours and days
+        for bucket_format, count in (("%Y-%m-%d %H", self.retention["hourly"]), ("%Y-%m-%d", self.retention["daily"])):
+            buckets = {}
+            for record in reversed(records):
+                bucket = datetime.fromisoformat(record["ts"]).strftime(bucket_format)
+                if bucket not in buckets:
+                    if len(buckets) == count:
+                        break
+                    buckets[bucket] = record["id"]
+            keep.update(buckets.values())
+        return keep
+
+    def compact(self):
+        """
+        Drops the versions outside the retention policy and deletes unreferenced manifests and blobs.
+        Returns the number of versions and bytes removed.
+        """
+        self.flush()
+        with self._lock:
+            return self._compact_locked()
+
+    def _compact_locked(self):
+        """
+        compact() for callers that hold self._lock, without waiting for queued snapshots.
+        """
+        keep = self._versions_to_keep()
+        dropped = [r for r in self._versions.values() if r["id"] not in keep]
+
+        # Relink every kept version to its nearest kept ancestor, merging the dropped ones into it
+        kept_records = []
+        for record in self._versions.values():
+            if record["id"] not in keep:
+                continue
+            parent = record["parent"]
+            while parent is not None and parent not in keep:
+                parent = self._versions[parent]["parent"] if parent in self._versions else None
+            kept = dict(record, parent=parent)
+            if parent != record["parent"] and "ops" in record:
+                # Its operations were relative to a dropped version: turn it into a checkpoint
+                manifest_name = f"state_{record['id']}.json"
+                manifest = {"frames": self._version_frames(record["id"])}
+                self._write_atomic(
+                    os.path.join(self.storage_dir, manifest_name),
+                    lambda f: f.write(json.dumps(manifest).encode("utf-8")),
+                )
+                del kept["ops"]
+                kept.update(manifest=manifest_name, chain=0)
+            kept_records.append(kept)
+
+        self._fsync_dirs()
+        tmp_path = f"{self.index_path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        for record in kept_records:
+            self._append_index(record, tmp_path)
+        if self._head is not None:
+            self._append_index({"op": "head", "id": self._head, "ts": datetime.now().isoformat()}, tmp_path)
+        os.replace(tmp_path, self.index_path)
+        self._versions = {r["id"]: r for r in kept_records}
+        self._frames_cache.clear()
+        self._commits_since_compaction = 0
+
+        removed_bytes = 0
+        for record in dropped:
+            if "manifest" not in record:
+                continue
+            manifest_path = os.path.join(self.storage_dir, record["manifest"])
+            if os.path.exists(manifest_path):
+                removed_bytes += os.path.getsize(manifest_path)
+                os.remove(manifest_path)
+        removed_bytes += self._collect_garbage()
+        self.log(f"Compaction removed {len(dropped)} versions and {removed_bytes} bytes")
+        return {"versions_removed": len(dropped), "bytes_removed": removed_bytes}
+
+    def _referenced_blobs(self):
+        # Every frame of a kept version comes from a kept checkpoint or from a kept upload/set record
+        referenced = set()
+        for record in self._versions.values():
+            if "ops" in record:
+                entries = [op["entry"] for op in record["ops"] if "entry" in op]
+            else:
+                entries = (self._read_manifest(record["manifest"]) or {}).values()
+            for entry in entries:
+                referenced.update(self._entry_blobs(entry))
+        return referenced
+
+    def _collect_garbage(self):
+        referenced = self._referenced_blobs()
+        removed = set()
+        removed_bytes = 0
+        for blob in os.listdir(self.blobs_dir):
+            if blob not in referenced:
+                path = os.path.join(self.blobs_dir, blob)
+                removed_bytes += os.path.getsize(path)
+                os.remove(path)
+                removed.add(blob)
+        # Frames whose blobs are gone have to be written again the next time they are saved
+        for key, (_, entry) in list(self._known_entries.items()):
+            if removed.intersection(self._entry_blobs(entry)):
+                self._known_entries.pop(key, None)
+        for blob in removed:
+            self._columns.pop(blob, None)
+        return removed_bytes
+
+    def usage(self):
+        """
+        Reports the disk usage of every version and of the store as a whole.
+        """
+        self.flush()
+        with self._lock:
+            versions = [
+                {key: record.get(key) for key in ("id", "parent", "ts", "frames", "size", "written")}
+                for record in self._versions.values()
+            ]
+            blob_bytes = sum(entry.stat().st_size for entry in os.scandir(self.blobs_dir))
+            return {"head": self._head, "versions": versions, "blob_bytes": blob_bytes}
 
 
 storage_service = StorageService()
@@ -0,0 +1,203 @@
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+import pandas as pd
+
+
+def describe_frame(frame, deep=True):
+    """
+    Returns the shape, dtypes and in-memory size of a dataframe or series.
+    The size counts the Python objects of object columns too (a shallow count misses most of a string
+    column), which takes a pass over them: callers keep it rather than describing a frame again.
+    With `deep=False` the size is left out.
+    """
+    if isinstance(frame, pd.DataFrame):
+        return {
+            "shape": list(frame.shape),
+            "dtypes": {str(c): str(t) for c, t in frame.dtypes.items()},
+            "nbytes": int(frame.memory_usage(index=True, deep=True).sum()) if deep else None,
+        }
+    if isinstance(frame, pd.Series):
+        nbytes = int(frame.memory_usage(index=True, deep=True)) if deep else None
+        return {"shape": list(frame.shape), "dtypes": str(frame.dtype), "nbytes": nbytes}
+    return {"shape": None, "dtypes": None, "nbytes": None}
+
+
+class FrameRef:
+    """
+    A persisted dataframe that is only materialized when it is first accessed.
+    `entry` is the manifest entry written by the storage service (blob, shape, dtypes, nbytes).
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __repr__(self):
+        return f"FrameRef({self.entry.get('blob')!r})"
+
+
+class Workspace(MutableMapping):
+    """
+    Name -> dataframe mapping whose persisted frames are hydrated lazily.
+
+    Iterating, `len()`, `in` and `info()` only use the manifest metadata; a frame
+    is read from storage the first time it is looked up by name.
+
+    With a `memory_budget` (in bytes), hydrated frames are kept in LRU order and
+    the least recently used ones are dropped back to their FrameRef once the
+    budget is exceeded. Only frames that are already persisted can be evicted;
+    they are reloaded transparently on their next lookup.
+
+    A Workspace is not thread-safe. Snapshots are persisted on the storage writer thread,
+    so what they report back through mark_persisted is queued on this workspace and
+    applied on the thread that uses it, the next time it is accessed.
+    """
+
+    def __init__(self, loader=None, entries=None):
+        self._loader = loader
+        self._entries = dict(entries or {})  # name -> dataframe or FrameRef, in insertion order
+        self._refs = {}  # name -> FrameRef of a hydrated frame that is still unchanged
+        self._origin = None  # Workspace this one is a snapshot of
+        self._persisted = deque()  # (name, ref, frame) reported by snapshots, see mark_persisted
+        self.memory_budget = 0  # 0 means unlimited
+        self._loaded = OrderedDict()  # name -> nbytes of hydrated frames, least recently used first
+        for name, value in self._entries.items():
+            if not isinstance(value, FrameRef):
+                self._loaded[name] = describe_frame(value)["nbytes"] or 0
+
+    def __getitem__(self, name):
+        self._apply_persisted()
+        value = self._entries[name]
+        if isinstance(value, FrameRef):
+            frame = self._loader(value)
+            self._entries[name] = frame
+            self._refs[name] = value
+            self._track(name, frame, value.entry.get("nbytes"))
+            return frame
+        if name in self._loaded:
+            self._loaded.move_to_end(name)
+        return value
+
+    def __setitem__(self, name, frame):
+        self._entries[name] = frame
+        self._refs.pop(name, None)
+        self._track(name, frame)
+
+    def __delitem__(self, name):
+        del self._entries[name]
+        self._refs.pop(name, None)
+        self._loaded.pop(name, None)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"Workspace({list(self._entries)!r})"
+
+    def rename(self, old_name, new_name):
+        """
+        Renames a frame without hydrating it.
+        """
+        self._apply_persisted()
+        self._entries[new_name] = self._entries.pop(old_name)
+        if old_name in self._refs:
+            self._refs[new_name] = self._refs.pop(old_name)
+        if old_name in self._loaded:
+            self._loaded[new_name] = self._loaded.pop(old_name)
+
+    def _track(self, name, frame, nbytes=None):
+        # Persisted frames come with the size measured when they were written
+        self._loaded[name] = (nbytes if nbytes is not None else describe_frame(frame)["nbytes"]) or 0
+        self._loaded.move_to_end(name)
+        self.enforce_memory_budget(keep=name)
+
+    def memory_usage(self):
+        """
+        Returns the in-memory size of every hydrated frame, least recently used first.
+        """
+        self._apply_persisted()
+        return dict(self._loaded)
+
+    def enforce_memory_budget(self, keep=None):
+        """
+        Evicts least recently used persisted frames until the hydrated frames fit the budget.
+        """
+        self._apply_persisted()
+        if not self.memory_budget:
+            return []
+        evicted = []
+        total = sum(self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.memory_budget:
+                break
+            if name == keep or name not in self._refs:
+                continue  # Still in use, or not persisted yet
+            total -= self._loaded.pop(name)
+            self._entries[name] = self._refs.pop(name)
+            evicted.append(name)
+        return evicted
+
+    def snapshot(self):
+        """
+        Returns a shallow copy that can be persisted while this workspace keeps changing.
+        """
+        self._apply_persisted()
+        copy = Workspace(self._loader, self._entries)
+        copy._refs = dict(self._refs)
+        copy._origin = self
+        return copy
+
+    def mark_persisted(self, name, ref, frame=None):
+        """
+        Records that `frame` (by default the current frame stored under `name`) has been persisted as `ref`.
+        A snapshot passes this on to the workspace it was taken from, which applies it once it is next accessed,
+        and only if it still holds that very frame.
+        """
+        value = self._entries.get(name)
+        if frame is None:
+            frame = value
+        if value is frame and not isinstance(value, FrameRef):
+            self._refs[name] = ref
+            self.enforce_memory_budget()
+        if self._origin is not None:
+            self._origin._persisted.append((name, ref, frame))
+
+    def _apply_persisted(self):
+        while self._persisted:
+            self.mark_persisted(*self._persisted.popleft())
+
+    def is_loaded(self, name):
+        self._apply_persisted()
+        return not isinstance(self._entries[name], FrameRef)
+
+    def info(self, name):
+        """
+        Returns shape, dtypes and size of a frame, without hydrating it if it is not loaded yet.
+        """
+        self._apply_persisted()
+        value = self._entries[name]
+        if isinstance(value, FrameRef):
+            info = {key: value.entry.get(key) for key in ("shape", "dtypes", "nbytes")}
+            info["loaded"] = False
+        else:
+            info = describe_frame(value, deep=False)
+            info["nbytes"] = self._loaded.get(name)
+            info["loaded"] = True
+        return info
+
+    def raw(self, name):
+        """
+        Returns the FrameRef of a frame that is unchanged since it was persisted, and the dataframe itself otherwise.
+        """
+        self._apply_persisted()
+        return self._refs.get(name, self._entries[name])
+
+    def raw_items(self):
+        """
+        Yields (name, value) pairs where value is a FrameRef for every frame that is
+        unchanged since it was persisted, and the dataframe itself otherwise.
+        """
+        for name in self._entries:
+            yield name, self.raw(name)
@@ -0,0 +1,83 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Add the server directory to the Python path to resolve imports
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app.services.storage_service import StorageService
+
+CONFIGURATIONS = [
+    ("arrow", "none", None),
+    ("arrow", "lz4", None),
+    ("arrow", "zstd", 1),
+    ("arrow", "zstd", 3),
+    ("arrow", "zstd", 9),
+    ("parquet", "none", None),
+    ("parquet", "lz4", None),
+    ("parquet", "zstd", 3),
+    ("pickle", "none", None),
+    ("pickle", "lz4", None),
+    ("pickle", "zstd", 3),
+]
+
+
+def make_frame(rows, seed=0):
+    """
+    A string-heavy frame resembling the uploaded CSV files: ids, categories,
+    free text, timestamps kept as strings, and a few numeric columns.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array(["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"])
+    return pd.DataFrame({
+        "id": np.arange(rows),
+        "country": rng.choice(["SG", "HU", "US", "DE", "JP"], rows),
+        "status": rng.choice(["ok", "pending", "failed"], rows, p=[0.8, 0.15, 0.05]),
+        "received_date_time": pd.Series(
+            pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 10**7, rows), unit="s")
+        ).dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "comment": [" ".join(rng.choice(words, 4)) for _ in range(rows)],
+        "amount": rng.normal(100, 25, rows).round(2),
+        "num1": rng.integers(1, 50, rows),
+        "num2": rng.integers(1, 50, rows),
+    })
+
+
+def run(rows):
+    df = make_frame(rows)
+    print(f"Frame: {rows} rows, {df.memory_usage(deep=True).sum() / 2**20:.1f} MB in memory")
+    print(f"{'format':<8} {'codec':<6} {'level':>5} {'size MB':>9} {'ratio':>6} {'save MB/s':>10} {'load MB/s':>10}")
+    raw_mb = df.memory_usage(deep=True).sum() / 2**20
+    for storage_format, codec, level in CONFIGURATIONS:
+        storage_dir = tempfile.mkdtemp()
+        try:
+            storage = StorageService(storage_dir)
+            storage.configure({"format": storage_format, "compression": {"codec": codec, "level": level}})
+            start = time.perf_counter()
+            storage.save_state({"df": df.copy()})
+            save_seconds = time.perf_counter() - start
+            size_mb = sum(e.stat().st_size for e in os.scandir(storage.blobs_dir)) / 2**20
+
+            start = time.perf_counter()
+            loaded = StorageService(storage_dir).get_latest_state()["df"]
+            for column in loaded.columns:
+                loaded[column].to_numpy().sum() if loaded[column].dtype.kind in "if" else loaded[column].nunique()
+            load_seconds = time.perf_counter() - start
+        finally:
+            shutil.rmtree(storage_dir)
+        print(
+            f"{storage_format:<8} {codec:<6} {str(level or '-'):>5} {size_mb:>9.1f} {raw_mb / size_mb:>6.1f} "
+            f"{raw_mb / save_seconds:>10.0f} {raw_mb / load_seconds:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare storage formats and compression codecs.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    run(parser.parse_args().rows)
@@ -0,0 +1,16 @@
+import copy
+import pytest
+from app.services.logging_service import logging_service
+
+
+@pytest.fixture(autouse=True)
+def log_to_tmp_path(tmp_path, monkeypatch):
+    """
+    Sends the service logs of every test to tmp_path instead of server/logs.
+    """
+    config = copy.deepcopy(logging_service.config)
+    for service in config.get("logging", {}).values():
+        if service.get("log_file"):
+            service["log_file"] = str(tmp_path / "logs" / f"{service['log_file'].rsplit('/', 1)[-1]}")
+    (tmp_path / "logs").mkdir()
+    monkeypatch.setattr(logging_service, "config", config)
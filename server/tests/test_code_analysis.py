@@ -0,0 +1,80 @@
+import pytest
+from app.services.code_analysis import analyze_code, chunk_plan
+
+FRAMES = ["df", "dataframes", "df_te"]
+
+
+@pytest.mark.parametrize("code", [
+    "result = df.head()",
+    "mask = df['a'] > 1\nresult = df[mask]",
+    "result = df_te.merge(dataframes['df_pr'], on='id')",
+    "out = df.copy()\nout['b'] = 1\nresult = out",
+    "result = df.sort_values('a', inplace=False)",
+    "items = [1, 2]\nitems.pop()\nresult = items",
+])
+def test_read_only_code(code):
+    assert analyze_code(code, FRAMES) == {"read_only": True, "mutations": [], "frames": []}
+
+
+@pytest.mark.parametrize("code, mutation, frames", [
+    ("df['a'] = pd.to_numeric(df['a'])\nresult = df", "line 1: assigns into df", ["df"]),
+    ("df.loc[df['a'] > 1, 'b'] = 0", "line 1: assigns into df", ["df"]),
+    ("del df_te['a']", "line 1: deletes from df_te", ["df_te"]),
+    ("df.columns = ['x']", "line 1: assigns into df", ["df"]),
+    ("df = df.dropna()\nresult = df", "line 1: rebinds df", ["df"]),
+    ("df.dropna(inplace=True)", "line 1: df.dropna() changes df in place", ["df"]),
+    ("d = df\nd['a'] = 1", "line 2: assigns into d", ["df"]),
+    ("d = df_te\nd = d.dropna()", "line 2: rebinds d", []),
+    ("dataframes['df_te']['a'] = 1", "line 1: assigns into dataframes", ["dataframes"]),
+    ("df.insert(0, 'x', 1)", "line 1: df.insert() changes df in place", ["df"]),
+    ("df_te['c'] = 1\nresult = df.head(1)", "line 1: assigns into df_te", ["df_te"]),
+    ("result = (", "line 1: code does not parse", []),
+])
+def test_mutating_code(code, mutation, frames):
+    analysis = analyze_code(code, FRAMES)
+    assert not analysis["read_only"]
+    assert mutation in analysis["mutations"]
+    assert analysis["frames"] == frames
+
+
+@pytest.mark.parametrize("code, mode, reducer", [
+    ("result = df[df['a'] > 1][['a', 'b']]", "rows", None),
+    ("df['c'] = df['a'].str.lower()\nresult = df.dropna()", "rows", None),
+    ("mask = df['a'].isin([1, 2])\nresult = df.loc[mask, 'b'].sum()", "reduce", "sum"),
+    ("result = df.groupby(['k', 'j'])['v'].mean()", "groupby", "mean"),
+    ("result = df[df['v'] > 0].groupby('k').size()", "groupby", "size"),
+    ("result = df.apply(lambda row: row['a'] * 2, axis=1)", "rows", None),
+    ("result = df.query('a > 1 and b.str.startswith(\"x\")')", "rows", None),
+    ("result = df.loc[:, ['a', 'b']]['a'].str[:3]", "rows", None),
+    ("sub = df[df['a'] > 0]\nresult = sub[['b']].max()", "reduce", "max"),
+])
+def test_chunk_plan_of_eligible_code(code, mode, reducer):
+    plan = chunk_plan(code)
+    assert (plan["mode"], plan["reducer"]) == (mode, reducer)
+
+
+@pytest.mark.parametrize("code", [
+    "result = df.head()",
+    "result = df['a'] - df['a'].mean()",
+    "result = df.sort_values('a')",
+    "result = df.groupby('k', as_index=False)['v'].sum()",
+    "result = df.merge(df_te, on='id')",
+    "print(df)\nresult = df",
+    "result = df['a'].median()",
+    # Lambdas that get the whole chunk
+    "result = df.loc[lambda d: d['a'] > d['a'].mean()]",
+    "result = df[lambda d: d['a'] > 0]",
+    "result = df.assign(z=lambda d: d['a'] - d['a'].mean())",
+    # Query expressions are checked like code
+    "result = df.query('a > a.mean()')",
+    "result = df.query('a > @limit')",
+    "result = df.query(condition)",
+    # Label lookups, and subscripts of a Series
+    "result = df['a'][7]",
+    "result = df.loc[5]",
+    "result = df.loc[5, 'a']",
+    "result = df['a'][df['a'] > 0]",
+    "s = df['a']\nresult = s['x']",
+])
+def test_chunk_plan_rejects_code_that_needs_the_whole_frame(code):
+    assert chunk_plan(code) is None
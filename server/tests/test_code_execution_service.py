@@ -0,0 +1,87 @@
+import threading
+import time
+import pandas as pd
+import pytest
+from app.services import dataframe_service as dataframe_module
+from app.services.code_execution_service import CodeExecutionService
+from app.services.dataframe_service import DataFrameService
+from app.services.result_store import ResultStore
+from app.services.storage_service import StorageService
+from tests.test_safe_exec import Config, CONFIG
+from tests.test_workspace import VectorStore
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = CodeExecutionService(Config(CONFIG, pool_size=0, results={"preview_rows": 4, "preview_cols": 2}))
+    service.results_history = ResultStore(str(tmp_path / "results"))
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def frames(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataframe_module, "storage_service", StorageService(str(tmp_path / "storage")))
+    frames = DataFrameService()
+    frames.set_vector_store(VectorStore())
+    frames.add_dataframe("df_te", pd.DataFrame({'a': [1, 2, 3]}))
+    frames.add_dataframe("df_pr", pd.DataFrame({'b': [4, 5]}))
+    return frames
+
+
+def test_series_and_frame_results_are_previewed(service):
+    series = service._finish(pd.Series(range(10), name="a"))
+    assert series["shape"] == [10]
+    assert series["result"].splitlines()[2].strip() == ".."
+
+    frame = service._finish(pd.DataFrame({c: range(10) for c in "abcd"}))
+    assert frame["shape"] == [10, 4]
+    assert "..." in frame["result"].splitlines()[0]
+
+
+def test_changes_are_committed_to_the_frame_they_were_made_to(service, frames):
+    result = service.execute("df_pr['c'] = 1\nresult = df_pr.head(1)", frames, "df_te")
+    assert result["shape"] == [1, 2]
+    assert frames.get_dataframe("df_te")["a"].tolist() == [1, 2, 3]
+    assert frames.get_dataframe("df_pr")["c"].tolist() == [1, 1]
+
+
+def test_a_slice_returned_by_mutating_code_does_not_replace_the_frame(service, frames):
+    result = service.execute("df['x'] = df['a'] * 2\nresult = df.loc[[0]]", frames, "df_te")
+    assert result["shape"] == [1, 2]
+    assert frames.get_dataframe("df_te")["x"].tolist() == [2, 4, 6]
+
+
+def test_read_only_code_commits_nothing(service, frames, monkeypatch):
+    monkeypatch.setattr(frames, "set_dataframe", lambda name, df: pytest.fail(f"committed {name}"))
+    assert service.execute("result = df[df['a'] > 1]", frames, "df_te")["shape"] == [2, 1]
+    assert service.execute("result = df[df['a'] > 1]", frames, "df_te")["shape"] == [2, 1]  # From the cache
+
+
+def test_code_runs_without_holding_the_workspace_lock(service, frames):
+    started = threading.Event()
+    frames.vector_store.add_dataframe_schema = lambda name, schema_text: started.set()
+    thread = threading.Thread(target=service.execute, args=("import time\ntime.sleep(2)\ndf['x'] = 1", frames, "df_te"))
+    thread.start()
+    try:
+        time.sleep(0.5)
+        assert frames.lock.acquire(timeout=0.5)
+        frames.lock.release()
+        assert not started.is_set()
+    finally:
+        thread.join()
+    assert frames.get_dataframe("df_te")["x"].tolist() == [1, 1, 1]
+
+
+def test_changes_to_a_frame_that_changed_meanwhile_are_not_committed(service, frames):
+    snapshot = frames.snapshot()
+    frames.set_dataframe("df_te", pd.DataFrame({'a': [7]}))
+    result = service.execute("df['x'] = 1", frames, "df_te", frames=snapshot)
+    assert result.startswith("Error executing code: df_te changed while the code ran")
+    assert frames.get_dataframe("df_te").columns.tolist() == ['a']
+    # Persisting or reloading a frame does not count as a change
+    snapshot = frames.snapshot()
+    frames.dataframes = dataframe_module.storage_service.get_latest_state()
+    assert frames.dataframes.raw("df_te") is not snapshot.raw("df_te")
+    service.execute("df['x'] = 1", frames, "df_te", frames=snapshot)
+    assert frames.get_dataframe("df_te")["x"].tolist() == [1]
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.services.code_optimizer import optimize_code
+
+
+def run(code, df):
+    namespace = {"df": df, "pd": pd, "np": np}
+    exec(code, namespace)
+    return namespace["result"]
+
+
+@pytest.mark.parametrize("code, rewritten", [
+    ("result = df.apply(lambda row: row['a'] * row['b'] + 1, axis=1)", "result = df['a'] * df['b'] + 1"),
+    ("result = df.apply(lambda r: r.a > 2, axis='columns')", "result = df['a'] > 2"),
+    ("result = df['a'].apply(lambda x: np.sqrt(x) - 1)", "result = np.sqrt(df['a']) - 1"),
+    ("result = df['b'].map(lambda v: -v / 2)", "result = -df['b'] / 2"),
+])
+def test_rewrites_are_equivalent(code, rewritten):
+    df = pd.DataFrame({"a": [1.0, 4.0, 9.0], "b": [2, 3, 4]})
+    optimized, report = optimize_code(code)
+    assert optimized == rewritten
+    assert [r["line"] for r in report["rewrites"]] == [1]
+    pd.testing.assert_series_equal(run(optimized, df), run(code, df), check_names=False)
+
+
+@pytest.mark.parametrize("code, message", [
+    ("result = df.apply(lambda row: f(row['a']), axis=1)", "row-wise apply(axis=1)"),
+    ("for i, row in df.iterrows():\n    print(row)", "iterrows() loops over rows"),
+    ("out = []\nfor x in df['a']:\n    out.append(x * 2)", "list built in a Python loop"),
+    ("for k in keys:\n    total = df[df['k'] == k]['v'].sum()", "df[...] is filtered again"),
+])
+def test_slow_patterns_are_flagged_not_rewritten(code, message):
+    optimized, report = optimize_code(code)
+    assert optimized == code
+    assert report["rewrites"] == []
+    assert any(message in warning["message"] for warning in report["warnings"])
+
+
+@pytest.mark.parametrize("code", [
+    "result = df.apply(lambda row: 1, axis=1)",
+    "result = get_frame().apply(lambda row: row['a'] + 1, axis=1)",
+    "result = df['a'].apply(lambda x: x if x > 0 else 0)",
+    "result = df.apply(lambda col: col * 2)",
+    "result = (",
+    # Attributes of the row Series are not columns
+    "result = df.apply(lambda r: r.name * 2, axis=1)",
+    "result = df.apply(lambda r: r.size + r.a, axis=1)",
+    "result = df.apply(lambda r: r.index, axis=1)",
+    # Only frames, and only while their names are not rebound
+    "g = df.groupby('k')\nresult = g['a'].apply(lambda s: s * 2)",
+    "df = df.groupby('k')\nresult = df['a'].apply(lambda s: s * 2)",
+    "for sales in parts:\n    total = sales['a'].apply(lambda x: x + 1)",
+])
+def test_unsafe_cases_are_left_alone(code):
+    assert optimize_code(code, ["sales"])[0] == code
+
+
+def test_workspace_frames_are_rewritten():
+    optimized, _ = optimize_code("result = sales['a'].apply(lambda x: x + 1)", ["sales"])
+    assert optimized == "result = sales['a'] + 1"
+    assert optimize_code("result = other['a'].apply(lambda x: x + 1)", ["sales"])[0].endswith("(lambda x: x + 1)")
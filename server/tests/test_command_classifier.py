@@ -0,0 +1,49 @@
+import pytest
+from app.services.command_classifier import CommandClassifier
+
+FRAMES = ["df_sales", "df_old"]
+SERVICES = ["llm", "dataframe", "code_execution"]
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("pop", {"command": "pop", "args": {}}),
+    ("Undo", {"command": "pop", "args": {}}),
+    ("list dataframes", {"command": "list_dataframes", "args": {}}),
+    ("What dataframes are currently loaded?", {"command": "list_dataframes", "args": {}}),
+    ("rename df_old to df_new", {"command": "rename", "args": {"old_name": "df_old", "new_name": "df_new"}}),
+    ("remove df_sales", {"command": "remove", "args": {"df_name": "df_sales"}}),
+    ("Upload the file located at ./data/sales.csv",
+     {"command": "upload", "args": {"file_path": "./data/sales.csv"}}),
+    ("download df_sales as out.csv", {"command": "download", "args": {"df_name": "df_sales", "filename": "out.csv"}}),
+    ("compact the storage", {"command": "storage", "args": {"action": "compact"}}),
+    ("turn off llm logging", {"command": "set_logging", "args": {"service_name": "llm", "level": "off"}}),
+    ("disable client side logging", {"command": "client_command", "args": {"action": "disable_logging"}}),
+    ("health", {"command": "service_health", "args": {"service_name": "all"}}),
+    ("check health of code_execution", {"command": "service_health", "args": {"service_name": "code_execution"}}),
+])
+def test_trivial_commands_are_classified_locally(prompt, expected):
+    classifier = CommandClassifier(services=SERVICES)
+    assert classifier.classify(prompt, FRAMES) == expected
+
+
+@pytest.mark.parametrize("prompt", [
+    "remove duplicates",
+    "rename df_old to df_sales",
+    "drop rows where price is missing",
+    "turn off server logging",
+    "what is the average price per region?",
+])
+def test_uncertain_prompts_are_left_to_the_llm(prompt):
+    assert CommandClassifier(services=SERVICES).classify(prompt, FRAMES) is None
+
+
+def test_hits_are_counted_per_path():
+    vectors = {"which dataframes do i have": [1.0, 0.0], "what data is loaded": [0.9, 0.1], "plot the sales": [-1.0, 0.0]}
+    classifier = CommandClassifier(embed=lambda text: vectors.get(text, [0.0, 1.0]), threshold=0.9)
+    classifier.classify("pop")
+    assert classifier.classify("what data is loaded") == {"command": "list_dataframes", "args": {}}
+    assert classifier.classify("plot the sales") is None
+    classifier.record_llm()
+    assert classifier.stats() == {
+        "rules": {"pop": 1}, "embedding": {"list_dataframes": 1}, "llm": 1, "fast_path_rate": 0.667,
+    }
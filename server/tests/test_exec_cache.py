@@ -0,0 +1,43 @@
+import pandas as pd
+from app.services.exec_cache import ExecutionCache, is_cacheable
+
+
+def test_cache_is_keyed_on_normalized_code_and_inputs(tmp_path):
+    cache = ExecutionCache(max_bytes=10**6, directory=str(tmp_path))
+    code_key = cache.code_key("result = df['a'].sum()", context="df")
+    assert code_key == cache.code_key("result = df[ 'a' ].sum()  # total", context="df")
+    assert code_key != cache.code_key("result = df['a'].sum()", context="other")
+    assert cache.inputs(code_key) is None
+
+    cache.put(code_key, [("frame", "df")], cache.key(code_key, ["v1"]), 6)
+    assert cache.get(cache.key(code_key, ["v1"])) == 6
+    assert cache.get(cache.key(code_key, ["v2"])) is None
+    assert cache.stats()["hit_rate"] == 0.5
+
+    # Persisted entries survive a restart
+    reopened = ExecutionCache(directory=str(tmp_path))
+    assert reopened.inputs(code_key) == [["frame", "df"]]
+    assert reopened.get(cache.key(code_key, ["v1"])) == 6
+
+
+def test_cache_is_bounded_in_bytes():
+    cache = ExecutionCache(max_bytes=20000)
+    for i in range(3):
+        cache.put("code", [], str(i), pd.DataFrame({'a': range(1000)}))
+    assert cache.stats()["entries"] == 2
+    assert cache.get("0") is None
+
+
+def test_nondeterministic_code_is_not_cached():
+    assert is_cacheable("result = df.groupby('a').size()")
+    assert not is_cacheable("result = df.sample(5)")
+    assert not is_cacheable("result = np.random.rand(3)")
+    assert not is_cacheable("result = (")
+
+
+def test_invalid_entries_are_dropped():
+    cache = ExecutionCache(max_bytes=10**6)
+    cache.put("code", [], "key", {"plot_urls": ["gone.png"]})
+    assert cache.get("key", valid=lambda value: False) is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["misses"] == 1
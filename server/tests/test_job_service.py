@@ -0,0 +1,47 @@
+import time
+import pandas as pd
+from app.services import safe_exec
+from app.services.job_service import JobService
+from tests.test_safe_exec import Config, CONFIG
+
+
+def _wait(jobs, job_id, timeout=20):
+    deadline = time.monotonic() + timeout
+    while jobs.get(job_id)["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return jobs.get(job_id)
+
+
+def test_jobs_run_in_the_background():
+    jobs = JobService({"max_workers": 1})
+    job = jobs.submit(lambda cancelled: {"result": "42"}, "answer")
+    assert job["status"] in ("queued", "running", "succeeded")
+    assert _wait(jobs, job["id"])["result"] == {"result": "42"}
+
+    failed = jobs.submit(lambda cancelled: 1 / 0, "fail")
+    assert _wait(jobs, failed["id"])["status"] == "failed"
+    assert jobs.get("missing") is None
+    jobs.close()
+
+
+def test_cancelling_a_running_job_kills_its_sandbox():
+    jobs = JobService({"max_workers": 1})
+    config = Config(CONFIG, timeout=60, cpu_limit=60)
+    outcome = {}
+
+    def run(cancelled):
+        outcome.update(safe_exec.run_user_code("while True: pass", pd.DataFrame(), config, cancelled=cancelled))
+
+    running = jobs.submit(run, "spin")
+    queued = jobs.submit(lambda cancelled: "never", "queued")
+    while jobs.get(running["id"])["status"] != "running":
+        time.sleep(0.05)
+    assert jobs.cancel(queued["id"])["status"] == "cancelled"
+
+    started = time.monotonic()
+    jobs.cancel(running["id"])
+    assert _wait(jobs, running["id"])["status"] == "cancelled"
+    assert time.monotonic() - started < 5
+    assert outcome["error"] == "cancelled"
+    assert jobs.get(queued["id"])["result"] is None
+    jobs.close()
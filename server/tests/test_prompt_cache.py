@@ -0,0 +1,41 @@
+import pandas as pd
+from app.services.prompt_cache import PromptCache, schema_fingerprint
+from app.services.workspace import Workspace
+
+
+def test_prompts_are_cached_per_schema_with_ttl_and_lru(tmp_path, monkeypatch):
+    path = str(tmp_path / "prompt_cache.json")
+    cache = PromptCache(path=path, ttl=60, max_entries=2)
+    cache.put("Top 5 customers by revenue?", "schema1", {"code": "a"})
+    assert cache.get("top 5  customers by revenue", "schema1") == {"code": "a"}
+    assert cache.get("top 5 customers by revenue", "schema2") is None
+
+    cache.put("p2", "schema1", {"code": "b"})
+    assert cache.get("Top 5 customers by revenue?", "schema1") is not None
+    cache.put("p3", "schema1", {"code": "c"})  # Evicts p2, the least recently used
+    assert cache.get("p2", "schema1") is None
+    assert PromptCache(path=path).get("p3", "schema1") == {"code": "c"}  # Persisted
+
+    now = __import__("time").time()
+    monkeypatch.setattr("app.services.prompt_cache.time.time", lambda: now + 61)
+    assert cache.get("p3", "schema1") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_similar_prompts_match_above_the_threshold():
+    vectors = {"sum of sales": [1.0, 0.0], "total sales": [0.9, 0.1], "plot sales": [0.0, 1.0]}
+    cache = PromptCache(threshold=0.95, embed=lambda prompt: vectors[prompt])
+    cache.put("sum of sales", "s", {"code": "a"})
+    assert cache.get("total sales", "s") == {"code": "a"}
+    assert cache.get("plot sales", "s") is None
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_schema_fingerprint_follows_columns_and_dtypes():
+    frames = Workspace()
+    frames["df"] = pd.DataFrame({"a": [1]})
+    before = schema_fingerprint(frames)
+    frames["df"] = pd.DataFrame({"a": [2]})
+    assert schema_fingerprint(frames) == before
+    frames["df"] = pd.DataFrame({"a": [1.5]})
+    assert schema_fingerprint(frames) != before
@@ -0,0 +1,39 @@
+import os
+import pandas as pd
+from app.services import safe_exec
+from app.services.result_store import ResultStore
+from tests.test_safe_exec import Config, CONFIG
+
+
+def test_results_are_spilled_and_trimmed(tmp_path):
+    store = ResultStore(str(tmp_path / "results"), keep_last=3)
+    for i in range(5):
+        store.append(pd.DataFrame({'a': range(i, i + 100)}))
+    store.append({33: 2})
+    assert len(store) == 3
+    assert len(os.listdir(store.directory)) == 3
+    assert store[-2]['a'].tolist()[0] == 4
+    assert store[-1] == {33: 2}
+
+    # Over budget, only the newest result is kept
+    store.budget = 1
+    store.append("text")
+    assert store[:] == ["text"]
+    assert len(os.listdir(store.directory)) == 1
+
+
+def test_sandbox_reads_results_history(tmp_path):
+    store = ResultStore(str(tmp_path / "results"))
+    store.append(pd.DataFrame({'score': [10, 60, 80]}))
+    store.append({33: 2})
+    code = "result = results_history[-2][results_history[-2]['score'] > 50]['score'].tolist() + list(last_result)"
+    result = safe_exec.run_user_code(code, pd.DataFrame(), Config(CONFIG), results=store.paths())
+    assert result["result"] == [60, 80, 33]
+
+
+def test_results_are_looked_up_by_id(tmp_path):
+    store = ResultStore(str(tmp_path / "results"), keep_last=1)
+    first = store.append(pd.DataFrame({'a': range(5)}))
+    assert store.get(first)['a'].tolist() == list(range(5))
+    store.append(1)
+    assert store.get(first) is None
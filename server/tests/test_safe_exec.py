@@ -0,0 +1,269 @@
+import errno
+import os
+import time
+import types
+import numpy as np
+import pandas as pd
+import pytest
+from app.services import safe_exec
+from app.services.sandbox_worker import read_frame, write_frame
+
+CONFIG = {"cpu_limit": 2, "mem_limit": 2000000000, "timeout": 30, "pool_size": 1, "max_jobs_per_worker": 2}
+
+
+class Config(dict):
+    __getattr__ = dict.get
+
+
+@pytest.fixture
+def config():
+    return Config(CONFIG)
+
+
+@pytest.fixture
+def pool(config):
+    pool = safe_exec.SandboxPool(config)
+    yield pool
+    pool.close()
+
+
+def _df():
+    return pd.DataFrame({'a': [1, 2, 3]})
+
+
+def test_one_shot_sandbox(config):
+    result = safe_exec.run_user_code("print('sum'); result = df['a'].sum()", _df(), config)
+    assert result["ok"]
+    assert result["out"] == "sum\n"
+    assert result["result"] == 6
+
+
+def test_pool_reuses_and_recycles_workers(pool, config):
+    first = pool._idle.queue[0]
+    assert safe_exec.run_user_code("x = 1\nresult = x", _df(), config, pool=pool)["result"] == 1
+    # Every job gets fresh globals
+    result = safe_exec.run_user_code("result = x", _df(), config, pool=pool)
+    assert not result["ok"]
+    assert "NameError" in result["err"]
+    # The failure replaced the worker
+    assert pool._idle.queue[0] is not first
+    assert first.process.poll() is not None
+
+
+def test_pool_keeps_limits_and_import_guard(pool, config):
+    result = safe_exec.run_user_code("import resource", _df(), config, pool=pool)
+    assert "not allowed" in result["err"]
+    result = safe_exec.run_user_code("while True: pass", _df(), config, pool=pool)
+    assert result["err"] == "CPU time limit exceeded"
+    assert result["usage"]["cpu_user_seconds"] + result["usage"]["cpu_sys_seconds"] >= CONFIG["cpu_limit"]
+    result = safe_exec.run_user_code("result = pd.DataFrame({'b': [1]})", _df(), config, pool=pool)
+    assert result["result"]["b"].tolist() == [1]
+
+
+def test_pooled_jobs_do_not_see_each_others_changes(pool, config):
+    first = pool._idle.queue[0]
+    code = "pd.DataFrame.sum = lambda self, *args, **kwargs: 42\nresult = 1"
+    assert safe_exec.run_user_code(code, _df(), config, pool=pool)["ok"]
+    result = safe_exec.run_user_code("result = int(df.sum().iloc[0])", _df(), config, pool=pool)
+    assert result["result"] == 6
+    assert first.jobs == 2
+
+
+def test_jobs_cannot_raise_their_cpu_limit(pool, config):
+    code = "import sys\nresource = sys.modules['resource']\nresult = resource.getrlimit(resource.RLIMIT_CPU)"
+    assert safe_exec.run_user_code(code, _df(), config, pool=pool)["result"] == (2, 2)
+    code = "import sys\nresource = sys.modules['resource']\nresource.setrlimit(resource.RLIMIT_CPU, (100, 100))"
+    assert "ValueError" in safe_exec.run_user_code(code, _df(), config, pool=pool)["err"]
+
+
+def test_processes_left_by_a_job_cannot_reach_the_next_one(pool, config):
+    # Forges a result on every descriptor it has, from outside the job's process group
+    code = """
+import os, pickle, struct, time
+if os.fork() == 0:
+    os.setsid()
+    data = pickle.dumps({"ok": True, "out": "forged", "result_path": "/etc/passwd"})
+    end = time.monotonic() + 2
+    while time.monotonic() < end:
+        for fd in range(64):
+            try:
+                os.write(fd, struct.pack("<Q", len(data)) + data)
+            except OSError:
+                pass
+        time.sleep(0.01)
+    os._exit(0)
+result = 1
+"""
+    assert safe_exec.run_user_code(code, _df(), config, pool=pool)["result"] == 1
+    result = safe_exec.run_user_code("import time\ntime.sleep(0.5)\nresult = 2", _df(), config, pool=pool)
+    assert result["ok"]
+    assert result["result"] == 2
+
+
+def _gone(pid, wait=2):
+    # Killed processes can stay zombies when the container's init does not reap orphans
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                if f.read().rsplit(")", 1)[1].split()[0] in "ZX":
+                    return True
+        except FileNotFoundError:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_jobs_are_killed_with_everything_they_started(pool, tmp_path):
+    pid_file = tmp_path / "pid"
+    start = ("import os, time\npid = os.fork()\nif pid == 0:\n    time.sleep(60)\n    os._exit(0)\n"
+             f"open({str(pid_file)!r}, 'w').write(str(pid))\n")
+    config = Config(CONFIG, timeout=2)
+    assert safe_exec.run_user_code(start + "result = 1", _df(), config, pool=pool)["result"] == 1
+    assert _gone(int(pid_file.read_text()))
+    result = safe_exec.run_user_code(start + "time.sleep(60)", _df(), config, pool=pool)
+    assert result["error"] == "timeout"
+    assert _gone(int(pid_file.read_text()))
+
+
+def test_frames_are_handed_over_as_writable_memory_maps(tmp_path):
+    df = pd.DataFrame({'a': np.arange(5), 'b': list('abcde'), 1: [0.5] * 5, 'mixed': [1, 'x', 2, 3, 4]})
+    path = write_frame(str(tmp_path / "mixed"), df)
+    assert path.endswith(".pickle")
+    path = write_frame(str(tmp_path / "df"), df.drop(columns="mixed"))
+    assert path.endswith(".arrow")
+
+    loaded = read_frame(path)
+    assert loaded.equals(df.drop(columns="mixed"))
+    assert isinstance(loaded['a'].to_numpy().base.base, memoryview)  # A view of the mapped file
+    loaded.loc[0, 'a'] = 100  # Copy-on-write mapping: the file is unchanged
+    assert read_frame(path)['a'].tolist() == list(range(5))
+
+
+def test_frames_go_to_disk_when_shm_is_full(config, tmp_path, monkeypatch):
+    shm = tmp_path / "shm"
+    shm.mkdir()
+    monkeypatch.setattr(safe_exec, "SHM_DIR", str(shm))
+    write = safe_exec.write_frame
+
+    def full(path, obj, chunk_rows=None):
+        if path.startswith(str(shm)):
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return write(path, obj, chunk_rows=chunk_rows)
+
+    monkeypatch.setattr(safe_exec, "write_frame", full)
+    result = safe_exec.run_user_code("result = df['a'].sum()", None, config, frames={"df": _df()}, df_name="df")
+    assert result["result"] == 6
+
+    # A frame that is known not to fit does not even try SHM_DIR
+    assert safe_exec._handoff_dir(_df(), {}, None) == str(shm)
+    monkeypatch.setattr(safe_exec.shutil, "disk_usage", lambda path: types.SimpleNamespace(free=10))
+    assert safe_exec._handoff_dir(_df(), {}, None) is None
+
+
+def test_frame_results_come_back_from_the_sandbox(config):
+    result = safe_exec.run_user_code("df['a'] *= 2\nresult = df", _df(), config)
+    assert result["result"].equals(pd.DataFrame({'a': [2, 4, 6]}))
+    result = safe_exec.run_user_code("result = df['a'].rename('b')", _df(), config)
+    assert result["result"].name == 'b'
+
+
+def test_frames_are_exported_only_when_the_code_uses_them(config):
+    frames = {"df_te": pd.DataFrame({'id': [1, 2], 'te': [3, 4]}), "df_pr": pd.DataFrame({'id': [1, 2], 'pr': [5, 6]}),
+              "unused": pd.DataFrame({'x': [0]})}
+    code = "result = df_te.merge(dataframes['df_pr'], on='id')"
+    result = safe_exec.run_user_code(code, None, config, frames=frames, df_name="df_te")
+    assert result["result"].columns.tolist() == ['id', 'te', 'pr']
+    assert sorted(result["frames_loaded"]) == ["df_pr", "df_te"]
+
+    result = safe_exec.run_user_code("result = sorted(dataframes)", None, config, frames=frames, df_name="df_te")
+    assert result["result"] == ["df_pr", "df_te", "unused"]
+    assert result["frames_loaded"] == []
+
+
+def test_executions_report_their_resource_usage(pool, config):
+    frames = {"big": pd.DataFrame({'a': np.arange(10**6)})}
+    code = "x = np.ones(10**7)\nresult = big.head(3)"
+    usage = safe_exec.run_user_code(code, None, config, pool=pool, frames=frames)["usage"]
+    assert usage["bytes_in"] >= 8 * 10**6
+    assert 0 < usage["bytes_out"] < usage["bytes_in"]
+    assert usage["peak_rss_bytes"] > 8 * 10**7
+    assert usage["wall_seconds"] >= usage["code_seconds"] > 0
+    assert {"cpu_user_seconds", "cpu_sys_seconds", "load_seconds", "export_seconds", "result_read_seconds"} <= set(usage)
+
+    usage = safe_exec.run_user_code("import time\ntime.sleep(5)", None, Config(CONFIG, timeout=1), pool=pool)["usage"]
+    assert usage["wall_seconds"] >= 1
+
+
+def test_plots_are_downsampled_and_moved_out_of_the_sandbox(config, tmp_path):
+    config = Config(CONFIG, plots={"format": "svg", "dpi": 50, "max_points": 1000})
+    code = (
+        "y = np.sin(np.arange(1_000_000) / 1000.0)\ny[123_456] = 5\n"
+        "plt.plot(y)\nplt.figure()\nplt.scatter(np.arange(5000), np.arange(5000))"
+    )
+    result = safe_exec.run_user_code(code, _df(), config, plots_dir=str(tmp_path))
+    assert result["ok"], result
+    assert result["downsampled"] == 2
+    assert [p.endswith(".svg") and p.startswith(str(tmp_path)) for p in result["plots"]] == [True, True]
+    assert all((tmp_path / p.rsplit("/", 1)[-1]).exists() for p in result["plots"])
+
+
+def test_paths_reported_by_the_sandbox_must_be_inside_it(config, tmp_path):
+    outside, plots = tmp_path / "outside", tmp_path / "plots"
+    outside.mkdir()
+    plots.mkdir()
+    (outside / "secret.txt").write_text("secret")
+    # User code can patch the worker, and so the paths it reports, to point at any file of the server
+    code = (
+        "import sys\nworker = sys.modules['__main__']\nresult = 1\n"
+        f"worker.save_figures = lambda workdir, settings: ([{str(outside / 'secret.txt')!r}], 0)\n"
+        f"worker.JobUsage.write = lambda self, path, obj: {str(outside / 'secret.txt')!r}"
+    )
+    result = safe_exec.run_user_code(code, _df(), config, plots_dir=str(plots))
+    assert not result["ok"]
+    assert result["err"] == "Sandbox returned an invalid result path"
+    assert result["plots"] == []
+    assert list(plots.iterdir()) == []
+    assert (outside / "secret.txt").read_text() == "secret"
+
+    assert safe_exec.sandbox_file(str(tmp_path), str(outside / "secret.txt"), safe_exec.PLOT_FILE) is None
+    link = tmp_path / f"plot_{'0' * 32}.png"
+    link.symlink_to(outside / "secret.txt")
+    assert safe_exec.sandbox_file(str(tmp_path), str(link), safe_exec.PLOT_FILE) is None
+
+
+def test_minmax_decimation_keeps_extremes():
+    from app.services import sandbox_worker
+    sandbox_worker.libs.np = np
+    y = np.zeros(100_000)
+    y[777], y[54_321] = 9.0, -9.0
+    indices = sandbox_worker.minmax_indices(y, 100)
+    assert len(indices) <= 102
+    assert {777, 54_321, 0, 99_999} <= set(indices.tolist())
+    assert (np.diff(indices) > 0).all()
+
+
+def test_chunked_mode_combines_the_results_of_every_chunk(config):
+    from app.services.code_analysis import chunk_plan
+    df = pd.DataFrame({"k": np.arange(1000) % 3, "v": np.arange(1000.0)})
+    code = "result = df[df['v'] > 10].groupby('k')['v'].mean()"
+    plan = dict(chunk_plan(code), chunk_rows=300)
+    result = safe_exec.run_user_code(code, df, config, chunked=plan)
+    assert result["ok"], result
+    assert result["usage"]["chunks"] == 4
+    pd.testing.assert_series_equal(result["result"], df[df['v'] > 10].groupby('k')['v'].mean())
+
+
+def test_parallel_helpers_match_their_serial_equivalents(config):
+    config = Config(CONFIG, parallel_processes=3)
+    df = pd.DataFrame({"k": np.arange(300) % 7, "v": np.arange(300.0)})
+    result = safe_exec.run_user_code("result = parallel_apply(df, lambda part: part['v'] * 2)", df, config)
+    assert result["ok"], result
+    assert result["usage"]["parallel_tasks"] == 3
+    pd.testing.assert_series_equal(result["result"], df["v"] * 2)
+
+    result = safe_exec.run_user_code("result = parallel_groupby(df, 'k', lambda g: g.nlargest(2, 'v'))", df, config)
+    pd.testing.assert_frame_equal(result["result"], df.groupby("k").apply(lambda g: g.nlargest(2, "v")))
+
+    result = safe_exec.run_user_code("result = parallel_apply(df, lambda part: 1 / 0)", df, config)
+    assert not result["ok"] and "ZeroDivisionError" in result["err"]
@@ -0,0 +1,270 @@
+import os
+import pyarrow as pa
+import yaml
+import numpy as np
+import pandas as pd
+import pytest
+from app.services.storage_service import StorageService
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return StorageService(str(tmp_path / "storage"))
+
+
+def _blob_count(storage):
+    return len(os.listdir(storage.blobs_dir))
+
+
+def test_save_and_load_latest_state(storage):
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    storage.save_state({"df": df})
+    state = storage.get_latest_state()
+    assert list(state) == ["df"]
+    assert df.equals(state["df"])
+
+
+def test_unchanged_frames_are_written_once(storage):
+    big = pd.DataFrame({'a': range(1000)})
+    small = pd.DataFrame({'b': [1, 2, 3]})
+    storage.save_state({"big": big, "small": small})
+    blobs = _blob_count(storage)
+
+    # Renaming only writes a new manifest
+    storage.save_state({"big": big, "renamed": small})
+    assert _blob_count(storage) == blobs
+
+    # An equal frame loaded from elsewhere maps to the same blobs
+    storage.save_state({"big": big.copy(), "renamed": small})
+    assert _blob_count(storage) == blobs
+
+
+def test_pop_state_returns_previous_state(storage):
+    first = pd.DataFrame({'a': [1]})
+    second = pd.DataFrame({'a': [2]})
+    storage.save_state({"df": first})
+    storage.save_state({"df": second})
+    state = storage.pop_state()
+    assert first.equals(state["df"])
+    assert storage.pop_state() is None
+
+
+def test_columnar_blobs_with_pickle_fallback(storage):
+    storage.configure({"format": "arrow"})
+    columnar = pd.DataFrame({'a': [1, 2], 'b': [0.5, 1.5]})
+    mixed = pd.DataFrame({'a': [1, 'x']})  # Arrow cannot hold mixed-type object columns
+    storage.save_state({"columnar": columnar, "mixed": mixed})
+    entries = dict(storage.get_latest_state().raw_items())
+    assert all(blob.endswith(".arrow") for blob in entries["columnar"].entry["columns"])
+    assert entries["mixed"].entry["columns"][0].endswith(".pkl")
+
+    state = StorageService(storage.storage_dir).get_latest_state()
+    assert columnar.equals(state["columnar"])
+    assert mixed.equals(state["mixed"])
+
+
+def test_columns_that_do_not_survive_arrow_are_pickled(storage):
+    storage.configure({"format": "arrow"})
+    timestamps = [pd.Timestamp("2024-01-01", tz=tz) for tz in ("UTC", "Europe/Berlin")]
+    df = pd.DataFrame({
+        'sparse': pd.arrays.SparseArray([0, 1]),
+        'lists': [[1], [2, 3]],
+        'timezones': pd.Series(timestamps, dtype=object),
+        'plain': [1, 2],
+    })
+    storage.save_state({"df": df})
+    blobs = dict(storage.get_latest_state().raw_items())["df"].entry["columns"]
+    assert [blob.rsplit(".", 1)[-1] for blob in blobs] == ["pkl", "pkl", "pkl", "arrow"]
+
+    restored = StorageService(storage.storage_dir).get_latest_state()["df"]
+    pd.testing.assert_frame_equal(restored, df)
+    assert isinstance(restored['lists'][0], list)
+
+
+def test_object_columns_with_equal_strings_but_different_types(storage):
+    left = pd.Series([1, '2'], dtype=object)
+    right = pd.Series(['1', 2], dtype=object)
+    assert storage.fingerprint(left) != storage.fingerprint(right)
+
+    storage.save_state({"left": left, "right": right})
+    state = StorageService(storage.storage_dir).get_latest_state()
+    assert state["left"].tolist() == [1, '2']
+    assert state["right"].tolist() == ['1', 2]
+
+
+def test_latest_state_is_hydrated_lazily(storage):
+    storage.save_state({"a": pd.DataFrame({'x': [1, 2, 3]}), "b": pd.DataFrame({'y': ['u']})})
+    state = StorageService(storage.storage_dir).get_latest_state()
+    assert list(state) == ["a", "b"]
+    assert not state.is_loaded("a")
+    assert state.info("a")["shape"] == [3, 1]
+
+    state.rename("b", "c")
+    assert not state.is_loaded("c")
+    assert state["a"]["x"].tolist() == [1, 2, 3]
+    assert state.is_loaded("a")
+    assert not state.is_loaded("c")
+
+
+def test_version_index_supports_checkout_and_survives_restart(storage):
+    storage.save_state({"df": pd.DataFrame({'a': [1]})})
+    first = storage.get_head()
+    storage.save_state({"df": pd.DataFrame({'a': [2]})})
+    storage.save_state({"df": pd.DataFrame({'a': [3]})})
+
+    versions = storage.list_versions()
+    assert [v["parent"] for v in versions] == [None, versions[0]["id"], versions[1]["id"]]
+
+    state = storage.checkout(first)
+    assert state["df"]["a"].tolist() == [1]
+    assert storage.checkout("missing") is None
+
+    reopened = StorageService(storage.storage_dir)
+    assert reopened.get_head() == first
+    assert len(reopened.list_versions()) == 3
+    assert reopened.pop_state() is None
+
+
+def test_write_behind_coalesces_and_flushes(storage):
+    storage.configure({"write_behind": True})
+    for i in range(5):
+        storage.save_state({"df": pd.DataFrame({'a': [i]})})
+    storage.flush()
+    versions = storage.list_versions()
+    assert 1 <= len(versions) <= 5
+    assert storage.get_latest_state()["df"]["a"].tolist() == [4]
+
+
+def test_write_behind_with_automatic_compaction(storage):
+    storage.configure({"write_behind": True, "compact_every": 1, "retention": {"keep_last": 2, "hourly": 0, "daily": 0}})
+    for i in range(5):
+        storage.save_state({"df": pd.DataFrame({'a': [i]})})
+        storage.flush()
+    assert storage.health() == "OK"
+    assert len(storage.list_versions()) == 2
+    assert storage.get_latest_state()["df"]["a"].tolist() == [4]
+
+
+def test_compaction_keeps_recent_versions_and_collects_blobs(storage):
+    storage.configure({"retention": {"keep_last": 2, "hourly": 0, "daily": 0}})
+    for i in range(5):
+        storage.save_state({"df": pd.DataFrame({'a': [i]})})
+    blobs = _blob_count(storage)
+
+    result = storage.compact()
+    assert result["versions_removed"] == 3
+    assert _blob_count(storage) == blobs - 3
+    versions = storage.list_versions()
+    assert versions[0]["parent"] is None
+    assert storage.pop_state()["df"]["a"].tolist() == [3]
+    assert len(StorageService(storage.storage_dir).usage()["versions"]) == 2
+
+
+def test_frames_are_written_again_after_their_blobs_are_collected(storage):
+    storage.configure({"retention": {"keep_last": 1, "hourly": 0, "daily": 0}})
+    df = pd.DataFrame({'a': [1, 2]})
+    storage.save_state({"df": df})
+    storage.save_state({"other": pd.DataFrame({'b': [3]})})
+    storage.compact()
+
+    storage.save_state({"df": df})
+    restored = StorageService(storage.storage_dir).get_latest_state()["df"]
+    assert df.equals(restored)
+
+
+def test_unchanged_columns_are_shared_between_versions(storage):
+    df = pd.DataFrame({'a': range(1000), 'b': [float(i) for i in range(1000)]})
+    storage.save_state({"df": df})
+    blobs = _blob_count(storage)
+
+    derived = df.copy()
+    derived['c'] = derived['a'] * 2
+    storage.save_state({"df": derived})
+    # One new column plus the new column names
+    assert _blob_count(storage) == blobs + 2
+
+    latest = storage.get_latest_state()["df"]
+    previous = storage.pop_state()["df"]
+    assert latest.equals(derived)
+    assert np.shares_memory(latest['a'].to_numpy(), previous['a'].to_numpy())
+
+
+def test_workspace_evicts_least_recently_used_frames(storage):
+    frames = {name: pd.DataFrame({'a': np.arange(1000)}) for name in ("a", "b", "c")}
+    storage.save_state(frames)
+    state = storage.get_latest_state()
+    state.memory_budget = 2 * 8000 + 500
+
+    for name in ("a", "b", "c"):
+        state[name]
+    assert list(state.memory_usage()) == ["b", "c"]
+    assert not state.is_loaded("a")
+
+    state["b"]
+    state["a"]
+    assert list(state.memory_usage()) == ["b", "a"]
+    assert state["c"]["a"].tolist() == list(range(1000))
+
+
+@pytest.mark.parametrize("storage_format", ["arrow", "parquet", "pickle"])
+def test_snapshots_with_different_codecs_are_read_together(storage, storage_format):
+    df = pd.DataFrame({'a': range(100), 'b': ['text'] * 100})
+    storage.configure({"format": storage_format, "compression": {"codec": "zstd", "level": 3}})
+    storage.save_state({"df": df})
+    storage.configure({"compression": {"codec": "lz4"}})
+    storage.save_state({"df": df, "other": df.assign(c=1.5)})
+    storage.configure({"compression": {"codec": "none"}})
+    storage.save_state({"df": df, "other": df.assign(c=1.5), "more": df.assign(d='x')})
+
+    state = StorageService(storage.storage_dir).get_latest_state()
+    assert state["df"].equals(df)
+    assert state["more"].equals(df.assign(d='x'))
+    assert [v["codec"] for v in storage.list_versions()] == ["zstd", "lz4", "none"]
+
+
+def test_default_config_keeps_arrow_blobs_memory_mapped(storage):
+    config_path = os.path.join(os.path.dirname(__file__), "..", "app", "conf", "config.yaml")
+    with open(config_path) as f:
+        storage.configure(dict(yaml.safe_load(f)["storage"], fsync=False))
+    storage.save_state({"df": pd.DataFrame({'a': np.arange(100_000)})})
+
+    # Compressed blobs are decompressed into buffers allocated by Arrow; mapped ones are not copied at all
+    allocated = pa.total_allocated_bytes()
+    df = StorageService(storage.storage_dir).get_latest_state()["df"]
+    assert df['a'].sum() == 4999950000
+    assert pa.total_allocated_bytes() - allocated < 100_000 * 8
+
+
+def test_renames_and_removals_are_journal_records(storage):
+    df = pd.DataFrame({'a': range(10)})
+    storage.save_state({"df": df, "other": df.assign(b=1)})
+    storage.save_state({"other": df.assign(b=1), "renamed": df})
+    storage.save_state({"renamed": df})
+    manifests = [f for f in os.listdir(storage.storage_dir) if f.startswith("state_")]
+    assert len(manifests) == 1
+    assert [op["op"] for op in storage.list_versions()[-1]["ops"]] == ["remove"]
+
+    state = StorageService(storage.storage_dir).get_latest_state()
+    assert list(state) == ["renamed"]
+    assert state["renamed"].equals(df)
+    assert list(storage.pop_state()) == ["other", "renamed"]
+
+
+def test_torn_journal_write_is_truncated_on_recovery(storage):
+    storage.save_state({"df": pd.DataFrame({'a': [1]})})
+    storage.save_state({"df": pd.DataFrame({'a': [2]})})
+    with open(storage.index_path, "ab") as f:
+        f.write(b'{"op": "commit", "id": "99", "par')
+
+    recovered = StorageService(storage.storage_dir)
+    assert recovered.get_latest_state()["df"]["a"].tolist() == [2]
+    recovered.save_state({"df": pd.DataFrame({'a': [3]})})
+    assert len(StorageService(storage.storage_dir).list_versions()) == 3
+
+
+def test_checkpoints_are_written_periodically(storage):
+    storage.configure({"checkpoint_every": 3})
+    for i in range(7):
+        storage.save_state({"df": pd.DataFrame({'a': [i]})})
+    assert ["manifest" in v for v in storage.list_versions()] == [True, False, False, True, False, False, True]
+    assert StorageService(storage.storage_dir).checkout(storage.list_versions()[5]["id"])["df"]["a"].tolist() == [5]
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+from app.services import dataframe_service as dataframe_module
+from app.services.dataframe_service import DataFrameService
+from app.services.storage_service import StorageService
+from app.services.workspace import FrameRef, Workspace, describe_frame
+
+
+class VectorStore:
+    def add_dataframe_schema(self, name, schema_text):
+        pass
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataframe_module, "storage_service", StorageService(str(tmp_path / "storage")))
+    service = DataFrameService()
+    service.set_vector_store(VectorStore())
+    return service
+
+
+def test_frames_saved_into_a_fresh_service_are_reloaded_after_eviction(service):
+    first = pd.DataFrame({'a': range(1000)})
+    service.configure({"memory_budget": describe_frame(first)["nbytes"] + 1})
+    service.add_dataframe("first", first)
+    service.add_dataframe("second", pd.DataFrame({'b': range(1000)}))
+    assert not service.dataframes.is_loaded("first")
+    assert service.get_dataframe("first").equals(first)
+
+
+def test_sizes_count_the_strings_of_object_columns(service):
+    df = pd.DataFrame({'s': pd.Series([f"some text {i}" for i in range(10_000)], dtype=object)})
+    nbytes = describe_frame(df)["nbytes"]
+    assert nbytes > 4 * df.memory_usage(index=True).sum()
+
+    service.add_dataframe("df", df)
+    assert service.get_dataframe_info("df")["nbytes"] == nbytes
+    workspace = Workspace(entries={"df": df})
+    assert workspace.info("df")["nbytes"] == workspace.memory_usage()["df"] == nbytes
+
+
+def test_persisted_snapshots_update_the_workspace_only_while_it_holds_the_same_frame():
+    old, new = pd.DataFrame({'a': [1]}), pd.DataFrame({'a': [2]})
+    workspace = Workspace(entries={"kept": old, "replaced": old})
+    snapshot = workspace.snapshot()
+    workspace["replaced"] = new
+    # As the storage writer thread does, while requests keep using the workspace
+    for name in snapshot:
+        snapshot.mark_persisted(name, FrameRef({"blob": name}))
+    assert isinstance(workspace.raw("kept"), FrameRef)
+    assert workspace.raw("replaced") is new